@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+图片预处理微基准
+在一组分辨率上生成测试图片，比较当前的 get_image_url 与最初的预处理实现
+（先打开读尺寸、再由 compress_image 重新打开并完整解码，大图 NEAREST 缩放，JPEG 质量逐档下调）
+
+- 两种流程交替运行，报告每张图片耗时的中位数与 JPEG 编码次数
+- --max-file-mb 调小体积上限时可观察质量搜索的编码次数（默认上限下多数图片一次编码即可）
+- --throughput 时改为比较预处理后端：thread / process 各用 1 个与全部可用核数并发处理同一批图片，
+  报告每秒图片数与每核每秒图片数（进程池启动与预热不计入）
+- --rss 时每种流程在独立子进程中处理一次，报告相对空载子进程的峰值 RSS 增量（仅 Linux/macOS）
+
+用法: python scripts/bench_preprocess.py [--repeat N] [--seconds S] [--sizes 640x480,4032x3024] [--max-file-mb MB] [--rss]
+      python scripts/bench_preprocess.py --throughput [--images N] [--sizes 4032x3024]
+"""
+
+import argparse
+import base64
+import io
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 修复Windows控制台编码问题
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# 添加项目根目录与 src 到路径
+project_root = Path(__file__).resolve().parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from backend.core.config import DEFAULT_MAX_IMAGE_SIZE, DEFAULT_MAX_FILE_SIZE_MB  # noqa: E402
+from backend.core.local import image_utils  # noqa: E402
+from backend.core.local.preprocess_pool import (  # noqa: E402
+    BACKEND_PROCESS, PREPROCESS_BACKENDS, PreprocessPool, available_cores,
+)
+
+DEFAULT_SIZES = "640x480,1280x960,2048x1536,4032x3024,6000x4000"
+
+
+def make_image(path: Path, size: tuple[int, int]) -> None:
+    """生成带噪声与文字块的测试图（接近拍照文档，JPEG 压缩率与真实照片相近）"""
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    img = Image.merge("RGB", [Image.linear_gradient("L").resize(size), noise.getchannel(0), noise.getchannel(1)])
+    draw = ImageDraw.Draw(img)
+    step = max(20, size[1] // 40)
+    for y in range(step, size[1] - step, step):
+        draw.rectangle((size[0] // 10, y, size[0] * 9 // 10, y + step // 3), fill=(20, 20, 20))
+    img = img.filter(ImageFilter.SMOOTH)
+    if path.suffix == ".png":
+        img.save(path)
+    else:
+        img.save(path, quality=92)
+
+
+def _baseline_compress(image_path: Path, max_size, max_file_size_mb, stats: dict) -> bytes:
+    """最初的 compress_image：完整解码，大图 NEAREST、其它 BILINEAR，质量逐档下调（stats 记录编码次数）"""
+    with Image.open(image_path) as img:
+        file_size_mb = image_path.stat().st_size / (1024 * 1024)
+        is_large_image = img.size[0] * img.size[1] > 4000000
+        if img.size[0] > max_size[0] or img.size[1] > max_size[1] or file_size_mb > max_file_size_mb:
+            ratio = min(max_size[0] / img.size[0], max_size[1] / img.size[1])
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            resample_method = Image.Resampling.NEAREST if is_large_image else Image.Resampling.BILINEAR
+            img = img.resize(new_size, resample_method)
+        if img.mode in ("RGBA", "LA", "P"):
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            if img.mode == "P":
+                img = img.convert("RGBA")
+            background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        quality = 85 if not is_large_image else 75
+        img.save(buffer, format="JPEG", quality=quality, optimize=False)
+        stats["encodes"] = 1
+        while buffer.tell() / (1024 * 1024) > max_file_size_mb and quality > 30:
+            quality -= 10 if is_large_image else 5
+            buffer.seek(0)
+            buffer.truncate(0)
+            img.save(buffer, format="JPEG", quality=quality, optimize=False)
+            stats["encodes"] += 1
+        stats["quality"] = quality
+        return buffer.getvalue()
+
+
+def baseline_image_url(image_path: Path, max_image_size, max_file_size_mb, stats: dict) -> str:
+    """最初的 get_image_url：exists/is_file + 缓存键各 stat 一次，打开读尺寸后重新打开完整解码"""
+    cache = image_utils._IMAGE_CACHE
+    cache.clear()
+    if not image_path.exists() or not image_path.is_file():
+        raise FileNotFoundError(image_path)
+    if cache.get(image_path, max_image_size, max_file_size_mb, True) is not None:
+        raise AssertionError("缓存应为空")
+    with Image.open(image_path) as img:
+        file_size_mb = image_path.stat().st_size / (1024 * 1024)
+        needs_compression = img.size[0] > max_image_size[0] or img.size[1] > max_image_size[1] or file_size_mb > 0.5
+    if needs_compression:
+        data = _baseline_compress(image_path, max_image_size, max_file_size_mb, stats)
+        url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+    else:
+        stats["encodes"] = 0
+        url = image_utils.encode_image_to_base64(image_path, image_utils.get_image_mime_type(image_path))
+    cache.put(image_path, max_image_size, max_file_size_mb, True, url)
+    return url
+
+
+def current_image_url(image_path: Path, max_image_size, max_file_size_mb, stats: dict) -> str:
+    image_utils._IMAGE_CACHE.clear()
+    return image_utils.get_image_url(image_path, max_image_size, max_file_size_mb, True, verbose=False, stats=stats)
+
+
+VARIANTS = {"baseline": baseline_image_url, "current": current_image_url}
+
+
+def time_pair(image_path: Path, max_file_size_mb: float, min_seconds: float, min_repeat: int) -> dict[str, tuple]:
+    """两种流程交替运行，直到累计耗时达到 min_seconds，取中位数（毫秒），减少调度抖动与顺序偏差
+
+    返回 {流程: (耗时中位数ms, stats)}，stats 为最后一次运行的编码次数与质量。
+    """
+    times: dict[str, list[float]] = {name: [] for name in VARIANTS}
+    stats: dict[str, dict] = {}
+    start = time.perf_counter()
+    while len(times["baseline"]) < min_repeat or time.perf_counter() - start < min_seconds:
+        for name, fn in VARIANTS.items():
+            stats[name] = {}
+            t0 = time.perf_counter()
+            fn(image_path, DEFAULT_MAX_IMAGE_SIZE, max_file_size_mb, stats[name])
+            times[name].append((time.perf_counter() - t0) * 1000)
+    return {name: (statistics.median(times[name]), stats[name]) for name in VARIANTS}
+
+
+def peak_rss_mb(variant: str, image_path: Path, max_file_size_mb: float) -> float:
+    """在子进程中处理一次，返回峰值 RSS（MB）"""
+    out = subprocess.run(
+        [sys.executable, __file__, "--rss-child", variant, str(image_path), f"--max-file-mb={max_file_size_mb}"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def _rss_child(variant: str, image_path: str, max_file_size_mb: float) -> None:
+    import resource
+
+    if variant in VARIANTS:
+        VARIANTS[variant](Path(image_path), DEFAULT_MAX_IMAGE_SIZE, max_file_size_mb, {})
+    # Linux 的 ru_maxrss 会跨 fork/exec 继承父进程的峰值，改读本进程地址空间的 VmHWM
+    status = Path("/proc/self/status")
+    if status.is_file():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                print(int(line.split()[1]) / 1024)
+                return
+    # macOS 的 ru_maxrss 单位为字节
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024))
+
+
+def measure_throughput(paths: list[Path], backend: str, workers: int, max_file_size_mb: float) -> float:
+    """按后端以 workers 路并发预处理整批图片（不走缓存），返回每秒图片数（墙钟）"""
+    pool = PreprocessPool(workers) if backend == BACKEND_PROCESS else None
+
+    def run(path: Path) -> str:
+        image_utils._IMAGE_CACHE.clear()
+        return image_utils.get_image_url(path, DEFAULT_MAX_IMAGE_SIZE, max_file_size_mb, True, verbose=False, pool=pool)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 预热一轮：启动工作进程、导入 Pillow
+            list(executor.map(run, paths[:workers]))
+            t0 = time.perf_counter()
+            list(executor.map(run, paths))
+            return len(paths) / (time.perf_counter() - t0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _throughput_main(args) -> None:
+    cores = available_cores()
+    size = tuple(int(v) for v in args.sizes.split(",")[0].lower().split("x"))
+    print(f"cores={cores} images={args.images} size={size[0]}x{size[1]} max_file_size_mb={args.max_file_mb}")
+    print(f"{'后端':<10}{'并发':>6}{'图片/秒':>10}{'图片/核·秒':>12}")
+    with tempfile.TemporaryDirectory(prefix="bench_preprocess_") as tmp:
+        # 图片内容各不相同，避免命中任何缓存
+        paths = []
+        for i in range(args.images):
+            path = Path(tmp) / f"img{i}.jpg"
+            make_image(path, (size[0] + i % 7, size[1]))
+            paths.append(path)
+        for backend in PREPROCESS_BACKENDS:
+            for workers in sorted({1, cores}):
+                rate = measure_throughput(paths, backend, workers, args.max_file_mb)
+                print(f"{backend:<10}{workers:>6}{rate:>10.2f}{rate / workers:>12.2f}")
+
+
+def _format_encodes(stats: dict) -> str:
+    if not stats.get("encodes"):
+        return "0"
+    return f"{stats['encodes']}(q{stats.get('quality')})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="图片预处理微基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每种图片最少重复次数")
+    parser.add_argument("--seconds", type=float, default=1.0, help="每种图片最少累计运行秒数")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="分辨率列表，如 640x480,4032x3024")
+    parser.add_argument("--formats", default="jpg,png", help="测试图片格式")
+    parser.add_argument("--max-file-mb", type=float, default=DEFAULT_MAX_FILE_SIZE_MB, help="压缩后体积上限（MB）")
+    parser.add_argument("--rss", action="store_true", help="另在子进程中测量峰值 RSS 增量")
+    parser.add_argument("--throughput", action="store_true", help="比较 thread / process 预处理后端的吞吐")
+    parser.add_argument("--images", type=int, default=24, help="--throughput 时的图片张数")
+    parser.add_argument("--rss-child", nargs=2, metavar=("VARIANT", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.rss_child:
+        _rss_child(*args.rss_child, args.max_file_mb)
+        return
+    if args.throughput:
+        if args.sizes == DEFAULT_SIZES:
+            args.sizes = "4032x3024"
+        _throughput_main(args)
+        return
+    measure_rss = args.rss and sys.platform != "win32"
+
+    sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.sizes.split(",") if s]
+    formats = [f.strip().lstrip(".") for f in args.formats.split(",") if f.strip()]
+    print(f"max_image_size={DEFAULT_MAX_IMAGE_SIZE} max_file_size_mb={args.max_file_mb} repeat={args.repeat}")
+    header = f"{'图片':<16}{'文件MB':>8}{'原实现ms':>12}{'当前ms':>10}{'节省%':>8}{'编码次数(质量)':>22}"
+    if measure_rss:
+        header += f"{'原实现RSS+MB':>14}{'当前RSS+MB':>12}"
+    print(header)
+    with tempfile.TemporaryDirectory(prefix="bench_preprocess_") as tmp:
+        idle_rss = peak_rss_mb("none", Path(tmp), args.max_file_mb) if measure_rss else 0.0
+        for fmt in formats:
+            for size in sizes:
+                path = Path(tmp) / f"{size[0]}x{size[1]}.{fmt}"
+                make_image(path, size)
+                result = time_pair(path, args.max_file_mb, args.seconds, args.repeat)
+                (baseline, baseline_stats), (current, current_stats) = result["baseline"], result["current"]
+                encodes = f"{_format_encodes(baseline_stats)} -> {_format_encodes(current_stats)}"
+                line = (f"{path.name:<16}{path.stat().st_size / 1048576:>8.2f}{baseline:>12.2f}{current:>10.2f}"
+                        f"{(baseline - current) / baseline * 100:>7.1f}%{encodes:>22}")
+                if measure_rss:
+                    line += (f"{peak_rss_mb('baseline', path, args.max_file_mb) - idle_rss:>14.1f}"
+                             f"{peak_rss_mb('current', path, args.max_file_mb) - idle_rss:>12.1f}")
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@
 - 支持：
   - 直接通过 --provider / --model 指定厂商与模型
   - 使用 --select 交互式选择厂商与模型
+  - 使用 --fanout 让多个模型处理同一批图片并生成对比汇总
 - 主要依赖：
   - src.config_loader.PROVIDERS: 从 config/models.yml 读取厂商与模型列表
   - src.processor.run_pipeline: 执行实际的图片批处理与模型调用
@@ -26,9 +27,16 @@ from backend.core.config import (
     DEFAULT_MAX_RETRIES,
     DEFAULT_RETRY_DELAY,
     DEFAULT_MAX_WORKERS,
+    DEFAULT_PREPROCESS_LOOKAHEAD,
+    DEFAULT_PACK_SIZE,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_JOB_DEADLINE,
+    DEFAULT_OUTPUT_LAYOUT,
+    DEFAULT_PREPROCESS_BACKEND,
     console,
 )
 from backend.core.config_loader import get_providers
+from backend.core.local.fanout import parse_model_targets
 from backend.core.processor import run_pipeline
 from backend.util import project_root as get_project_root
 
@@ -85,6 +93,34 @@ def build_parser() -> argparse.ArgumentParser:
     p.add_argument("--disable-compression", action="store_true", help="禁用图片压缩")
     p.add_argument("--no-verbose", action="store_true", help="关闭详细日志")
     p.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发线程数，1为串行")
+    p.add_argument("--preprocess-lookahead", type=int, default=DEFAULT_PREPROCESS_LOOKAHEAD,
+                   help="流式模式下提前预处理的图片张数，0为关闭流水线")
+    p.add_argument("--preprocess-backend", choices=["thread", "process"], default=DEFAULT_PREPROCESS_BACKEND,
+                   help="预处理后端：thread 线程池（默认）；process 按 CPU 核数启动进程池压缩图片，多核下不受 GIL 限制")
+    p.add_argument("--adaptive-concurrency", action="store_true",
+                   help="按端点健康状况自动调整并发（AIMD），--max-workers 作为上限")
+    p.add_argument("--early-stop", action="store_true",
+                   help="流式输出中出现完整 JSON 后立即结束该请求，跳过模型追加的说明文字")
+    p.add_argument("--resume", action="store_true",
+                   help="断点续跑：跳过上次已成功处理的图片（内容、提示词、模型均相同），只重跑失败/缺失的")
+    p.add_argument("--no-cache", action="store_true",
+                   help="不读取结果缓存，所有图片都重新请求模型（新结果仍会写入缓存）")
+    p.add_argument("--pack-size", type=int, default=DEFAULT_PACK_SIZE,
+                   help="多图打包：每个请求携带的图片数（>1 时启用，适合大量小截图；解析失败的图片自动回退为单图请求）")
+    p.add_argument("--hedge", action="store_true",
+                   help="对冲请求（仅流式）：首个 token 超过最近 TTFT 的百分位阈值仍未到达时再发一份请求，先出 token 的一路胜出")
+    p.add_argument("--hedge-percentile", type=float, default=DEFAULT_HEDGE_PERCENTILE,
+                   help="对冲阈值所用的 TTFT 百分位（默认 %(default)s）")
+    p.add_argument("--hedge-model", default=None,
+                   help="对冲请求使用的备用模型名（同一 API Base），默认与主请求相同")
+    p.add_argument("--deadline", type=float, default=DEFAULT_JOB_DEADLINE, metavar="SECONDS",
+                   help="任务截止时间（秒）：超时后取消剩余图片并关闭在途请求，0 表示不限")
+    p.add_argument("--output-layout", choices=["files", "run"], default=DEFAULT_OUTPUT_LAYOUT,
+                   help="输出布局：files 每张图片一个结果 JSON（默认）；run 每次运行一个 runs/<run_id>/ 目录，"
+                        "结果追加到 results.jsonl")
+    p.add_argument("--fanout", default=None, metavar="PROVIDER:MODEL[,...]",
+                   help="多模型对比：与 --provider/--model 一起处理同一批图片（预处理只做一次），"
+                        "另写对比汇总到 data/outputs/_fanout/")
     p.add_argument("--select", action="store_true", help="运行时交互选择厂商与模型")
     p.add_argument("--api-base", dest="api_base", default=None, help="覆盖模型/厂商默认的 API Base URL")
     p.add_argument("--timeout", type=float, default=60.0, help="请求超时秒数")
@@ -107,6 +143,13 @@ def main(argv: Optional[list[str]] = None) -> None:
     provider_key = args.provider
     model_key = args.model
 
+    fanout_models = None
+    if args.fanout:
+        try:
+            fanout_models = parse_model_targets(args.fanout)
+        except ValueError as e:
+            p.error(f"--fanout: {e}")
+
     # 读取上次选择
     last_provider, last_model = load_last_choice()
 
@@ -190,6 +233,19 @@ def main(argv: Optional[list[str]] = None) -> None:
         enable_compression=not args.disable_compression,
         verbose=not args.no_verbose,
         max_workers=args.max_workers,
+        preprocess_lookahead=args.preprocess_lookahead,
+        adaptive_concurrency=args.adaptive_concurrency,
+        early_stop=args.early_stop,
+        resume=args.resume,
+        use_cache=not args.no_cache,
+        pack_size=args.pack_size,
+        hedge=args.hedge,
+        hedge_percentile=args.hedge_percentile,
+        hedge_model=args.hedge_model,
+        fanout_models=fanout_models,
+        deadline=args.deadline,
+        output_layout=args.output_layout,
+        preprocess_backend=args.preprocess_backend,
     )
 
 
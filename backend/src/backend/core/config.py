@@ -100,6 +100,46 @@ DEFAULT_RETRY_DELAY = 5
 DEFAULT_ENABLE_COMPRESSION = True
 DEFAULT_VERBOSE = True
 DEFAULT_MAX_WORKERS = 1
+# 流式模式下预处理流水线的前瞻窗口：请求第 k 张时提前压缩第 k+1..k+W 张，0 表示关闭
+DEFAULT_PREPROCESS_LOOKAHEAD = 2
+# 预处理后端："thread" 在线程池中压缩（默认）；"process" 在按 CPU 核数创建的进程池中压缩，多核下不受 GIL 限制
+DEFAULT_PREPROCESS_BACKEND = "thread"
+# 自适应并发（AIMD）：开启后 max_workers 作为并发上限，实际在途请求数按端点健康状况自动伸缩
+DEFAULT_ADAPTIVE_CONCURRENCY = False
+# 重试退避上限（秒）：retry_delay 为首次退避时间，之后按指数增长到此上限（服务端 Retry-After 优先）
+DEFAULT_RETRY_MAX_DELAY = 60.0
+# 提前结束流：流式输出中出现完整的顶层 JSON 后立即关闭连接，不再接收后续说明文字
+DEFAULT_EARLY_STOP = False
+# 流式 delta 事件合并：同一张图片的 delta 在时间窗口（毫秒）内或达到字节数上限前合并为一个事件，均为 0 时逐块发送
+DEFAULT_DELTA_WINDOW_MS = 50
+DEFAULT_DELTA_MAX_BYTES = 4096
+# 断点续跑：按检查点清单跳过上次已成功的图片（图片内容 + 提示词 + 模型 均相同），只重跑失败/缺失的
+DEFAULT_RESUME = False
+# 结果缓存：相同 图片 + 提示词 + 模型 + 请求参数 直接复用上次的模型输出；关闭时不读缓存（仍写入新结果）
+DEFAULT_USE_CACHE = True
+# 结果缓存有效期（秒）与磁盘占用上限（MB）
+DEFAULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_CACHE_MAX_MB = 512
+# 多图打包：每个请求携带的图片数，1 表示不打包（适合大量小截图，减少每个请求的固定开销）
+DEFAULT_PACK_SIZE = 1
+# 对冲请求：流式请求超过最近 TTFT 的第 P 百分位仍未出首个 token 时再发一份，先出 token 的一路胜出
+DEFAULT_HEDGE = False
+DEFAULT_HEDGE_PERCENTILE = 95.0
+# 同一端点+模型至少积累多少个 TTFT 样本后才启用对冲，以及对冲等待时间下限（秒）
+DEFAULT_HEDGE_MIN_SAMPLES = 5
+DEFAULT_HEDGE_MIN_DELAY = 2.0
+# 熔断器：同一端点连续失败（5xx/超时/连接错误）达到此次数后熔断，冷却（秒）后放行一个探测请求，0 表示关闭
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+# 任务截止时间（秒）：从开始处理算起超过此时长即取消剩余图片并关闭在途请求，0 表示不限
+DEFAULT_JOB_DEADLINE = 0.0
+# 后台写盘：结果文件由写盘线程批量写入，队列长度（写满时提交方阻塞）与每批最多写入的文件数
+DEFAULT_WRITER_QUEUE_SIZE = 256
+DEFAULT_WRITER_BATCH_SIZE = 32
+# 结果文件写入后是否 fsync（开启后断电也不丢已写完的结果，但写盘更慢）
+DEFAULT_RESULT_FSYNC = False
+# 输出布局："files" 每张图片一个结果 JSON（兼容模式）；"run" 每次运行一个 runs/<run_id>/ 目录，结果追加到 results.jsonl
+DEFAULT_OUTPUT_LAYOUT = "files"
 
 # =====================
 # 彩色控制台
@@ -203,6 +243,29 @@ __all__ = [
     "DEFAULT_ENABLE_COMPRESSION",
     "DEFAULT_VERBOSE",
     "DEFAULT_MAX_WORKERS",
+    "DEFAULT_PREPROCESS_LOOKAHEAD",
+    "DEFAULT_PREPROCESS_BACKEND",
+    "DEFAULT_ADAPTIVE_CONCURRENCY",
+    "DEFAULT_RETRY_MAX_DELAY",
+    "DEFAULT_EARLY_STOP",
+    "DEFAULT_DELTA_WINDOW_MS",
+    "DEFAULT_DELTA_MAX_BYTES",
+    "DEFAULT_RESUME",
+    "DEFAULT_USE_CACHE",
+    "DEFAULT_CACHE_TTL_SECONDS",
+    "DEFAULT_CACHE_MAX_MB",
+    "DEFAULT_PACK_SIZE",
+    "DEFAULT_HEDGE",
+    "DEFAULT_HEDGE_PERCENTILE",
+    "DEFAULT_HEDGE_MIN_SAMPLES",
+    "DEFAULT_HEDGE_MIN_DELAY",
+    "DEFAULT_BREAKER_FAILURES",
+    "DEFAULT_BREAKER_COOLDOWN",
+    "DEFAULT_JOB_DEADLINE",
+    "DEFAULT_WRITER_QUEUE_SIZE",
+    "DEFAULT_WRITER_BATCH_SIZE",
+    "DEFAULT_RESULT_FSYNC",
+    "DEFAULT_OUTPUT_LAYOUT",
     # logger
     "console",
     "ICONS",
@@ -3,21 +3,25 @@
 在本地电脑上运行，调用云平台API
 """
 from backend.core.local.api_client import (
-    get_client_pool, get_rate_limiter,
+    get_client_pool, get_async_client_pool, get_rate_limiter,
 )
+from backend.core.local.async_processor import process_images_with_cloud_api_async
 from backend.core.local.cloud_processor import process_images_with_cloud_api
 from backend.core.local.image_utils import (
-    get_image_url, get_image_files, compress_image, IMAGE_EXTENSIONS,
+    get_image_url, get_image_files, compress_image, load_image_payload, IMAGE_EXTENSIONS,
 )
+from backend.core.local.preprocess_pool import get_preprocess_pool
 from backend.core.local.result_handler import (
     extract_text_from_message, parse_json_from_model_output,
     get_output_file_path, get_latest_output_file_path, save_result,
 )
+from backend.core.local.result_writer import get_result_writer
 
 __all__ = [
-    "get_image_url", "get_image_files", "compress_image", "IMAGE_EXTENSIONS",
-    "get_client_pool", "get_rate_limiter",
+    "get_image_url", "get_image_files", "compress_image", "load_image_payload", "IMAGE_EXTENSIONS",
+    "get_client_pool", "get_async_client_pool", "get_rate_limiter",
     "extract_text_from_message", "parse_json_from_model_output",
-    "get_output_file_path", "get_latest_output_file_path", "save_result",
-    "process_images_with_cloud_api",
+    "get_output_file_path", "get_latest_output_file_path", "save_result", "get_result_writer",
+    "get_preprocess_pool",
+    "process_images_with_cloud_api", "process_images_with_cloud_api_async",
 ]
@@ -4,9 +4,13 @@ API客户端模块
 """
 from __future__ import annotations
 
+import asyncio
 import threading
 import time
-from typing import Dict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any
+
+from backend.core.config import DEFAULT_BREAKER_FAILURES, DEFAULT_BREAKER_COOLDOWN
 
 
 class APIClientPool:
@@ -34,6 +38,38 @@ class APIClientPool:
         self._clients.clear()
 
 
+class AsyncAPIClientPool:
+    """AsyncOpenAI 客户端池（asyncio 引擎使用）
+
+    底层 httpx.AsyncClient 的连接池绑定在创建它的事件循环上，
+    因此缓存键包含事件循环 id，不同事件循环（如多次 asyncio.run）各用各的客户端。
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, api_key: str, base_url: str, timeout: float):
+        """获取或创建当前事件循环下的客户端实例"""
+        loop_id = id(asyncio.get_running_loop())
+        key = f"{loop_id}_{api_key[:10] if api_key else 'none'}_{base_url}_{timeout}"
+
+        with self._lock:
+            if key not in self._clients:
+                from openai import AsyncOpenAI
+                self._clients[key] = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=timeout
+                )
+            return self._clients[key]
+
+    def clear(self):
+        """清空客户端池"""
+        with self._lock:
+            self._clients.clear()
+
+
 class RequestRateLimiter:
     """请求速率限制器"""
 
@@ -41,23 +77,567 @@ class RequestRateLimiter:
         self._lock = threading.Lock()
         self._last_request_at: Dict[str, float] = {}
 
-    def wait(self, key: str, min_interval_s: float) -> None:
-        """等待直到可以发送下一个请求"""
+    def reserve(self, key: str, min_interval_s: float) -> float:
+        """预约下一个请求时间槽，返回需要等待的秒数（不阻塞）"""
         if not min_interval_s or min_interval_s <= 0:
-            return
+            return 0.0
         now = time.monotonic()
         with self._lock:
             last = self._last_request_at.get(key, 0.0)
             earliest = last + float(min_interval_s)
             sleep_s = max(0.0, earliest - now)
             self._last_request_at[key] = now + sleep_s
+        return sleep_s
+
+    def wait(self, key: str, min_interval_s: float) -> None:
+        """等待直到可以发送下一个请求"""
+        sleep_s = self.reserve(key, min_interval_s)
         if sleep_s:
             time.sleep(sleep_s)
 
+    async def wait_async(self, key: str, min_interval_s: float) -> None:
+        """asyncio 版等待：与线程版共享同一份时间槽，只是让出事件循环而不是阻塞线程"""
+        sleep_s = self.reserve(key, min_interval_s)
+        if sleep_s:
+            await asyncio.sleep(sleep_s)
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """models.yml 中 rate_limit 段的解析结果
+
+    rpm / tpm 为每分钟请求数 / token 数配额（None 表示不限制）；
+    burst_requests / burst_tokens 为令牌桶容量（突发上限），默认等于每分钟配额；
+    estimated_tokens 为发请求前预扣的 token 数，拿到实际用量后多退少补。
+    """
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+    burst_requests: Optional[float] = None
+    burst_tokens: Optional[float] = None
+    estimated_tokens: int = 1000
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "burst_requests": self.burst_requests,
+            "burst_tokens": self.burst_tokens,
+            "estimated_tokens": self.estimated_tokens,
+        }
+
+
+def parse_rate_limits(cfg: Any) -> Optional[RateLimits]:
+    """解析 rate_limit 配置（dict），未配置或配额均为空时返回 None
+
+    示例（厂商 defaults 或单个模型下）：
+        rate_limit:
+          rpm: 60
+          tpm: 100000
+          burst_requests: 10
+          estimated_tokens: 1500
+    """
+    if isinstance(cfg, RateLimits):
+        return cfg
+    if not isinstance(cfg, dict):
+        return None
+
+    def _positive(name: str) -> Optional[float]:
+        value = cfg.get(name)
+        if value is None:
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"rate_limit.{name} 必须是数字，当前为 {cfg.get(name)!r}")
+        return value if value > 0 else None
+
+    rpm = _positive("rpm")
+    tpm = _positive("tpm")
+    if rpm is None and tpm is None:
+        return None
+    estimated = _positive("estimated_tokens")
+    return RateLimits(
+        rpm=rpm,
+        tpm=tpm,
+        burst_requests=_positive("burst_requests"),
+        burst_tokens=_positive("burst_tokens"),
+        estimated_tokens=int(estimated) if estimated else 1000,
+    )
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 rate 个令牌
+
+    采用预约式扣减：reserve() 立即扣除并返回需要等待的秒数，余额允许为负，
+    后来者自然排在后面，线程与协程共用同一份状态。调用方需自行加锁。
+    """
+
+    def __init__(self, rate_per_s: float, capacity: float) -> None:
+        self.rate = float(rate_per_s)
+        self.capacity = max(1.0, float(capacity))
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """扣除 amount 个令牌（超过容量按容量计），返回需等待的秒数"""
+        self._refill(now)
+        self.level -= min(float(amount), self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, delta: float, now: float) -> None:
+        """按实际用量修正：delta > 0 追加扣减，delta < 0 退还"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - float(delta))
+
+
+@dataclass
+class _QuotaState:
+    limits: RateLimits
+    requests: Optional[TokenBucket]
+    tokens: Optional[TokenBucket]
+    token_estimate: float
+    request_count: int = 0
+    usage_reports: int = 0
+    tokens_used: int = 0
+    waited_seconds: float = 0.0
+
+
+class QuotaRateLimiter:
+    """按 key（api_base_url + 模型名）维护 RPM / TPM 两个令牌桶
+
+    - 请求前 reserve()：请求桶扣 1，token 桶预扣估算值（首个用量报告前取配置的 estimated_tokens，
+      之后取实际用量的滑动平均），返回需等待秒数与预扣数
+    - 流结束后 settle()：用流式 usage 报告的实际 total_tokens 多退少补；未报告用量时保留预扣
+    - 请求未发出或在竞速中落败时 refund()：退还 token 桶预扣，不计入用量统计
+    """
+
+    def __init__(self, usage_alpha: float = 0.2) -> None:
+        self._lock = threading.Lock()
+        self._states: Dict[str, _QuotaState] = {}
+        self._usage_alpha = usage_alpha
+
+    def _state(self, key: str, limits: RateLimits) -> _QuotaState:
+        state = self._states.get(key)
+        if state is None or state.limits != limits:
+            # 首次使用或 models.yml 中配额被修改：重建令牌桶
+            requests = tokens = None
+            if limits.rpm:
+                requests = TokenBucket(limits.rpm / 60.0, limits.burst_requests or limits.rpm)
+            if limits.tpm:
+                tokens = TokenBucket(limits.tpm / 60.0, limits.burst_tokens or limits.tpm)
+            state = _QuotaState(
+                limits=limits, requests=requests, tokens=tokens,
+                token_estimate=float(limits.estimated_tokens),
+            )
+            self._states[key] = state
+        return state
+
+    def reserve(self, key: str, limits: RateLimits) -> tuple[float, int]:
+        """预约一次请求，返回 (需要等待的秒数, 预扣的 token 数)"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key, limits)
+            sleep_s = 0.0
+            reserved = 0
+            if state.requests is not None:
+                sleep_s = max(sleep_s, state.requests.reserve(1, now))
+            if state.tokens is not None:
+                reserved = int(round(state.token_estimate))
+                sleep_s = max(sleep_s, state.tokens.reserve(reserved, now))
+            state.request_count += 1
+            state.waited_seconds += sleep_s
+        return sleep_s, reserved
+
+    def wait(self, key: str, limits: RateLimits) -> tuple[float, int]:
+        """阻塞等待配额，返回 (实际等待秒数, 预扣 token 数)"""
+        sleep_s, reserved = self.reserve(key, limits)
+        if sleep_s:
+            time.sleep(sleep_s)
+        return sleep_s, reserved
+
+    async def wait_async(self, key: str, limits: RateLimits) -> tuple[float, int]:
+        """asyncio 版 wait：与线程版共享令牌桶"""
+        sleep_s, reserved = self.reserve(key, limits)
+        if sleep_s:
+            await asyncio.sleep(sleep_s)
+        return sleep_s, reserved
+
+    def settle(self, key: str, reserved_tokens: int, used_tokens: Optional[int]) -> None:
+        """用实际 token 用量修正预扣；used_tokens 为 None（接口未报告用量）时不修正"""
+        if used_tokens is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.usage_reports += 1
+            state.tokens_used += int(used_tokens)
+            state.token_estimate += self._usage_alpha * (used_tokens - state.token_estimate)
+            if state.tokens is not None:
+                state.tokens.adjust(used_tokens - reserved_tokens, now)
+
+    def refund(self, key: str, reserved_tokens: int) -> None:
+        """退还预扣的 token（不更新用量估算，避免把未完成的请求当作 0 用量）"""
+        if not reserved_tokens:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None and state.tokens is not None:
+                state.tokens.adjust(-min(float(reserved_tokens), state.tokens.capacity), now)
+
+    def snapshot(self, key: str) -> Optional[Dict[str, Any]]:
+        """用于 run_summary 的状态快照"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            snap = state.limits.as_dict()
+            snap.update({
+                "requests": state.request_count,
+                "usage_reports": state.usage_reports,
+                "tokens_used": state.tokens_used,
+                "token_estimate": int(round(state.token_estimate)),
+                "waited_seconds": round(state.waited_seconds, 4),
+            })
+            return snap
+
+
+def quota_key(api_base_url: Optional[str], model_name: str) -> str:
+    """配额按 端点 + 模型 计算（厂商公布的 RPM/TPM 通常是模型维度）"""
+    return f"{api_base_url or ''}|{model_name}"
+
+
+def error_status_code(exc: BaseException) -> Optional[int]:
+    """提取 API 异常中的 HTTP 状态码（openai.APIStatusError 等），没有则返回 None"""
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """是否属于服务端过载信号：429 / 5xx / 超时"""
+    code = error_status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    return "timeout" in type(exc).__name__.lower()
+
+
+@dataclass
+class _AIMDState:
+    limit: float
+    ceiling: int
+    in_flight: int = 0
+    slow_start: bool = True
+    last_decrease_at: float = 0.0
+    increases: int = 0
+    decreases: int = 0
+    peak_limit: int = 1
+
+
+class AdaptiveConcurrencyController:
+    """按 api_base_url 维度的 AIMD 自适应并发控制器
+
+    - 加性增：请求成功且 TTFT 正常时提升并发上限（首次拥塞前为慢启动，每次成功 +1；之后每个窗口 +1）
+    - 乘性减：遇到 429/5xx/超时，或 TTFT 超过基线的 ttft_inflation 倍时，上限乘以 decrease_factor
+    - 冷却：同一波拥塞只减一次（cooldown_s 内不重复减）
+    - 上限不超过调用方给出的 ceiling（即 max_workers），下限为 min_limit
+    - TTFT 基线按 (端点, 模型) 分别维护（同一端点下不同模型的 TTFT 差异很大），
+      只用未判定为膨胀的样本更新 EWMA，拥塞期间的慢样本不会把基线抬高、掩盖后续的拥塞
+
+    并发上限按 key（端点）全局保留，同一端点的后续运行会从已学到的上限继续。
+    线程版用 acquire()/release() 阻塞等待；asyncio 版用 acquire_async()，两者共享同一份状态。
+    """
+
+    def __init__(
+            self,
+            *,
+            initial_limit: int = 1,
+            min_limit: int = 1,
+            decrease_factor: float = 0.5,
+            ttft_inflation: float = 2.0,
+            ttft_alpha: float = 0.1,
+            cooldown_s: float = 2.0,
+    ) -> None:
+        self._initial_limit = initial_limit
+        self._min_limit = min_limit
+        self._decrease_factor = decrease_factor
+        self._ttft_inflation = ttft_inflation
+        self._ttft_alpha = ttft_alpha
+        self._cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._states: Dict[str, _AIMDState] = {}
+        self._ttft_baselines: Dict[tuple[str, str], float] = {}
+        self._async_waiters: List[tuple[Any, asyncio.Event]] = []
+
+    def _state(self, key: str, ceiling: int) -> _AIMDState:
+        ceiling = max(self._min_limit, int(ceiling))
+        state = self._states.get(key)
+        if state is None:
+            limit = float(max(self._min_limit, min(self._initial_limit, ceiling)))
+            state = _AIMDState(limit=limit, ceiling=ceiling, peak_limit=int(limit))
+            self._states[key] = state
+        else:
+            state.ceiling = ceiling
+            state.limit = min(state.limit, float(ceiling))
+        return state
+
+    def _effective(self, state: _AIMDState) -> int:
+        return max(self._min_limit, int(state.limit))
+
+    def _try_acquire_locked(self, key: str, ceiling: int) -> bool:
+        state = self._state(key, ceiling)
+        if state.in_flight < self._effective(state):
+            state.in_flight += 1
+            return True
+        return False
+
+    def acquire(self, key: str, ceiling: int) -> None:
+        """阻塞直到该端点的在途请求数低于当前上限"""
+        with self._cond:
+            while not self._try_acquire_locked(key, ceiling):
+                self._cond.wait(timeout=1.0)
+
+    async def acquire_async(self, key: str, ceiling: int) -> None:
+        """asyncio 版 acquire：让出事件循环等待，而不是阻塞线程"""
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            with self._lock:
+                if self._try_acquire_locked(key, ceiling):
+                    return
+                self._async_waiters.append((loop, event))
+            await event.wait()
+
+    def release(
+            self,
+            key: str,
+            outcome: str,
+            ttft_seconds: Optional[float] = None,
+            *,
+            model: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """释放一个在途名额并根据结果调整上限
+
+        outcome: "success" / "overload"（429/5xx/超时）/ "error"（其它错误，不调整）
+        model: 本次请求实际使用的模型，TTFT 只与同一端点、同一模型的基线比较
+        返回值：上限发生变化时返回 {"limit", "previous_limit", "reason"}，否则 None
+        """
+        change = None
+        with self._cond:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            state.in_flight = max(0, state.in_flight - 1)
+            before = self._effective(state)
+
+            reason = None
+            if outcome == "overload":
+                reason = "throttled" if self._decrease(state) else None
+            elif outcome == "success":
+                baseline_key = (key, model or "")
+                baseline = self._ttft_baselines.get(baseline_key)
+                if (ttft_seconds is not None and baseline is not None
+                        and ttft_seconds > baseline * self._ttft_inflation):
+                    reason = "ttft_inflation" if self._decrease(state) else None
+                else:
+                    self._increase(state)
+                    reason = "increase"
+                    if ttft_seconds is not None:
+                        self._ttft_baselines[baseline_key] = (
+                            ttft_seconds if baseline is None
+                            else baseline + self._ttft_alpha * (ttft_seconds - baseline)
+                        )
+
+            after = self._effective(state)
+            state.peak_limit = max(state.peak_limit, after)
+            if after != before and reason:
+                change = {"limit": after, "previous_limit": before, "reason": reason}
+
+            waiters, self._async_waiters = self._async_waiters, []
+            self._cond.notify_all()
+
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        return change
+
+    def _increase(self, state: _AIMDState) -> None:
+        if state.slow_start:
+            state.limit += 1.0
+        else:
+            state.limit += 1.0 / max(state.limit, 1.0)
+        state.limit = min(state.limit, float(state.ceiling))
+        state.increases += 1
+
+    def _decrease(self, state: _AIMDState) -> bool:
+        now = time.monotonic()
+        if now - state.last_decrease_at < self._cooldown_s:
+            return False
+        state.limit = max(float(self._min_limit), state.limit * self._decrease_factor)
+        state.slow_start = False
+        state.last_decrease_at = now
+        state.decreases += 1
+        return True
+
+    def limit(self, key: str) -> Optional[int]:
+        """当前生效的并发上限（该端点尚无状态时返回 None）"""
+        with self._lock:
+            state = self._states.get(key)
+            return self._effective(state) if state else None
+
+    def snapshot(self, key: str, model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """用于 run_summary 的状态快照（TTFT 基线取该端点下 model 的基线）"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            ttft_baseline = self._ttft_baselines.get((key, model or ""))
+            return {
+                "limit": self._effective(state),
+                "ceiling": state.ceiling,
+                "peak_limit": state.peak_limit,
+                "in_flight": state.in_flight,
+                "ttft_baseline_seconds": round(ttft_baseline, 4) if ttft_baseline else None,
+                "increases": state.increases,
+                "decreases": state.decreases,
+            }
+
+
+class CircuitOpenError(RuntimeError):
+    """端点熔断中且没有可用的备用模型；retry_after 为距下一次探测的秒数（重试策略据此退避）"""
+
+    def __init__(self, key: str, retry_after: float) -> None:
+        super().__init__(f"端点熔断中: {key}（{retry_after:.1f}s 后探测）")
+        self.key = key
+        self.retry_after = retry_after
+
+
+@dataclass
+class _BreakerState:
+    state: str = "closed"
+    failures: int = 0
+    opened_at: float = 0.0
+    probe_in_flight: bool = False
+    opened_count: int = 0
+    rejected: int = 0
+
+
+class CircuitBreaker:
+    """按 api_base_url 维度的熔断器（线程安全，线程版与 asyncio 版共享状态）
+
+    - closed：正常放行；连续 failure_threshold 次健康类失败（5xx/超时/连接错误）后转为 open
+    - open：拒绝请求，cooldown_s 后转为 half_open
+    - half_open：只放行一个探测请求，成功则 closed，失败则重新 open
+    429、4xx、输出解析失败等与端点健康无关的结果不计数（half_open 时释放探测名额）。
+    """
+
+    def __init__(
+            self,
+            *,
+            failure_threshold: int = DEFAULT_BREAKER_FAILURES,
+            cooldown_s: float = DEFAULT_BREAKER_COOLDOWN,
+    ) -> None:
+        self._threshold = int(failure_threshold)
+        self._cooldown_s = float(cooldown_s)
+        self._lock = threading.Lock()
+        self._states: Dict[str, _BreakerState] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._threshold > 0
+
+    def allow(self, key: str) -> bool:
+        """是否放行一个请求（half_open 时占用唯一的探测名额）"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            state = self._states.setdefault(key, _BreakerState())
+            if state.state == "open" and time.monotonic() - state.opened_at >= self._cooldown_s:
+                state.state = "half_open"
+                state.probe_in_flight = False
+            if state.state == "closed":
+                return True
+            if state.state == "half_open" and not state.probe_in_flight:
+                state.probe_in_flight = True
+                return True
+            state.rejected += 1
+            return False
+
+    def retry_in(self, key: str) -> float:
+        """距离下一次探测的秒数"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None or state.state != "open":
+                return 0.0
+            return max(0.0, self._cooldown_s - (time.monotonic() - state.opened_at))
+
+    def record(self, key: str, outcome: str) -> Optional[Dict[str, Any]]:
+        """记录一次请求结果
+
+        outcome: "success" / "failure"（健康类失败）/ "neutral"（与端点健康无关）
+        返回值：状态发生变化时返回 {"endpoint", "state", "previous_state", "failures"}，否则 None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            state = self._states.setdefault(key, _BreakerState())
+            before = state.state
+            if before == "half_open":
+                state.probe_in_flight = False
+            if outcome == "success":
+                state.failures = 0
+                if before == "half_open":
+                    state.state = "closed"
+            elif outcome == "failure":
+                state.failures += 1
+                if before == "half_open" or (before == "closed" and state.failures >= self._threshold):
+                    state.state = "open"
+                    state.opened_at = time.monotonic()
+                    state.opened_count += 1
+            if state.state == before:
+                return None
+            return {"endpoint": key, "state": state.state, "previous_state": before, "failures": state.failures}
+
+    def state(self, key: str) -> str:
+        with self._lock:
+            state = self._states.get(key)
+            return state.state if state else "closed"
+
+    def snapshot(self, key: str) -> Optional[Dict[str, Any]]:
+        """用于 run_summary 的状态快照"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            return {
+                "state": state.state,
+                "consecutive_failures": state.failures,
+                "opened_count": state.opened_count,
+                "rejected": state.rejected,
+            }
+
 
 # 全局实例
 _RATE_LIMITER = RequestRateLimiter()
 _CLIENT_POOL = APIClientPool()
+_ASYNC_CLIENT_POOL = AsyncAPIClientPool()
+_CONCURRENCY_CONTROLLER = AdaptiveConcurrencyController()
+_QUOTA_LIMITER = QuotaRateLimiter()
+_CIRCUIT_BREAKER = CircuitBreaker()
 
 
 def get_rate_limiter() -> RequestRateLimiter:
@@ -68,3 +648,23 @@ def get_rate_limiter() -> RequestRateLimiter:
 def get_client_pool() -> APIClientPool:
     """获取全局客户端池"""
     return _CLIENT_POOL
+
+
+def get_async_client_pool() -> AsyncAPIClientPool:
+    """获取全局异步客户端池"""
+    return _ASYNC_CLIENT_POOL
+
+
+def get_concurrency_controller() -> AdaptiveConcurrencyController:
+    """获取全局自适应并发控制器"""
+    return _CONCURRENCY_CONTROLLER
+
+
+def get_quota_limiter() -> QuotaRateLimiter:
+    """获取全局 RPM/TPM 配额限制器"""
+    return _QUOTA_LIMITER
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """获取全局熔断器"""
+    return _CIRCUIT_BREAKER
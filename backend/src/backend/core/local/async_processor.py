@@ -0,0 +1,699 @@
+"""
+asyncio 云API处理模块
+基于 openai.AsyncOpenAI 的流式批处理引擎，与线程版 cloud_processor 并存
+
+与线程版的区别：
+- 每张图片是一个协程，并发度由 asyncio.Semaphore(max_workers) 限制，上百路在途流只占协程不占线程
+- 速率限制与重试等待使用 asyncio.sleep，不阻塞事件循环；重试退避期间释放并发名额
+- 图片预处理（Pillow 解码/压缩）与结果写盘放到默认线程池执行
+- FastAPI 路由可直接 await，无需后台线程 + queue.Queue 中转
+
+计时、事件、JSON 解析与保存逻辑与线程版共用 StreamSession，输出格式完全一致。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Sequence
+
+from backend.core.config import (
+    console, with_icon,
+    DEFAULT_INPUT_DIR, DEFAULT_PROMPT, DEFAULT_MAX_IMAGE_SIZE,
+    DEFAULT_MAX_FILE_SIZE_MB, DEFAULT_REQUEST_DELAY, DEFAULT_MAX_RETRIES,
+    DEFAULT_RETRY_DELAY, DEFAULT_ENABLE_COMPRESSION, DEFAULT_VERBOSE, DEFAULT_MAX_WORKERS,
+    DEFAULT_PREPROCESS_LOOKAHEAD, DEFAULT_ADAPTIVE_CONCURRENCY, DEFAULT_RETRY_MAX_DELAY,
+    DEFAULT_EARLY_STOP, DEFAULT_DELTA_WINDOW_MS, DEFAULT_DELTA_MAX_BYTES, DEFAULT_RESUME,
+    DEFAULT_USE_CACHE, DEFAULT_PACK_SIZE, DEFAULT_HEDGE, DEFAULT_HEDGE_PERCENTILE, DEFAULT_OUTPUT_LAYOUT,
+    DEFAULT_PREPROCESS_BACKEND,
+)
+from backend.core.local.api_client import (
+    get_rate_limiter, get_async_client_pool, get_concurrency_controller, is_overload_error,
+    get_quota_limiter, parse_rate_limits, quota_key, RateLimits,
+)
+from backend.core.local.cancellation import CancelToken, CancelledRunError
+from backend.core.local.checkpoint import CheckpointPlan, plan_checkpoint
+from backend.core.local.cloud_processor import (
+    _preprocess_image, _prepare_run, _write_run_summary, _emit_skipped,
+    _cache_params, _serve_from_cache, _cacheable, _store_in_cache, _split_duplicates, _fan_out,
+    _pack_timings, _deadline_options, _check_output_layout, _open_output_layout, _open_preprocess_pool,
+    _settle_race_quota, _refund_hedge_quota, _mark_failover, _apply_write_failures,
+)
+from backend.core.local.failover import FailoverRouter, Route, build_failover_routes
+from backend.core.local.hedging import HedgePolicy, HedgeReservation, race_first_token_async
+from backend.core.local.image_utils import get_image_files, PreprocessPrefetcher, PreprocessTotals
+from backend.core.local.packing import build_packed_messages, pack_groups, save_packed_results, split_packed_output
+from backend.core.local.preprocess_pool import BACKEND_THREAD
+from backend.core.local.result_cache import CacheStats, cache_key, get_result_cache
+from backend.core.local.result_handler import reserve_output_file_path
+from backend.core.local.result_writer import get_result_writer
+from backend.core.local.results_log import LAYOUT_RUN, RESULTS_FILENAME
+from backend.core.local.retry import RetryDecision, RetryPolicy
+from backend.core.local.run_summary import RunSummaryWriter, run_header
+from backend.core.local.stream_session import (
+    StreamSession, build_messages, delta_text, chunk_usage, usage_dict,
+)
+
+
+async def _process_single_image_async(
+        image_path: Path,
+        idx: int,
+        total: int,
+        model_name: str,
+        model_info: Optional[str],
+        prompt: str,
+        max_image_size: tuple[int, int],
+        max_file_size_mb: int,
+        request_delay: float,
+        max_retries: int,
+        retry_delay: float,
+        api_base_url: str,
+        timeout: Optional[float],
+        enable_compression: bool,
+        verbose: bool,
+        output_dir: Path,
+        api_key: str,
+        enable_streaming_print: bool = False,
+        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        log_prefix: str = "",
+        prefetcher: Optional[PreprocessPrefetcher] = None,
+        adaptive_ceiling: Optional[int] = None,
+        rate_limits: Optional[RateLimits] = None,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        slot: Optional[asyncio.Semaphore] = None,
+        early_stop: bool = DEFAULT_EARLY_STOP,
+        delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+        delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+        output_file: Optional[Path] = None,
+        hedge: Optional[HedgePolicy] = None,
+        router: Optional[FailoverRouter] = None,
+        cancel: Optional[CancelToken] = None,
+        preprocess_totals: Optional[PreprocessTotals] = None,
+) -> Dict[str, Any]:
+    """处理单张图片（asyncio 流式版本）
+
+    slot 为并发名额：每次尝试时持有，退避等待期间释放，让其他图片先跑（延迟重试）。
+    output_file 不为空时直接写入该文件（断点续跑重跑失败图片时复用上次的路径）。
+    hedge 不为空且已有足够 TTFT 样本时，首个 token 超过阈值未到即发对冲请求（见 hedging 模块）。
+    每次尝试前由 router 选择路由：主端点熔断时改用备用模型（见 failover 模块）。
+    cancel 触发时取消本协程（在途的流随之关闭），图片以 cancelled 失败结束（见 cancellation 模块）。
+    preprocess_totals 不为空时累计每次预处理的耗时与统计（没有本次运行专用的预取流水线时用于运行汇总）。
+    """
+    router = router or FailoverRouter(Route(
+        label=model_name, model_name=model_name, api_base_url=api_base_url, api_key=api_key,
+        rate_limits=rate_limits, primary=True,
+    ))
+    rate_limiter = get_rate_limiter()
+    controller = get_concurrency_controller() if adaptive_ceiling else None
+    retry_policy = RetryPolicy(max_retries=max_retries, base_delay=retry_delay, max_delay=retry_max_delay)
+    session: Optional[StreamSession] = None
+    retry_count = 0
+
+    async def _open_stream(client: Any, route: Route, name: str, image_url: str) -> Any:
+        # 配置了 TPM 时请求流式 usage，用实际用量修正 token 桶
+        request_options: Dict[str, Any] = (
+            {"stream_options": {"include_usage": True}}
+            if (route.rate_limits is not None and route.rate_limits.tpm) else {}
+        )
+        return await client.chat.completions.create(
+            model=name,
+            messages=build_messages(prompt, image_url),
+            stream=True,
+            **request_options,
+            **_deadline_options(cancel, timeout),
+        )
+
+    async def _open_hedge(
+            client: Any, route: Route, image_url: str, reservation: Optional[HedgeReservation],
+    ) -> Any:
+        """对冲请求：同样经过请求间隔与配额限制（不占自适应并发名额），TPM 预扣记入 reservation"""
+        name = hedge.hedge_model or model_name
+        await rate_limiter.wait_async(route.api_base_url, request_delay)
+        if reservation is not None:
+            key = quota_key(route.api_base_url, name)
+            sleep_s, reserved_tokens = get_quota_limiter().reserve(key, route.rate_limits)
+            if not reservation.hold(key, reserved_tokens):
+                raise RuntimeError("竞速已结束，不再发出对冲请求")
+            await asyncio.sleep(sleep_s)
+        return await _open_stream(client, route, name, image_url)
+
+    async def _attempt() -> Dict[str, Any] | RetryDecision:
+        nonlocal session, retry_count
+        if session is None:
+            # 首次尝试时才占用输出路径并发 image_start
+            target = output_file or await asyncio.to_thread(
+                reserve_output_file_path, output_dir, image_path.stem, ".json"
+            )
+            session = StreamSession(
+                image_path=image_path, idx=idx, total=total,
+                model_name=model_name, model_info=model_info, prompt=prompt,
+                output_dir=output_dir, output_file=target,
+                verbose=verbose, enable_streaming_print=enable_streaming_print,
+                emit=emit, log_prefix=log_prefix, early_stop=early_stop,
+                delta_window_ms=delta_window_ms, delta_max_bytes=delta_max_bytes,
+            )
+            session.emit("image_start")
+
+        holding_slot = False
+        route: Optional[Route] = None
+        route_settled = False
+        stream: Any = None
+        hedge_reservation: Optional[HedgeReservation] = None
+        try:
+            if retry_count > 0 and verbose:
+                console.warning(with_icon("retry", f"{log_prefix}重试({retry_count}/{max_retries})..."))
+            session.begin_attempt()
+            if cancel is not None:
+                cancel.check()
+
+            # 预处理图片（CPU 密集，放到线程池）：首次尝试优先取流水线预取结果
+            if prefetcher is not None and retry_count == 0:
+                t_wait = time.perf_counter()
+                image_url, preprocess_seconds, stats = await asyncio.wrap_future(prefetcher.future(idx))
+                session.set_preprocess(preprocess_seconds, wait_seconds=time.perf_counter() - t_wait, stats=stats)
+            else:
+                t_pre = time.perf_counter()
+                stats = {}
+                image_url = await asyncio.to_thread(
+                    _preprocess_image, image_path, max_image_size, max_file_size_mb, enable_compression, False,
+                    stats=stats,
+                )
+                preprocess_seconds = time.perf_counter() - t_pre
+                session.set_preprocess(preprocess_seconds, stats=stats)
+            if preprocess_totals is not None:
+                preprocess_totals.add(preprocess_seconds, stats)
+
+            # 路由：主端点熔断时改用备用模型（全部熔断时抛 CircuitOpenError，按探测时间退避重试）
+            route = router.pick()
+            if not route.primary:
+                session.failover(**router.failover_event(route))
+            client = get_async_client_pool().get_client(route.api_key, route.api_base_url, timeout)
+            quota = get_quota_limiter() if route.rate_limits is not None else None
+            q_key = quota_key(route.api_base_url, route.model_name)
+
+            # 自适应并发名额 + 速率限制
+            if controller is not None:
+                await controller.acquire_async(route.api_base_url, adaptive_ceiling)
+                holding_slot = True
+            await rate_limiter.wait_async(route.api_base_url, request_delay)
+            reserved_tokens = 0
+            if quota is not None:
+                quota_wait, reserved_tokens = await quota.wait_async(q_key, route.rate_limits)
+                session.set_quota_wait(quota_wait)
+            if cancel is not None:
+                cancel.check()
+
+            # ========== 真实流式调用 ==========
+            session.mark_request()
+            hedge_after = hedge.delay() if (hedge is not None and route.primary) else None
+            race = None
+            if hedge_after is None:
+                if hedge is not None:
+                    hedge.stats.add("requests")
+                stream = await _open_stream(client, route, route.model_name, image_url)
+                session.mark_connected()
+                chunks = stream
+            else:
+                hedge_name = hedge.hedge_model or model_name
+                hedge_reservation = HedgeReservation(quota) if quota is not None else None
+                race = await race_first_token_async(
+                    lambda: _open_stream(client, route, model_name, image_url),
+                    lambda: _open_hedge(client, route, image_url, hedge_reservation),
+                    primary_model=model_name,
+                    hedge_model=hedge_name,
+                    hedge_after=hedge_after,
+                    stats=hedge.stats,
+                    on_hedge=lambda: session.hedge_started(hedge_after, hedge_name),
+                )
+                stream = race.stream
+                session.mark_connected(at=race.t_connected)
+                chunks = race.chunks_then_rest_async()
+                if hedge_reservation is not None:
+                    q_key, reserved_tokens = _settle_race_quota(
+                        quota, race, (q_key, reserved_tokens), hedge_reservation.take(),
+                    )
+
+            async for chunk in chunks:
+                session.feed(delta_text(chunk))
+                session.set_usage(chunk_usage(chunk))
+                if session.should_stop():
+                    await stream.close()
+                    break
+            session.finish_stream()
+            route_settled = True
+            session.circuit_changed(router.record(route))
+            if hedge is not None and route.primary:
+                hedge.observe(race.own_ttft() if race is not None else session.ttft())
+                if race is not None:
+                    session.set_hedge(race.name, race.model)
+            if quota is not None:
+                quota.settle(q_key, reserved_tokens, session.used_tokens())
+            if holding_slot:
+                holding_slot = False
+                session.concurrency_changed(controller.release(
+                    route.api_base_url, "success", session.ttft(), model=session.model_name,
+                ))
+
+            # ========== JSON 后处理 / 保存结果 ==========
+            session.parse()
+            await asyncio.to_thread(session.save)
+            return session.success_record(retry_count)
+
+        except asyncio.CancelledError:
+            # 协程被取消（任务取消或上层取消）：关闭在途的流，释放名额与熔断探测名额
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception:
+                    pass
+            _refund_hedge_quota(hedge_reservation)
+            if route is not None and not route_settled:
+                router.record(route, CancelledRunError("coroutine cancelled"))
+            if holding_slot:
+                controller.release(route.api_base_url, "error")
+            raise
+        except Exception as e:
+            _refund_hedge_quota(hedge_reservation)
+            if route is not None and not route_settled:
+                session.circuit_changed(router.record(route, e))
+            if holding_slot:
+                outcome = "overload" if is_overload_error(e) else "error"
+                session.concurrency_changed(controller.release(route.api_base_url, outcome))
+            retry_count += 1
+            error_msg = str(e)
+            decision = retry_policy.decide(e, retry_count)
+            session.on_exception(error_msg, retry_count, max_retries)
+
+            if not decision.retry:
+                await asyncio.to_thread(session.save_failure, error_msg)
+                return session.failure_record(error_msg, retry_count - 1, error_kind=decision.kind)
+            session.retry_scheduled(decision, retry_count)
+            return decision
+
+    release_task = None
+    if cancel is not None:
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        release_task = cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        while True:
+            if slot is not None:
+                async with slot:
+                    outcome = await _attempt()
+            else:
+                outcome = await _attempt()
+            if not isinstance(outcome, RetryDecision):
+                return outcome
+            # 退避期间不占并发名额
+            await asyncio.sleep(outcome.delay)
+    except asyncio.CancelledError:
+        if cancel is None or not cancel.cancelled:
+            raise
+        # 由取消令牌触发：再走一次尝试，cancel.check() 使其以 cancelled 失败结束并写入失败结果
+        return await _attempt()
+    finally:
+        if release_task is not None:
+            release_task()
+
+
+async def _run_pack_async(
+        group: List[tuple[int, Path]],
+        *,
+        router: FailoverRouter,
+        model_info: Optional[str],
+        prompt: str,
+        output_dir: Path,
+        checkpoint: CheckpointPlan,
+        max_image_size: tuple[int, int],
+        max_file_size_mb: int,
+        enable_compression: bool,
+        request_delay: float,
+        verbose: bool,
+        timeout: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+        adaptive_ceiling: Optional[int] = None,
+) -> tuple[List[Dict[str, Any]], List[tuple[int, Path]]]:
+    """cloud_processor._run_pack 的 asyncio 版本：任何异常都让整组回退为单图请求
+
+    cancel 触发时取消本协程（在途请求随之关闭），整组回退后由单图任务以 cancelled 结束。
+    """
+    from backend.core.local.result_handler import extract_text_from_message
+
+    release_task = None
+    if cancel is not None:
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        release_task = cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    controller = get_concurrency_controller() if adaptive_ceiling else None
+    holding_slot = False
+    route: Optional[Route] = None
+    route_settled = False
+    quota = None
+    q_key = ""
+    reserved_tokens = 0
+    error: Optional[BaseException] = None
+    try:
+        t_pre = time.perf_counter()
+        image_urls = await asyncio.gather(*(
+            asyncio.to_thread(_preprocess_image, img, max_image_size, max_file_size_mb, enable_compression, False)
+            for _, img in group
+        ))
+        preprocess_seconds = time.perf_counter() - t_pre
+
+        route = router.pick()
+        client = get_async_client_pool().get_client(route.api_key, route.api_base_url, timeout)
+        quota = get_quota_limiter() if route.rate_limits is not None else None
+        q_key = quota_key(route.api_base_url, route.model_name)
+        if controller is not None:
+            await controller.acquire_async(route.api_base_url, adaptive_ceiling)
+            holding_slot = True
+        await get_rate_limiter().wait_async(route.api_base_url, request_delay)
+        if quota is not None:
+            _, reserved_tokens = await quota.wait_async(q_key, route.rate_limits)
+        if cancel is not None:
+            cancel.check()
+        t_api = time.perf_counter()
+        completion = await client.chat.completions.create(
+            model=route.model_name, messages=build_packed_messages(prompt, image_urls),
+            **_deadline_options(cancel, timeout),
+        )
+        api_seconds = time.perf_counter() - t_api
+        route_settled = True
+        router.record(route)
+        if quota is not None:
+            usage = usage_dict(getattr(completion, "usage", None))
+            quota.settle(q_key, reserved_tokens, usage.get("total_tokens") if usage else None)
+            reserved_tokens = 0
+        if holding_slot:
+            holding_slot = False
+            controller.release(route.api_base_url, "success", model=route.model_name)
+        raw_text = extract_text_from_message(completion.choices[0].message)
+    except asyncio.CancelledError:
+        if cancel is None or not cancel.cancelled:
+            error = CancelledRunError("coroutine cancelled")
+            raise
+        error = cancel.error()
+    except Exception as e:
+        error = e
+    finally:
+        if release_task is not None:
+            release_task()
+        if error is not None:
+            # 释放熔断探测名额与并发名额，退还 TPM 预扣
+            if route is not None and not route_settled:
+                router.record(route, error)
+            if holding_slot:
+                controller.release(route.api_base_url, "overload" if is_overload_error(error) else "error")
+            if quota is not None and reserved_tokens:
+                quota.refund(q_key, reserved_tokens)
+    if error is not None:
+        if verbose:
+            console.warning(with_icon("warning", f"打包请求失败，{len(group)} 张回退为单图请求: {error}"))
+        return [], list(group)
+
+    t_parse = time.perf_counter()
+    slots = split_packed_output(raw_text, len(group))
+    parse_seconds = time.perf_counter() - t_parse
+    records, fallback = await asyncio.to_thread(
+        save_packed_results,
+        group, slots, output_dir=output_dir,
+        output_files={idx: checkpoint.output_file(idx) for idx, _ in group},
+        model_name=route.model_name, model_info=model_info, prompt=prompt,
+        timings=_pack_timings(len(group), preprocess_seconds, api_seconds, parse_seconds),
+    )
+    return _mark_failover(records, route), fallback
+
+
+async def process_images_with_cloud_api_async(
+        *,
+        model_name: str,
+        model_info: Optional[str] = None,
+        input_dir: str = DEFAULT_INPUT_DIR,
+        prompt: str = DEFAULT_PROMPT,
+        max_image_size=DEFAULT_MAX_IMAGE_SIZE,
+        max_file_size_mb: int = DEFAULT_MAX_FILE_SIZE_MB,
+        request_delay: float = DEFAULT_REQUEST_DELAY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        api_base_url: Optional[str] = None,
+        timeout: Optional[float] = 60.0,
+        enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
+        verbose: bool = DEFAULT_VERBOSE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        api_key_env: Optional[str] = None,
+        enable_streaming_print: bool = True,
+        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        preprocess_lookahead: int = DEFAULT_PREPROCESS_LOOKAHEAD,
+        adaptive_concurrency: bool = DEFAULT_ADAPTIVE_CONCURRENCY,
+        rate_limits: Optional[Dict[str, Any] | RateLimits] = None,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        early_stop: bool = DEFAULT_EARLY_STOP,
+        delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+        delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+        resume: bool = DEFAULT_RESUME,
+        use_cache: bool = DEFAULT_USE_CACHE,
+        pack_size: int = DEFAULT_PACK_SIZE,
+        shared_prefetcher: Optional[PreprocessPrefetcher] = None,
+        hedge: bool = DEFAULT_HEDGE,
+        hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        hedge_model: Optional[str] = None,
+        failover: Optional[Sequence[Dict[str, Any]]] = None,
+        cancel: Optional[CancelToken] = None,
+        output_layout: str = DEFAULT_OUTPUT_LAYOUT,
+        preprocess_backend: str = DEFAULT_PREPROCESS_BACKEND,
+        run_id: Optional[str] = None,
+):
+    """process_images_with_cloud_api 的 asyncio 版本（仅流式），参数与返回值一致
+
+    max_workers 为同时在途的流数量上限；emit 在事件循环线程中回调。
+    adaptive_concurrency 开启时，在 max_workers 之内由 AIMD 控制器按端点动态调整在途流数；
+    rate_limits 为 models.yml 中的 rate_limit 配置，与线程版共享同一组令牌桶；
+    检查点清单、resume、结果缓存、多图打包、对冲请求、故障转移、任务取消、输出布局与预处理后端行为同线程版，
+    相关文件读写放到线程池执行；
+    shared_prefetcher 为多模型对比时各模型共享的预处理流水线（由调用方创建与关闭）。
+    """
+    _check_output_layout(output_layout)
+    preprocess_pool = _open_preprocess_pool(preprocess_backend, shared_prefetcher is not None)
+    project_root, output_dir, input_dir_path, api_key = _prepare_run(
+        model_name=model_name, input_dir=input_dir, api_key_env=api_key_env,
+        api_base_url=api_base_url, verbose=verbose,
+    )
+    limits = parse_rate_limits(rate_limits)
+    if verbose and limits is not None:
+        console.detail(with_icon("info", f"配额限制: rpm={limits.rpm} tpm={limits.tpm}"))
+    concurrency = max(1, int(max_workers or 1))
+    if verbose:
+        console.detail(with_icon("info", f"模式: asyncio 流式 x{concurrency} (streaming)"))
+
+    image_files = await asyncio.to_thread(get_image_files, input_dir_path, project_root)
+    if verbose:
+        console.info(with_icon("image_list", f"找到 {len(image_files)} 张图片"))
+        console.blank()
+
+    start_time = datetime.now()
+    total = len(image_files)
+    checkpoint = await asyncio.to_thread(
+        plan_checkpoint, output_dir, image_files, prompt=prompt, model_name=model_name, resume=resume,
+        reuse_outputs=output_layout != LAYOUT_RUN, run_id=run_id,
+    )
+    output_dir, results_log = await asyncio.to_thread(
+        _open_output_layout, output_dir, checkpoint.manifest.run_id, output_layout, verbose,
+    )
+    pending = checkpoint.pending()
+    if verbose and resume:
+        console.info(with_icon("info", f"断点续跑: 跳过已完成 {len(checkpoint.resumed)} 张，待处理 {len(pending)} 张"))
+    writer = await asyncio.to_thread(RunSummaryWriter, output_dir, run_header(
+        model_name=model_name, model_info=model_info, prompt=prompt, start_time=start_time,
+        input_dir_path=input_dir_path, output_dir=output_dir, run_id=checkpoint.manifest.run_id, total=total,
+    ))
+    # 无需请求的图片（断点续跑已完成 + 缓存命中）
+    skipped: Dict[int, Dict[str, Any]] = dict(checkpoint.resumed)
+
+    cache = get_result_cache()
+    cache_stats = CacheStats(enabled=use_cache)
+    params = _cache_params(api_base_url, max_image_size, max_file_size_mb, enable_compression, early_stop)
+
+    def _cache_key(idx: int) -> str:
+        return cache_key(checkpoint.image_hash(idx), prompt, model_name, params)
+
+    def _store(idx: int, result: Dict[str, Any]) -> bool:
+        return _cacheable(result) and _store_in_cache(cache, _cache_key(idx), result, model_name)
+
+    if use_cache and pending:
+        await asyncio.to_thread(checkpoint.ensure_hashes, [idx for idx, _ in pending])
+        hits, pending = await asyncio.to_thread(
+            _serve_from_cache,
+            cache=cache, keys={idx: _cache_key(idx) for idx, _ in pending}, pending=pending,
+            checkpoint=checkpoint, output_dir=output_dir,
+            model_name=model_name, model_info=model_info, prompt=prompt,
+        )
+        skipped.update(hits)
+        cache_stats.add("hits", len(hits))
+        cache_stats.add("misses", len(pending))
+        if verbose and hits:
+            console.info(with_icon("info", f"结果缓存: 命中 {len(hits)} 张，待请求 {len(pending)} 张"))
+    for idx in sorted(skipped):
+        _emit_skipped(emit, skipped[idx], total)
+    await asyncio.to_thread(writer.extend, [skipped[idx] for idx in sorted(skipped)])
+    # 批内内容相同的图片只请求一次，结果复制给其余图片
+    pending, duplicates = await asyncio.to_thread(_split_duplicates, pending, checkpoint)
+    if verbose and duplicates:
+        console.info(with_icon("info", f"批内去重: {sum(map(len, duplicates.values()))} 张与其他图片内容相同，不再单独请求"))
+
+    async def _finish(idx: int, result: Dict[str, Any]) -> None:
+        """图片得到最终结果：追加检查点清单与运行汇总、写入结果缓存并复制给批内重复图片"""
+        await asyncio.to_thread(checkpoint.record, idx, result)
+        await asyncio.to_thread(writer.add, result)
+        if await asyncio.to_thread(_store, idx, result):
+            cache_stats.add("stores")
+        if idx in duplicates:
+            records = await asyncio.to_thread(
+                _fan_out, result, duplicates[idx], checkpoint=checkpoint, output_dir=output_dir,
+            )
+            await asyncio.to_thread(writer.extend, records)
+            for record in records:
+                _emit_skipped(emit, record, total)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # 自适应并发与熔断路由同时作用于打包请求与单图请求
+    adaptive_ceiling = concurrency if (adaptive_concurrency and concurrency > 1) else None
+    router = FailoverRouter(
+        Route(label=model_name, model_name=model_name, api_base_url=api_base_url, api_key=api_key,
+              rate_limits=limits, primary=True),
+        build_failover_routes(failover, verbose=verbose),
+    )
+
+    # 多图打包：每 pack_size 张合并为一个请求，拆分失败的图片回退为下面的单图请求
+    packed_count = 0
+    if pack_size > 1 and len(pending) > 1:
+        async def _pack(group: List[tuple[int, Path]]) -> tuple[List[Dict[str, Any]], List[tuple[int, Path]]]:
+            async with semaphore:
+                if cancel is not None and cancel.cancelled:
+                    return [], list(group)
+                return await _run_pack_async(
+                    group, router=router, model_info=model_info, prompt=prompt,
+                    output_dir=output_dir, checkpoint=checkpoint, max_image_size=max_image_size,
+                    max_file_size_mb=max_file_size_mb, enable_compression=enable_compression,
+                    request_delay=request_delay, verbose=verbose,
+                    timeout=timeout, cancel=cancel, adaptive_ceiling=adaptive_ceiling,
+                )
+
+        groups = pack_groups(pending, pack_size)
+        done_in_pack: set[int] = set()
+        for records, _ in await asyncio.gather(*(_pack(g) for g in groups)):
+            for record in records:
+                done_in_pack.add(record["index"])
+                _emit_skipped(emit, record, total)
+                await _finish(record["index"], record)
+        packed_count = len(done_in_pack)
+        pending = [(idx, img) for idx, img in pending if idx not in done_in_pack]
+        if verbose:
+            console.info(with_icon("info", f"多图打包: {len(groups)} 个请求完成 {packed_count} 张，回退单图 {len(pending)} 张"))
+    # 单路时保留打字机效果；多路并发时关闭，计时日志加 [idx/total] 前缀
+    concurrent = concurrency > 1 and len(pending) > 1
+    log_output = verbose or enable_streaming_print
+    hedge_policy = (
+        HedgePolicy(key=quota_key(api_base_url, model_name), percentile=hedge_percentile, hedge_model=hedge_model)
+        if hedge else None
+    )
+
+    prefetcher: Optional[PreprocessPrefetcher] = None
+    if shared_prefetcher is not None:
+        prefetcher = shared_prefetcher
+    elif preprocess_lookahead > 0 and pending:
+        requested = {idx for idx, _ in pending}
+        prefetcher = PreprocessPrefetcher(
+            [None if idx not in requested else img for idx, img in enumerate(image_files, 1)],
+            max_image_size, max_file_size_mb, enable_compression, preprocess_lookahead,
+            pool=preprocess_pool,
+        )
+    # 没有本次运行专用的预取流水线时（不预取 / 多模型共享流水线），由各图片的预处理结果汇总
+    preprocess_totals: Optional[PreprocessTotals] = None
+    if prefetcher is None or prefetcher is shared_prefetcher:
+        preprocess_totals = PreprocessTotals(
+            shared_prefetcher.backend if shared_prefetcher is not None else BACKEND_THREAD,
+            shared_prefetcher.workers if shared_prefetcher is not None else concurrency,
+        )
+
+    async def _run_one(idx: int, img: Path) -> None:
+        result = await _process_single_image_async(
+            img, idx, total, model_name, model_info, prompt,
+            max_image_size, max_file_size_mb, request_delay, max_retries, retry_delay,
+            api_base_url, timeout, enable_compression, verbose, output_dir, api_key,
+            enable_streaming_print=enable_streaming_print and not concurrent,
+            emit=emit,
+            log_prefix=f"[{idx}/{total}] " if (concurrent and log_output) else "",
+            prefetcher=prefetcher,
+            adaptive_ceiling=adaptive_ceiling,
+            rate_limits=limits,
+            retry_max_delay=retry_max_delay,
+            slot=semaphore,
+            early_stop=early_stop,
+            delta_window_ms=delta_window_ms,
+            delta_max_bytes=delta_max_bytes,
+            output_file=checkpoint.output_file(idx),
+            hedge=hedge_policy,
+            router=router,
+            cancel=cancel,
+            preprocess_totals=preprocess_totals,
+        )
+        await _finish(idx, result)
+
+    # 每张图片完成时已在 _finish 中追加到 run_summary.jsonl，这里只等待全部完成
+    try:
+        await asyncio.gather(*(_run_one(idx, img) for idx, img in pending))
+    finally:
+        if prefetcher is not None and prefetcher is not shared_prefetcher:
+            prefetcher.shutdown()
+    # 结果文件全部落盘后再写汇总，调用方拿到返回值即可读取结果
+    await asyncio.to_thread(get_result_writer().flush)
+    if results_log is not None:
+        await asyncio.to_thread(results_log.close)
+    write_failures = await asyncio.to_thread(_apply_write_failures, writer, checkpoint, verbose)
+    cache_stats.add("evicted", await asyncio.to_thread(cache.prune))
+
+    await asyncio.to_thread(
+        _write_run_summary,
+        output_dir=output_dir, input_dir_path=input_dir_path, start_time=start_time,
+        writer=writer, verbose=verbose,
+        settings={
+            "model_name": model_name, "model_info": model_info, "prompt": prompt,
+            "max_workers": max_workers,
+            "use_streaming": True,
+            "engine": "async",
+            "request_delay": request_delay,
+            "max_retries": max_retries,
+            "retry_delay": retry_delay,
+            "retry_max_delay": retry_max_delay,
+            "enable_compression": enable_compression,
+            "max_image_size": list(max_image_size),
+            "max_file_size_mb": max_file_size_mb,
+            "preprocess_lookahead": preprocess_lookahead,
+            "shared_preprocess": shared_prefetcher is not None,
+            "preprocess_backend": preprocess_backend,
+            "preprocess": preprocess_totals.snapshot() if preprocess_totals is not None else prefetcher.snapshot(),
+            "early_stop": early_stop,
+            "run_id": checkpoint.manifest.run_id,
+            "resume": resume,
+            "resumed_count": len(checkpoint.resumed),
+            "result_cache": cache_stats.as_dict(),
+            "deduplication": writer.dedup_summary(),
+            "pack_size": pack_size,
+            "packed_count": packed_count,
+            "hedging": hedge_policy.stats.as_dict() if hedge_policy is not None else {"enabled": False},
+            "failover": router.summary(),
+            "result_writer": get_result_writer().snapshot(write_failures),
+            "output_layout": output_layout,
+            "results_file": RESULTS_FILENAME if results_log is not None else None,
+            "cancelled": cancel.reason if (cancel is not None and cancel.cancelled) else None,
+            "adaptive_concurrency": (
+                get_concurrency_controller().snapshot(api_base_url, model_name) if adaptive_ceiling else None
+            ),
+            "rate_limits": (
+                get_quota_limiter().snapshot(quota_key(api_base_url, model_name)) if limits else None
+            ),
+        },
+    )
+    return writer.success, writer.failed, output_dir
@@ -0,0 +1,158 @@
+"""
+任务取消模块
+一次批处理对应一个 CancelToken，由客户端断开、DELETE /tasks/{id} 或任务截止时间触发取消
+
+- 取消后尚未开始的图片直接记为失败（error_kind=cancelled），不再发请求
+- 在途流式请求在取消时立即关闭（线程版调用 stream.close()，asyncio 版取消对应协程）
+- 截止时间同时下传为每个请求的超时：请求超时取 min(客户端超时, 剩余时间)
+- 被取消的图片写入失败结果并记入检查点清单，resume 时会重跑
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# 取消原因
+REASON_CLIENT_DISCONNECTED = "client_disconnected"
+REASON_USER = "cancelled_by_user"
+REASON_DEADLINE = "deadline_exceeded"
+
+
+class CancelledRunError(Exception):
+    """任务已取消（不重试）"""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"任务已取消: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """单次运行的取消令牌（线程安全，线程版与 asyncio 版共用）
+
+    deadline_seconds > 0 时从创建起计时，到期自动以 deadline_exceeded 取消。
+    on_cancel 注册的回调在取消时执行一次（已取消时立即执行），用于关闭在途流。
+    """
+
+    def __init__(self, deadline_seconds: Optional[float] = None) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        self.reason: Optional[str] = None
+        self.deadline: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+        if deadline_seconds and deadline_seconds > 0:
+            self.deadline = time.monotonic() + float(deadline_seconds)
+            self._timer = threading.Timer(float(deadline_seconds), self.cancel, args=(REASON_DEADLINE,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = REASON_USER) -> bool:
+        """触发取消，返回是否为首次取消"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+        return True
+
+    def close(self) -> None:
+        """运行结束：停止截止时间计时器"""
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def check(self) -> None:
+        """已取消时抛出 CancelledRunError"""
+        if self._event.is_set():
+            raise self.error()
+
+    def error(self) -> CancelledRunError:
+        return CancelledRunError(self.reason or REASON_USER)
+
+    def wait(self, seconds: float) -> bool:
+        """可被取消打断的 sleep，返回是否已取消"""
+        return self._event.wait(max(0.0, seconds))
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数，没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def request_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        """下传给单个请求的超时：min(客户端超时, 剩余时间)，没有截止时间时返回 None（沿用客户端超时）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        remaining = max(0.001, remaining)
+        return min(timeout, remaining) if timeout else remaining
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消回调，返回注销函数"""
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_id
+                self._next_id += 1
+                self._callbacks[handle] = callback
+                return lambda: self._unregister(handle)
+        try:
+            callback()
+        except Exception:
+            pass
+        return lambda: None
+
+    def _unregister(self, handle: int) -> None:
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+
+class JobRegistry:
+    """进行中的任务（job_id -> CancelToken），供 DELETE /tasks/{id} 取消"""
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def register(self, job_id: str, token: CancelToken) -> None:
+        with self._lock:
+            self._jobs[job_id] = token
+
+    def remove(self, job_id: str) -> None:
+        with self._lock:
+            token = self._jobs.pop(job_id, None)
+        if token is not None:
+            token.close()
+
+    def cancel(self, job_id: str, reason: str = REASON_USER) -> Optional[CancelToken]:
+        """取消任务，任务不存在（或已结束）时返回 None"""
+        with self._lock:
+            token = self._jobs.get(job_id)
+        if token is not None:
+            token.cancel(reason)
+        return token
+
+    def job_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._jobs)
+
+
+_JOB_REGISTRY = JobRegistry()
+
+
+def get_job_registry() -> JobRegistry:
+    """获取全局任务注册表"""
+    return _JOB_REGISTRY
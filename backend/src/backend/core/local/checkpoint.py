@@ -0,0 +1,274 @@
+"""
+断点续跑模块
+按 图片内容哈希 + 提示词 + 模型 记录每张图片的处理结果，支持中断后只重跑失败/缺失的图片
+
+- 清单文件为输出目录下的 run_manifest.jsonl，每处理完一张图片追加一行并立即 flush，
+  进程中途退出时已完成的部分不会丢失
+- 同一 key 以最后一行为准；resume 时 status == "success" 且输出文件仍存在的图片直接跳过
+- 失败/未完成的图片重跑时复用上次的输出文件路径，不会生成 `_结果_1.json` 之类的重复文件
+  （按运行分目录布局时每次运行写入新的运行目录，不复用）
+- 图片哈希按需计算：只有 resume 时在规划阶段全部计算；其余图片在查缓存、批内去重（仅大小相同的）
+  或处理完成追加清单时才计算，每张图片最多算一次
+- resume 读取清单时，被覆盖的旧行超过一半则压缩重写，同一 (key, 图片名) 只保留最后一行
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from backend.core.local.results_log import result_exists
+
+MANIFEST_FILENAME = "run_manifest.jsonl"
+
+# 读取图片计算哈希时的块大小
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """计算文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_files(paths: Sequence[Path], max_workers: Optional[int] = None) -> List[str]:
+    """并行计算多个文件的 sha256（hashlib 处理大块数据时会释放 GIL），按输入顺序返回"""
+    if not paths:
+        return []
+    workers = max_workers or max(1, min(8, os.cpu_count() or 1, len(paths)))
+    if workers == 1:
+        return [file_sha256(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as executor:
+        return list(executor.map(file_sha256, paths))
+
+
+def checkpoint_key(image_sha256: str, prompt: str, model_name: str) -> str:
+    """图片内容 + 提示词 + 模型 共同决定一条处理记录"""
+    prompt_sha = hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{image_sha256}\n{prompt_sha}\n{model_name}".encode("utf-8")).hexdigest()
+
+
+# 同一清单文件的追加与压缩共用一把锁（同一进程内并发的多次运行可能写入同一输出目录）
+_MANIFEST_LOCKS: Dict[Path, threading.Lock] = {}
+_MANIFEST_LOCKS_LOCK = threading.Lock()
+
+
+def _manifest_lock(path: Path) -> threading.Lock:
+    key = path.resolve()
+    with _MANIFEST_LOCKS_LOCK:
+        lock = _MANIFEST_LOCKS.get(key)
+        if lock is None:
+            lock = _MANIFEST_LOCKS[key] = threading.Lock()
+        return lock
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+class RunManifest:
+    """追加写入的检查点清单（线程安全）"""
+
+    def __init__(self, output_dir: Path, run_id: Optional[str] = None) -> None:
+        self.path = Path(output_dir) / MANIFEST_FILENAME
+        self.run_id = run_id or new_run_id()
+        self._lock = _manifest_lock(self.path)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # 同一批次中内容相同的图片共用一个 key，按 (key, 图片名) 再记一份，续跑时各自找回自己的输出文件
+        self._by_name: Dict[tuple[str, str], Dict[str, Any]] = {}
+        self.loaded = False
+
+    def load(self) -> "RunManifest":
+        """读取已有清单；损坏的行（如进程中途退出时写了一半）直接跳过
+
+        被覆盖的旧行与损坏的行超过一半时压缩重写清单（见 _compact）。
+        """
+        self._entries.clear()
+        self._by_name.clear()
+        self.loaded = True
+        with self._lock:
+            if not self.path.is_file():
+                return self
+            lines = 0
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    key = entry.get("key") if isinstance(entry, dict) else None
+                    if key:
+                        self._entries[key] = entry
+                        name_key = (key, entry.get("image_name") or "")
+                        # 重新插入，使字典顺序为各条记录最后出现的顺序
+                        self._by_name.pop(name_key, None)
+                        self._by_name[name_key] = entry
+            if lines - len(self._by_name) >= len(self._by_name) > 0:
+                self._compact()
+        return self
+
+    def _compact(self) -> None:
+        """按 (key, 图片名) 只保留最后一行，写临时文件后替换（调用方持有锁）
+
+        同一 key 下不同图片名的记录都保留（批内重复图片各自的输出文件）；压缩失败不影响本次读取。
+        """
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self._by_name.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+    def completed(self, key: str, image_name: str) -> Optional[Dict[str, Any]]:
+        """该 key 上次成功处理且输出文件仍存在时返回清单记录（优先同名图片的记录），否则 None
+
+        输出文件为空说明结果还没来得及落盘（只有占位文件），视为未完成。
+        """
+        entry = self._by_name.get((key, image_name)) or self._entries.get(key)
+        if not entry or entry.get("status") != "success":
+            return None
+        output_file = entry.get("output_file")
+        if not output_file or not result_exists(Path(output_file)):
+            return None
+        return entry
+
+    def previous_output(self, key: str, image_name: str) -> Optional[Path]:
+        """该 key 上次（失败时）使用的输出文件路径，用于重跑时原地覆盖；图片改名时不复用"""
+        entry = self._by_name.get((key, image_name))
+        if not entry:
+            return None
+        output_file = entry.get("output_file")
+        return Path(output_file) if output_file else None
+
+    def record(self, key: str, image_sha256: str, record: Dict[str, Any]) -> None:
+        """追加一条图片处理结果并立即落盘"""
+        entry = {
+            "key": key,
+            "run_id": self.run_id,
+            "image_sha256": image_sha256,
+            "image_name": record.get("image_name"),
+            "status": record.get("status"),
+            "output_file": record.get("output_file"),
+            "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._entries[key] = entry
+            self._by_name[(key, entry["image_name"] or "")] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+
+
+def resumed_record(idx: int, image_path: Path, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """断点续跑时跳过的图片在 run_summary 中的记录"""
+    return {
+        "index": idx,
+        "image_name": image_path.name,
+        "status": "success",
+        "output_file": entry.get("output_file"),
+        "retries": 0,
+        "resumed": True,
+        "resumed_from_run": entry.get("run_id"),
+    }
+
+
+@dataclass
+class CheckpointPlan:
+    """一次运行的检查点规划：resumed 为可跳过图片（1-based 序号）的记录
+
+    图片哈希按需计算并缓存（image_hash / ensure_hashes），线程安全；同一图片并发请求时可能重复计算，结果相同。
+    """
+    manifest: RunManifest
+    image_files: List[Path]
+    prompt: str
+    model_name: str
+    resumed: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    reuse_outputs: bool = True
+    _hashes: Dict[int, str] = field(default_factory=dict, repr=False)
+    _hash_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def pending(self) -> List[tuple[int, Path]]:
+        """需要（重新）处理的图片，(序号, 路径)"""
+        return [(idx, img) for idx, img in enumerate(self.image_files, 1) if idx not in self.resumed]
+
+    def image_hash(self, idx: int) -> str:
+        """第 idx 张图片内容的 sha256（首次调用时计算）"""
+        with self._hash_lock:
+            digest = self._hashes.get(idx)
+        if digest is None:
+            digest = file_sha256(self.image_files[idx - 1])
+            with self._hash_lock:
+                self._hashes[idx] = digest
+        return digest
+
+    def ensure_hashes(self, indices: Iterable[int]) -> None:
+        """并行计算尚未计算的图片哈希（规划阶段与查缓存前批量调用）"""
+        with self._hash_lock:
+            missing = sorted({idx for idx in indices if idx not in self._hashes})
+        digests = hash_files([self.image_files[idx - 1] for idx in missing])
+        with self._hash_lock:
+            self._hashes.update(zip(missing, digests))
+
+    def key(self, idx: int) -> str:
+        return checkpoint_key(self.image_hash(idx), self.prompt, self.model_name)
+
+    def output_file(self, idx: int) -> Optional[Path]:
+        """断点续跑时该图片上次使用的输出文件（未续跑或没有记录时为 None）"""
+        if not self.manifest.loaded or not self.reuse_outputs:
+            return None
+        return self.manifest.previous_output(self.key(idx), self.image_files[idx - 1].name)
+
+    def record(self, idx: int, record: Dict[str, Any]) -> None:
+        self.manifest.record(self.key(idx), self.image_hash(idx), record)
+
+
+def plan_checkpoint(
+        output_dir: Path,
+        image_files: Sequence[Path],
+        *,
+        prompt: str,
+        model_name: str,
+        resume: bool,
+        reuse_outputs: bool = True,
+        run_id: Optional[str] = None,
+) -> CheckpointPlan:
+    """打开检查点清单；resume 为 True 时读取已有清单并计算全部图片哈希，找出可以跳过的图片
+
+    不续跑时不在这里计算哈希，由之后查缓存、批内去重与追加清单时按需计算（见 CheckpointPlan.image_hash）。
+    reuse_outputs=False 时重跑的图片不复用上次的输出路径（按运行分目录布局）；
+    run_id 为调用方预先分配的运行 ID（默认新建）。
+    """
+    manifest = RunManifest(output_dir, run_id)
+    plan = CheckpointPlan(
+        manifest=manifest, image_files=list(image_files), prompt=prompt, model_name=model_name,
+        reuse_outputs=reuse_outputs,
+    )
+    if resume:
+        manifest.load()
+        plan.ensure_hashes(range(1, len(plan.image_files) + 1))
+        for idx, img in enumerate(plan.image_files, 1):
+            entry = manifest.completed(plan.key(idx), img.name)
+            if entry is not None:
+                plan.resumed[idx] = resumed_record(idx, img, entry)
+    return plan
@@ -10,25 +10,51 @@
 """
 from __future__ import annotations
 
-import json
 import os
-import re
+import queue
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Callable
+from typing import Optional, Dict, Any, List, Callable, Sequence
 
 from backend.core.config import (
     console, with_icon,
     DEFAULT_INPUT_DIR, DEFAULT_PROMPT, DEFAULT_MAX_IMAGE_SIZE,
     DEFAULT_MAX_FILE_SIZE_MB, DEFAULT_REQUEST_DELAY, DEFAULT_MAX_RETRIES,
     DEFAULT_RETRY_DELAY, DEFAULT_ENABLE_COMPRESSION, DEFAULT_VERBOSE, DEFAULT_MAX_WORKERS,
+    DEFAULT_PREPROCESS_LOOKAHEAD, DEFAULT_ADAPTIVE_CONCURRENCY, DEFAULT_RETRY_MAX_DELAY,
+    DEFAULT_EARLY_STOP, DEFAULT_DELTA_WINDOW_MS, DEFAULT_DELTA_MAX_BYTES, DEFAULT_RESUME,
+    DEFAULT_USE_CACHE, DEFAULT_PACK_SIZE, DEFAULT_HEDGE, DEFAULT_HEDGE_PERCENTILE, DEFAULT_OUTPUT_LAYOUT,
+    DEFAULT_PREPROCESS_BACKEND,
 )
-from backend.core.local.api_client import get_rate_limiter, get_client_pool
-from backend.core.local.image_utils import get_image_url, get_image_files
+from backend.core.local.api_client import (
+    get_rate_limiter, get_client_pool, get_concurrency_controller, is_overload_error,
+    get_quota_limiter, parse_rate_limits, quota_key, RateLimits,
+)
+from backend.core.local.cancellation import CancelToken, CancelledRunError
+from backend.core.local.checkpoint import CheckpointPlan, plan_checkpoint
+from backend.core.local.failover import FailoverRouter, Route, build_failover_routes
+from backend.core.local.hedging import HedgePolicy, HedgeReservation, race_first_token
+from backend.core.local.image_utils import get_image_url, get_image_files, PreprocessPrefetcher, PreprocessTotals
 from backend.core.local.result_handler import (
-    get_output_file_path, save_result,
+    reserve_output_file_path, save_result,
+)
+from backend.core.local.output_index import get_output_index
+from backend.core.local.preprocess_pool import (
+    BACKEND_PROCESS, BACKEND_THREAD, PREPROCESS_BACKENDS, PreprocessPool, get_preprocess_pool,
+)
+from backend.core.local.packing import build_packed_messages, pack_groups, save_packed_results, split_packed_output
+from backend.core.local.result_cache import CacheStats, ResultCache, cache_key, get_result_cache
+from backend.core.local.result_writer import get_result_writer
+from backend.core.local.results_log import (
+    LAYOUT_RUN, OUTPUT_LAYOUTS, RESULTS_FILENAME, ResultsLog, open_results_log, run_output_dir,
+)
+from backend.core.local.retry import RetryDecision, RetryPolicy, run_with_deferred_retries
+from backend.core.local.run_summary import RunSummaryWriter, run_header, write_summary_file
+from backend.core.local.stream_session import (
+    StreamSession, build_messages, delta_text, chunk_usage, usage_dict, preprocess_timings,
 )
 from backend.util import project_root as get_project_root
 
@@ -39,492 +65,883 @@ def _preprocess_image(
         max_file_size_mb: int,
         enable_compression: bool,
         verbose: bool,
+        stats: Optional[Dict[str, Any]] = None,
+        pool: Optional[PreprocessPool] = None,
 ) -> str:
-    """预处理图片，包括压缩和编码"""
+    """预处理图片，包括压缩和编码；stats、pool 见 get_image_url"""
     return get_image_url(
         image_path, max_image_size, max_file_size_mb,
-        enable_compression, verbose=verbose
+        enable_compression, verbose=verbose, stats=stats, pool=pool,
     )
 
 
-def _extract_json_from_text(raw_text: str) -> tuple[Any, bool, str]:
-    """
-    从模型输出中容错提取 JSON
-    
-    返回: (parsed_json, is_valid, error_reason)
-    - 成功: (json_obj, True, "")
-    - 失败: (None, False, "错误原因")
+def _preprocess_batch(
+        images: Sequence[Path],
+        max_image_size: tuple[int, int],
+        max_file_size_mb: int,
+        enable_compression: bool,
+        workers: int,
+        pool: Optional[PreprocessPool] = None,
+) -> tuple[Dict[Path, Optional[str]], Dict[str, Any]]:
+    """非流式模式下一次性预处理全部图片，返回 ({图片: data URL}, 预处理统计)
+
+    预处理失败的图片为 None，发起请求时重新预处理并按失败处理；pool 不为 None 时线程数为进程数。
     """
-    if not raw_text or not raw_text.strip():
-        return None, False, "empty_response"
-    
-    stripped = raw_text.strip()
-    candidates = []
-    
-    # 1. 尝试直接解析
-    candidates.append(stripped)
-    
-    # 2. 提取 ```json codeblock
-    if "```" in stripped:
-        # 匹配 ```json ... ``` 或 ``` ... ```
-        codeblock_pattern = r"```(?:json)?\s*([\s\S]*?)```"
-        matches = re.findall(codeblock_pattern, stripped, re.IGNORECASE)
-        for match in matches:
-            candidate = match.strip()
-            if candidate:
-                candidates.append(candidate)
-    
-    # 3. 提取最外层 {} 对象
-    brace_match = re.search(r"\{[\s\S]*\}", stripped)
-    if brace_match:
-        candidates.append(brace_match.group(0))
-    
-    # 4. 提取最外层 [] 数组
-    bracket_match = re.search(r"\[[\s\S]*\]", stripped)
-    if bracket_match:
-        candidates.append(bracket_match.group(0))
-    
-    # 尝试解析每个候选
-    for candidate in candidates:
-        try:
-            parsed = json.loads(candidate)
-            return parsed, True, ""
-        except json.JSONDecodeError:
-            continue
-    
-    return None, False, f"no_valid_json_found (tried {len(candidates)} candidates)"
+    if pool is not None:
+        workers = pool.workers
+    totals = PreprocessTotals(pool.backend if pool is not None else BACKEND_THREAD, workers)
 
+    def run(img: Path) -> Optional[str]:
+        stats: Dict[str, Any] = {}
+        t0 = time.perf_counter()
+        try:
+            url = _preprocess_image(
+                img, max_image_size, max_file_size_mb, enable_compression, False, stats=stats, pool=pool,
+            )
+        except Exception:
+            return None
+        totals.add(time.perf_counter() - t0, stats)
+        return url
 
-def _save_backup_txt(output_dir: Path, image_stem: str, full_text: str) -> Path:
-    """保存原始输出为 .txt 备份文件"""
-    backup_file = output_dir / f"{image_stem}_backup.txt"
-    counter = 1
-    while backup_file.exists():
-        backup_file = output_dir / f"{image_stem}_backup_{counter}.txt"
-        counter += 1
-    
-    with open(backup_file, "w", encoding="utf-8") as f:
-        f.write(full_text)
-    
-    return backup_file
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            urls = list(executor.map(run, images))
+    else:
+        urls = [run(img) for img in images]
+    return dict(zip(images, urls)), totals.snapshot()
 
 
-def _process_single_image_streaming(
-        image_path: Path,
-        idx: int,
-        total: int,
-        model_name: str,
-        model_info: Optional[str],
-        prompt: str,
-        max_image_size: tuple[int, int],
-        max_file_size_mb: int,
-        request_delay: float,
-        max_retries: int,
-        retry_delay: float,
-        api_base_url: str,
-        timeout: Optional[float],
-        enable_compression: bool,
-        verbose: bool,
-        output_dir: Path,
-        api_key: str,
-        preprocessed_image_url: Optional[str] = None,
-        enable_streaming_print: bool = True,
-        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
-) -> Dict[str, Any]:
+class _StreamingImageJob:
     """
-    处理单张图片（真实流式版本）
-    
+    单张图片的流式任务（真实流式版本）
+
     实现：
     - stream=True 真实流式输出
     - TTFT / 生成 / 解析 / 保存 / 全链路 精确计时
     - JSON 容错提取与校验
     - 失败时保存 .txt 备份
-    """
-    client = get_client_pool().get_client(api_key, api_base_url, timeout)
-    rate_limiter = get_rate_limiter()
-    log_output = bool(verbose or enable_streaming_print)
 
-    def _emit(payload: Dict[str, Any]) -> None:
-        if emit is None:
-            return
-        try:
-            emit(payload)
-        except Exception:
-            # 流式输出不应因 UI/回调失败而中断主流程
-            pass
-
-    # 保留原有日志
-    if verbose:
-        console.blank()
-        console.title(with_icon("camera", f"[{idx}/{total}] {image_path.name}"))
-
-    _emit(
-        {
-            "event": "image_start",
-            "index": idx,
-            "total": total,
-            "image_name": image_path.name,
-        }
-    )
+    计时、事件与保存逻辑见 StreamSession，这里只负责驱动同步网络调用。
+    run_attempt() 每次只做一次尝试：成功或不再重试时返回结果记录，需要重试时返回 RetryDecision，
+    由调用方放入延迟重试队列（run_with_deferred_retries），退避期间工作线程继续处理其他图片。
+    并发流式时由调用方传入 log_prefix（如 "[3/20] "），用于区分交错输出的计时日志。
+    adaptive_ceiling 不为空时，请求前需向自适应并发控制器申请名额（上限不超过该值）。
+    early_stop 开启时，流中出现完整的顶层 JSON 即关闭连接，不再为后续说明文字付费与等待。
+    hedge 不为空且已有足够 TTFT 样本时，首个 token 超过阈值未到即发对冲请求（见 hedging 模块）。
+    每次尝试前由 router 选择路由：主端点熔断时改用备用模型，结果计入该端点的熔断器（见 failover 模块）。
+    cancel 触发时不再发起新的尝试，在途的流立即关闭，图片以 cancelled 失败结束（见 cancellation 模块）。
+    """
 
-    output_file = get_output_file_path(output_dir, image_path.stem, extension=".json")
-    retry_count = 0
-    
-    # 计时变量
-    t0 = None  # 请求发起时间
-    t_first = None  # 第一个 token 到达时间
-    t_end_stream = None  # 流式结束时间
-    t_parse_end = None  # JSON 解析结束时间
-    t_save_end = None  # 保存结束时间
-    
-    while retry_count <= max_retries:
+    def __init__(
+            self,
+            *,
+            image_path: Path,
+            idx: int,
+            total: int,
+            model_name: str,
+            model_info: Optional[str],
+            prompt: str,
+            max_image_size: tuple[int, int],
+            max_file_size_mb: int,
+            request_delay: float,
+            retry_policy: RetryPolicy,
+            api_base_url: str,
+            timeout: Optional[float],
+            enable_compression: bool,
+            verbose: bool,
+            output_dir: Path,
+            api_key: str,
+            preprocessed_image_url: Optional[str] = None,
+            enable_streaming_print: bool = True,
+            emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            log_prefix: str = "",
+            prefetcher: Optional[PreprocessPrefetcher] = None,
+            adaptive_ceiling: Optional[int] = None,
+            rate_limits: Optional[RateLimits] = None,
+            early_stop: bool = False,
+            delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+            delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+            output_file: Optional[Path] = None,
+            hedge: Optional[HedgePolicy] = None,
+            router: Optional[FailoverRouter] = None,
+            cancel: Optional[CancelToken] = None,
+            preprocess_totals: Optional[PreprocessTotals] = None,
+    ) -> None:
+        self.image_path = image_path
+        self.idx = idx
+        self.total = total
+        self.model_name = model_name
+        self.model_info = model_info
+        self.prompt = prompt
+        self.max_image_size = max_image_size
+        self.max_file_size_mb = max_file_size_mb
+        self.request_delay = request_delay
+        self.retry_policy = retry_policy
+        self.api_base_url = api_base_url
+        self.enable_compression = enable_compression
+        self.verbose = verbose
+        self.output_dir = output_dir
+        self.preprocessed_image_url = preprocessed_image_url
+        self.enable_streaming_print = enable_streaming_print
+        self.emit = emit
+        self.log_prefix = log_prefix
+        self.prefetcher = prefetcher
+        self.preprocess_totals = preprocess_totals
+        self.adaptive_ceiling = adaptive_ceiling
+        self.rate_limits = rate_limits
+        self.early_stop = early_stop
+        self.delta_window_ms = delta_window_ms
+        self.delta_max_bytes = delta_max_bytes
+        self.output_file = output_file
+        self.hedge = hedge
+        self.timeout = timeout
+        self.cancel = cancel
+        self.router = router or FailoverRouter(Route(
+            label=model_name, model_name=model_name, api_base_url=api_base_url, api_key=api_key,
+            rate_limits=rate_limits, primary=True,
+        ))
+
+        self.rate_limiter = get_rate_limiter()
+        self.controller = get_concurrency_controller() if adaptive_ceiling else None
+        self.session: Optional[StreamSession] = None
+        self.retry_count = 0
+
+    def _start(self) -> StreamSession:
+        """首次尝试时占用输出路径并发 image_start（并发调度下图片真正开始处理时才执行）"""
+        # 保留原有日志
+        if self.verbose:
+            console.blank()
+            console.title(with_icon("camera", f"[{self.idx}/{self.total}] {self.image_path.name}"))
+
+        self.session = StreamSession(
+            image_path=self.image_path, idx=self.idx, total=self.total,
+            model_name=self.model_name, model_info=self.model_info, prompt=self.prompt,
+            output_dir=self.output_dir,
+            output_file=(
+                self.output_file
+                or reserve_output_file_path(self.output_dir, self.image_path.stem, extension=".json")
+            ),
+            verbose=self.verbose, enable_streaming_print=self.enable_streaming_print,
+            emit=self.emit, log_prefix=self.log_prefix, early_stop=self.early_stop,
+            delta_window_ms=self.delta_window_ms, delta_max_bytes=self.delta_max_bytes,
+        )
+        self.session.emit("image_start")
+        return self.session
+
+    def run_attempt(self) -> Dict[str, Any] | RetryDecision:
+        session = self.session or self._start()
+        controller = self.controller
+        holding_slot = False
+        route: Optional[Route] = None
+        route_settled = False
+        hedge_reservation: Optional[HedgeReservation] = None
         try:
-            if retry_count > 0 and verbose:
-                console.warning(with_icon("retry", f"重试({retry_count}/{max_retries})..."))
-                time.sleep(retry_delay)
-
-            # 预处理图片
-            preprocess_seconds = 0.0
-            if preprocessed_image_url is not None:
-                image_url = preprocessed_image_url
+            if self.retry_count > 0 and self.verbose:
+                # 退避期间可能已处理过其他图片，重试日志带上图片序号与文件名
+                prefix = self.log_prefix or f"[{self.idx}/{self.total}] {self.image_path.name} "
+                console.warning(with_icon(
+                    "retry", f"{prefix}重试({self.retry_count}/{self.retry_policy.max_retries})..."
+                ))
+            session.begin_attempt()
+            if self.cancel is not None:
+                self.cancel.check()
+
+            # 预处理图片：首次尝试优先取流水线预取结果，重试时就地重新预处理
+            if self.preprocessed_image_url is not None:
+                image_url = self.preprocessed_image_url
+                session.set_preprocess(0.0)
+            elif self.prefetcher is not None and self.retry_count == 0:
+                t_wait = time.perf_counter()
+                image_url, preprocess_seconds, stats = self.prefetcher.take(self.idx)
+                session.set_preprocess(preprocess_seconds, wait_seconds=time.perf_counter() - t_wait, stats=stats)
             else:
                 t_pre = time.perf_counter()
+                stats = {}
                 image_url = _preprocess_image(
-                    image_path, max_image_size, max_file_size_mb, enable_compression, verbose=False
+                    self.image_path, self.max_image_size, self.max_file_size_mb, self.enable_compression,
+                    verbose=False, stats=stats,
                 )
                 preprocess_seconds = time.perf_counter() - t_pre
+                session.set_preprocess(preprocess_seconds, stats=stats)
+            if self.preprocess_totals is not None and self.preprocessed_image_url is None:
+                self.preprocess_totals.add(preprocess_seconds, stats)
+
+            # 路由：主端点熔断时改用备用模型（全部熔断时抛 CircuitOpenError，按探测时间退避重试）
+            route = self.router.pick()
+            if not route.primary:
+                session.failover(**self.router.failover_event(route))
+            client = get_client_pool().get_client(route.api_key, route.api_base_url, self.timeout)
+            quota = get_quota_limiter() if route.rate_limits is not None else None
+            q_key = quota_key(route.api_base_url, route.model_name)
+
+            # 自适应并发名额 + 速率限制
+            if controller is not None:
+                controller.acquire(route.api_base_url, self.adaptive_ceiling)
+                holding_slot = True
+            self.rate_limiter.wait(route.api_base_url, self.request_delay)
+            reserved_tokens = 0
+            if quota is not None:
+                quota_wait, reserved_tokens = quota.wait(q_key, route.rate_limits)
+                session.set_quota_wait(quota_wait)
+            if self.cancel is not None:
+                self.cancel.check()
 
-            _emit(
-                {
-                    "event": "preprocess_done",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "preprocess_seconds": round(preprocess_seconds, 4),
-                }
-            )
-
-            # 构建消息
-            messages = [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": image_url}},
-                ],
-            }]
-
-            # 等待速率限制
-            rate_limiter.wait(api_base_url, request_delay)
-            
             # ========== 真实流式调用 ==========
-            t0 = time.perf_counter()
-             
-            # 连接/握手耗时：从发起请求到拿到流式响应对象（通常等价于拿到响应头）
-            stream = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                stream=True  # 开启真实流式
-            )
-            t_connected = time.perf_counter()
-            connect_seconds = t_connected - t0
-            _emit(
-                {
-                    "event": "connect_done",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "connect_seconds": round(connect_seconds, 4),
-                }
-            )
-             
-            full_text = ""
-            char_count = 0
-            t_first = None
-            thinking_seconds = None
-             
-            # 流式接收并打印
-            for chunk in stream:
-                # 提取 delta 内容
-                delta_content = ""
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta and hasattr(delta, "content") and delta.content:
-                        delta_content = delta.content
-                
-                if delta_content:
-                    # 记录 TTFT（第一个 token 到达时间）
-                    if t_first is None:
-                        t_first = time.perf_counter()
-                        thinking_seconds = t_first - t_connected
-                        ttft = t_first - t0
-                        if log_output:
-                            print(f"\n[TIME] TTFT={ttft:.3f}s", flush=True)
-                        _emit(
-                            {
-                                "event": "ttft",
-                                "index": idx,
-                                "total": total,
-                                "image_name": image_path.name,
-                                "ttft_seconds": round(ttft, 4),
-                                "thinking_seconds": round(thinking_seconds, 4),
-                            }
-                        )
-
-                    # 打字机效果输出
-                    if enable_streaming_print:
-                        print(delta_content, end="", flush=True)
-                    _emit(
-                        {
-                            "event": "delta",
-                            "index": idx,
-                            "total": total,
-                            "image_name": image_path.name,
-                            "content": delta_content,
-                        }
-                    )
-                     
-                    full_text += delta_content
-                    char_count += len(delta_content)
-            
-            # 流式结束
-            t_end_stream = time.perf_counter()
-            
-            # 如果没有收到任何内容
-            if t_first is None:
-                t_first = t_end_stream
-                if log_output:
-                    print(f"\n[TIME] TTFT=N/A (no content)", flush=True)
-
-            # 打印流式结束统计
-            gen_time = t_end_stream - t_first
-            total_stream_time = t_end_stream - t0
-            if log_output:
-                print(
-                    f"\n[TIME] gen={gen_time:.3f}s total={total_stream_time:.3f}s chars={char_count}",
-                    flush=True,
+            session.mark_request()
+            hedge_after = self.hedge.delay() if (self.hedge is not None and route.primary) else None
+            race = None
+            if hedge_after is None:
+                if self.hedge is not None:
+                    self.hedge.stats.add("requests")
+                stream = self._open_stream(client, route, route.model_name, image_url)
+                session.mark_connected()
+                chunks = stream
+            else:
+                hedge_reservation = HedgeReservation(quota) if quota is not None else None
+                race = race_first_token(
+                    lambda: self._open_stream(client, route, self.model_name, image_url),
+                    lambda: self._open_hedge(client, route, image_url, hedge_reservation),
+                    primary_model=self.model_name,
+                    hedge_model=self.hedge.hedge_model or self.model_name,
+                    hedge_after=hedge_after,
+                    stats=self.hedge.stats,
+                    on_hedge=lambda: session.hedge_started(hedge_after, self.hedge.hedge_model or self.model_name),
+                    cancel=self.cancel,
                 )
-            _emit(
-                {
-                    "event": "stream_done",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "connect_seconds": round(connect_seconds, 4),
-                    "thinking_seconds": round(thinking_seconds or 0.0, 4),
-                    "gen_seconds": round(gen_time, 4),
-                    "stream_total_seconds": round(total_stream_time, 4),
-                    "char_count": char_count,
-                }
-            )
+                stream = race.stream
+                session.mark_connected(at=race.t_connected)
+                chunks = race.chunks_then_rest()
+                if hedge_reservation is not None:
+                    q_key, reserved_tokens = _settle_race_quota(
+                        quota, race, (q_key, reserved_tokens), hedge_reservation.take(),
+                    )
 
-            # ========== JSON 后处理 ==========
-            t_parse_start = time.perf_counter()
-
-            parsed_json, is_valid, error_reason = _extract_json_from_text(full_text)
-            
-            t_parse_end = time.perf_counter()
-            parse_seconds = t_parse_end - t_parse_start
-            
-            if log_output:
-                if is_valid:
-                    print(f"[JSON] parse={parse_seconds:.3f}s valid=True", flush=True)
-                else:
-                    print(f"[JSON] parse={parse_seconds:.3f}s valid=False reason={error_reason}", flush=True)
-            _emit(
-                {
-                    "event": "parse_done",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "parse_seconds": round(parse_seconds, 4),
-                    "json_valid": bool(is_valid),
-                    "error_reason": "" if is_valid else error_reason,
-                }
-            )
+            # 流式接收并打印；任务取消时由取消回调关闭流
+            release_stream = self.cancel.on_cancel(stream.close) if self.cancel is not None else None
+            try:
+                for chunk in chunks:
+                    session.feed(delta_text(chunk))
+                    session.set_usage(chunk_usage(chunk))
+                    if session.should_stop():
+                        stream.close()
+                        break
+            finally:
+                if release_stream is not None:
+                    release_stream()
+            if self.cancel is not None:
+                self.cancel.check()
+            session.finish_stream()
+            route_settled = True
+            session.circuit_changed(self.router.record(route))
+            if self.hedge is not None and route.primary:
+                self.hedge.observe(race.own_ttft() if race is not None else session.ttft())
+                if race is not None:
+                    session.set_hedge(race.name, race.model)
+            if quota is not None:
+                quota.settle(q_key, reserved_tokens, session.used_tokens())
+            if holding_slot:
+                holding_slot = False
+                session.concurrency_changed(controller.release(
+                    route.api_base_url, "success", session.ttft(), model=session.model_name,
+                ))
+
+            # ========== JSON 后处理 / 保存结果 ==========
+            session.parse()
+            session.save()
+            return session.success_record(self.retry_count)
 
-            # ========== 保存结果 ==========
-            t_save_start = time.perf_counter()
+        except Exception as e:
+            if self.cancel is not None and self.cancel.cancelled and not isinstance(e, CancelledRunError):
+                # 取消回调关闭流导致的读取错误按取消处理
+                e = self.cancel.error()
+            _refund_hedge_quota(hedge_reservation)
+            if route is not None and not route_settled:
+                session.circuit_changed(self.router.record(route, e))
+            if holding_slot:
+                outcome = "overload" if is_overload_error(e) else "error"
+                session.concurrency_changed(controller.release(route.api_base_url, outcome))
+            self.retry_count += 1
+            error_msg = str(e)
+            decision = self.retry_policy.decide(e, self.retry_count)
+            session.on_exception(error_msg, self.retry_count, self.retry_policy.max_retries)
+
+            if not decision.retry:
+                session.save_failure(error_msg)
+                return session.failure_record(error_msg, self.retry_count - 1, error_kind=decision.kind)
+            session.retry_scheduled(decision, self.retry_count)
+            return decision
+
+    def _open_stream(self, client: Any, route: Route, model_name: str, image_url: str) -> Any:
+        # 配置了 TPM 时请求流式 usage，用实际用量修正 token 桶
+        request_options: Dict[str, Any] = (
+            {"stream_options": {"include_usage": True}}
+            if (route.rate_limits is not None and route.rate_limits.tpm) else {}
+        )
+        return client.chat.completions.create(
+            model=model_name,
+            messages=build_messages(self.prompt, image_url),
+            stream=True,  # 开启真实流式
+            **request_options,
+            **_deadline_options(self.cancel, self.timeout),
+        )
 
-            if is_valid:
-                # JSON 解析成功，正常保存
-                save_result(
-                    output_file, image_path, model_name, model_info, prompt,
-                    result_json=parsed_json, raw_response=full_text,
+    def _open_hedge(
+            self, client: Any, route: Route, image_url: str, reservation: Optional[HedgeReservation],
+    ) -> Any:
+        """对冲请求：同样经过请求间隔与配额限制（不占自适应并发名额），TPM 预扣记入 reservation"""
+        model_name = self.hedge.hedge_model or self.model_name
+        self.rate_limiter.wait(route.api_base_url, self.request_delay)
+        if reservation is not None:
+            key = quota_key(route.api_base_url, model_name)
+            sleep_s, reserved_tokens = get_quota_limiter().reserve(key, route.rate_limits)
+            if not reservation.hold(key, reserved_tokens):
+                raise RuntimeError("竞速已结束，不再发出对冲请求")
+            time.sleep(sleep_s)
+            if reservation.closed:
+                raise RuntimeError("竞速已结束，不再发出对冲请求")
+        return self._open_stream(client, route, model_name, image_url)
+
+
+class _CompletionImageJob:
+    """单张图片的非流式任务（保留原有逻辑），重试方式与 _StreamingImageJob 一致"""
+
+    def __init__(
+            self,
+            *,
+            image_path: Path,
+            idx: int,
+            total: int,
+            model_name: str,
+            model_info: Optional[str],
+            prompt: str,
+            max_image_size: tuple[int, int],
+            max_file_size_mb: int,
+            request_delay: float,
+            retry_policy: RetryPolicy,
+            api_base_url: str,
+            timeout: Optional[float],
+            enable_compression: bool,
+            verbose: bool,
+            output_dir: Path,
+            api_key: str,
+            preprocessed_image_url: Optional[str] = None,
+            emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            rate_limits: Optional[RateLimits] = None,
+            output_file: Optional[Path] = None,
+            router: Optional[FailoverRouter] = None,
+            cancel: Optional[CancelToken] = None,
+    ) -> None:
+        self.image_path = image_path
+        self.idx = idx
+        self.total = total
+        self.model_name = model_name
+        self.model_info = model_info
+        self.prompt = prompt
+        self.max_image_size = max_image_size
+        self.max_file_size_mb = max_file_size_mb
+        self.request_delay = request_delay
+        self.retry_policy = retry_policy
+        self.api_base_url = api_base_url
+        self.enable_compression = enable_compression
+        self.verbose = verbose
+        self.output_dir = output_dir
+        self.preprocessed_image_url = preprocessed_image_url
+        self.emit = emit
+        self.rate_limits = rate_limits
+        self.timeout = timeout
+        self.cancel = cancel
+        self.router = router or FailoverRouter(Route(
+            label=model_name, model_name=model_name, api_base_url=api_base_url, api_key=api_key,
+            rate_limits=rate_limits, primary=True,
+        ))
+
+        self.rate_limiter = get_rate_limiter()
+        self.output_file = output_file
+        self.started = False
+        self.retry_count = 0
+
+    def run_attempt(self) -> Dict[str, Any] | RetryDecision:
+        from backend.core.local.result_handler import extract_text_from_message, parse_json_from_model_output
+
+        if not self.started:
+            self.started = True
+            if self.verbose:
+                console.blank()
+                console.title(with_icon("camera", f"[{self.idx}/{self.total}] {self.image_path.name}"))
+            if self.output_file is None:
+                self.output_file = reserve_output_file_path(
+                    self.output_dir, self.image_path.stem, extension=".json"
                 )
-                t_save_end = time.perf_counter()
-                save_seconds = t_save_end - t_save_start
-                if log_output:
-                    print(f"[SAVE] save={save_seconds:.3f}s path={output_file}", flush=True)
-
-                # 保留原有日志
-                if verbose:
-                    console.success(with_icon("save", f"已保存 {output_file.name}"))
-            else:
-                # JSON 解析失败，保存备份
-                if log_output:
-                    print(f"[ERR] JSON_PARSE_FAILED reason={error_reason}", flush=True)
+        output_file = self.output_file
+        image_path = self.image_path
+        raw_text = None
+        route: Optional[Route] = None
+        route_settled = False
 
-                # 保存 .txt 备份
-                backup_file = _save_backup_txt(output_dir, image_path.stem, full_text)
+        try:
+            if self.retry_count > 0 and self.verbose:
+                console.warning(with_icon("retry", (
+                    f"[{self.idx}/{self.total}] {self.image_path.name} "
+                    f"重试({self.retry_count}/{self.retry_policy.max_retries})..."
+                )))
+            if self.cancel is not None:
+                self.cancel.check()
 
-                # 同时保存带错误信息的 JSON
-                save_result(
-                    output_file, image_path, model_name, model_info, prompt,
-                    error_msg=f"JSON解析失败: {error_reason}",
-                    raw_response=full_text,
+            preprocess_seconds = 0.0
+            preprocess_stats: Dict[str, Any] = {}
+            if self.preprocessed_image_url is not None:
+                image_url = self.preprocessed_image_url
+            else:
+                t0 = time.perf_counter()
+                image_url = _preprocess_image(
+                    image_path, self.max_image_size, self.max_file_size_mb, self.enable_compression, verbose=False,
+                    stats=preprocess_stats,
                 )
+                preprocess_seconds = time.perf_counter() - t0
 
-                t_save_end = time.perf_counter()
-                save_seconds = t_save_end - t_save_start
-                if log_output:
-                    print(f"[SAVE] save={save_seconds:.3f}s backup={backup_file}", flush=True)
-
-                if verbose:
-                    console.warning(with_icon("warning", f"JSON解析失败，已保存备份: {backup_file.name}"))
-
-            # ========== 全链路耗时 ==========
-            all_time = t_save_end - t0
-            if log_output:
-                print(f"[TIME] all={all_time:.3f}s", flush=True)
-
-            status = "success" if is_valid else "json_parse_failed"
-            _emit(
-                {
-                    "event": "image_done",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "status": status,
-                    "output_file": str(output_file),
-                    "timings": {
-                        "preprocess_seconds": round(preprocess_seconds, 4),
-                        "connect_seconds": round(connect_seconds, 4),
-                        "thinking_seconds": round(thinking_seconds or 0.0, 4),
-                        "ttft_seconds": round((t_first - t0) if t_first else 0, 4),
-                        "gen_seconds": round(gen_time, 4),
-                        "stream_total_seconds": round(total_stream_time, 4),
-                        "parse_seconds": round(parse_seconds, 4),
-                        "save_seconds": round(save_seconds, 4),
-                        "all_seconds": round(all_time, 4),
-                    },
-                }
+            route = self.router.pick()
+            if not route.primary:
+                self._emit({"event": "failover", **self.router.failover_event(route)})
+            client = get_client_pool().get_client(route.api_key, route.api_base_url, self.timeout)
+            quota = get_quota_limiter() if route.rate_limits is not None else None
+            q_key = quota_key(route.api_base_url, route.model_name)
+
+            self.rate_limiter.wait(route.api_base_url, self.request_delay)
+            reserved_tokens = 0
+            if quota is not None:
+                _, reserved_tokens = quota.wait(q_key, route.rate_limits)
+            t_api = time.perf_counter()
+            completion = client.chat.completions.create(
+                model=route.model_name, messages=build_messages(self.prompt, image_url),
+                **_deadline_options(self.cancel, self.timeout),
             )
+            api_seconds = time.perf_counter() - t_api
+            route_settled = True
+            self._emit_circuit(self.router.record(route))
+            if quota is not None:
+                usage = usage_dict(getattr(completion, "usage", None))
+                quota.settle(q_key, reserved_tokens, usage.get("total_tokens") if usage else None)
+            result = completion.choices[0].message
+            raw_text = extract_text_from_message(result)
+            t_parse = time.perf_counter()
+            structured_json = parse_json_from_model_output(raw_text)
+            parse_seconds = time.perf_counter() - t_parse
 
-            # 返回结果
-            return {
-                "index": idx, 
-                "image_name": image_path.name,
-                "status": status,
-                "output_file": str(output_file), 
-                "retries": retry_count,
-                "json_valid": is_valid,
+            t_save = time.perf_counter()
+            save_result(
+                output_file, image_path, route.model_name, self.model_info, self.prompt,
+                result_json=structured_json, raw_response=raw_text, background=True,
+            )
+            save_seconds = time.perf_counter() - t_save
+
+            if self.verbose:
+                console.success(with_icon("save", f"已保存 {output_file.name}"))
+
+            record = {
+                "index": self.idx, "image_name": image_path.name,
+                "status": "success", "output_file": str(output_file), "retries": self.retry_count,
                 "timings": {
                     "preprocess_seconds": round(preprocess_seconds, 4),
-                    "connect_seconds": round(connect_seconds, 4),
-                    "thinking_seconds": round(thinking_seconds or 0.0, 4),
-                    "ttft_seconds": round((t_first - t0) if t_first else 0, 4),
-                    "gen_seconds": round(gen_time, 4),
-                    "stream_total_seconds": round(total_stream_time, 4),
+                    "api_seconds": round(api_seconds, 4),
                     "parse_seconds": round(parse_seconds, 4),
                     "save_seconds": round(save_seconds, 4),
-                    "all_seconds": round(all_time, 4),
+                    **preprocess_timings(preprocess_stats),
                 },
-                "char_count": char_count,
             }
+            if not route.primary:
+                record["failover_model"] = route.label
+            return record
 
         except Exception as e:
-            retry_count += 1
+            if self.cancel is not None and self.cancel.cancelled and not isinstance(e, CancelledRunError):
+                e = self.cancel.error()
+            if route is not None and not route_settled:
+                self._emit_circuit(self.router.record(route, e))
+            self.retry_count += 1
             error_msg = str(e)
-            
-            # 计算已完成阶段的耗时
-            current_time = time.perf_counter()
-            elapsed = current_time - t0 if t0 else 0
-            
-            if log_output:
-                print(
-                    f"[ERR] EXCEPTION retry={retry_count}/{max_retries} elapsed={elapsed:.3f}s error={error_msg}",
-                    flush=True,
+            decision = self.retry_policy.decide(e, self.retry_count)
+            if self.verbose:
+                console.error(with_icon("error", f"错误: {error_msg}"))
+            if not decision.retry:
+                save_result(
+                    output_file, image_path, self.model_name, self.model_info, self.prompt,
+                    error_msg=error_msg, raw_response=raw_text, background=True,
                 )
-            _emit(
-                {
-                    "event": "exception",
-                    "index": idx,
-                    "total": total,
-                    "image_name": image_path.name,
-                    "retry": retry_count,
-                    "max_retries": max_retries,
-                    "elapsed_seconds": round(elapsed, 4),
-                    "error": error_msg,
+                return {
+                    "index": self.idx, "image_name": image_path.name,
+                    "status": "failed", "output_file": str(output_file), "error": error_msg,
+                    "error_kind": decision.kind, "retries": self.retry_count - 1,
                 }
-            )
+            return decision
 
-            if verbose:
-                console.error(with_icon("error", f"错误: {error_msg}"))
+    def _emit(self, event: Dict[str, Any]) -> None:
+        if self.emit is None:
+            return
+        try:
+            self.emit({**event, "index": self.idx, "total": self.total, "image_name": self.image_path.name})
+        except Exception:
+            pass
 
-            if retry_count > max_retries:
-                # 保存错误信息
-                t_save_start = time.perf_counter()
-                
-                # 如果有部分输出，保存备份
-                if 'full_text' in locals() and full_text:
-                    backup_file = _save_backup_txt(output_dir, image_path.stem, full_text)
-                    if log_output:
-                        print(f"[SAVE] backup={backup_file}", flush=True)
+    def _emit_circuit(self, change: Optional[Dict[str, Any]]) -> None:
+        if change is None:
+            return
+        if self.verbose:
+            console.warning(with_icon(
+                "warning", f"端点 {change['endpoint']} 熔断状态: {change['previous_state']} -> {change['state']}"
+            ))
+        self._emit({"event": "circuit", **change})
 
-                save_result(
-                    output_file, image_path, model_name, model_info, prompt,
-                    error_msg=error_msg, raw_response=locals().get("full_text"),
-                )
 
-                t_save_end = time.perf_counter()
-                save_seconds = t_save_end - t_save_start
-                if log_output:
-                    print(f"[SAVE] error_save={save_seconds:.3f}s path={output_file}", flush=True)
-
-                all_time = t_save_end - t0 if t0 else elapsed
-                if log_output:
-                    print(f"[TIME] all={all_time:.3f}s (failed)", flush=True)
-
-                _emit(
-                    {
-                        "event": "image_done",
-                        "index": idx,
-                        "total": total,
-                        "image_name": image_path.name,
-                        "status": "failed",
-                        "output_file": str(output_file),
-                        "error": error_msg,
-                        "timings": {"elapsed_before_fail": round(elapsed, 4)},
-                    }
-                )
+def _settle_race_quota(
+        quota: Any, race: Any, primary: tuple[str, int], hedge: Optional[tuple[str, int]],
+) -> tuple[str, int]:
+    """竞速结束：退还落败一路的 TPM 预扣，返回胜出一路的 (配额 key, 预扣数) 供流结束后按实际用量结算"""
+    if race.hedge and hedge is not None:
+        quota.refund(*primary)
+        return hedge
+    if hedge is not None:
+        quota.refund(*hedge)
+    return primary
+
+
+def _refund_hedge_quota(reservation: Optional[HedgeReservation]) -> None:
+    """竞速失败或被取消：退还对冲请求的预扣（竞速正常结束时已由 _settle_race_quota 处理）"""
+    if reservation is not None and not reservation.closed:
+        held = reservation.take()
+        if held is not None:
+            get_quota_limiter().refund(*held)
+
+
+def _deadline_options(cancel: Optional[CancelToken], timeout: Optional[float]) -> Dict[str, Any]:
+    """任务有截止时间时，把剩余时间下传为本次请求的超时"""
+    request_timeout = cancel.request_timeout(timeout) if cancel is not None else None
+    return {"timeout": request_timeout} if request_timeout is not None else {}
+
+
+def _call_cancellable(cancel: Optional[CancelToken], call: Callable[[], Any]) -> Any:
+    """执行非流式请求；任务取消时立即抛出 CancelledRunError
+
+    非流式请求没有可关闭的流：请求在后台线程中继续，直到返回或按截止时间超时，其结果被丢弃。
+    """
+    if cancel is None:
+        return call()
+    outcomes: "queue.Queue[tuple[Any, Optional[BaseException]]]" = queue.Queue()
+
+    def run() -> None:
+        try:
+            outcomes.put((call(), None))
+        except Exception as e:
+            outcomes.put((None, e))
+
+    threading.Thread(target=run, daemon=True, name="cancellable-request").start()
+    release = cancel.on_cancel(lambda: outcomes.put((None, cancel.error())))
+    try:
+        result, error = outcomes.get()
+    finally:
+        release()
+    if error is not None:
+        raise error
+    return result
+
+
+def _emit_skipped(emit: Optional[Callable[[Dict[str, Any]], None]], record: Dict[str, Any], total: int) -> None:
+    """未走单图请求的图片（续跑跳过/缓存命中/批内去重/打包请求）直接发 image_done，并带上对应标记"""
+    if emit is None:
+        return
+    event = {
+        "event": "image_done", "index": record["index"], "total": total,
+        "image_name": record["image_name"], "status": record["status"],
+        "output_file": record["output_file"],
+    }
+    for flag in ("resumed", "cached", "deduplicated", "packed"):
+        if record.get(flag):
+            event[flag] = True
+    try:
+        emit(event)
+    except Exception:
+        pass
+
+
+def _cache_params(
+        api_base_url: Optional[str],
+        max_image_size: tuple[int, int],
+        max_file_size_mb: int,
+        enable_compression: bool,
+        early_stop: bool,
+) -> Dict[str, Any]:
+    """参与缓存键的请求参数：端点、决定实际发送图片的压缩设置，以及是否提前关闭流（输出可能被截断）"""
+    return {
+        "api_base_url": api_base_url,
+        "max_image_size": list(max_image_size),
+        "max_file_size_mb": max_file_size_mb,
+        "enable_compression": enable_compression,
+        "early_stop": early_stop,
+    }
+
+
+def _serve_from_cache(
+        *,
+        cache: ResultCache,
+        keys: Dict[int, str],
+        pending: List[tuple[int, Path]],
+        checkpoint: CheckpointPlan,
+        output_dir: Path,
+        model_name: str,
+        model_info: Optional[str],
+        prompt: str,
+) -> tuple[Dict[int, Dict[str, Any]], List[tuple[int, Path]]]:
+    """查询结果缓存，命中的图片直接写出结果文件；返回 (命中记录, 仍需请求的图片)
+
+    只做文件 I/O，不发事件，asyncio 引擎可整体放到线程池执行。
+    """
+    hits: Dict[int, Dict[str, Any]] = {}
+    remaining: List[tuple[int, Path]] = []
+    for idx, img in pending:
+        t0 = time.perf_counter()
+        entry = cache.get(keys[idx])
+        if entry is None:
+            remaining.append((idx, img))
+            continue
+        output_file = checkpoint.output_file(idx) or reserve_output_file_path(output_dir, img.stem, extension=".json")
+        save_result(output_file, img, model_name, model_info, prompt, result_json=entry.get("result"), background=True)
+        hits[idx] = {
+            "index": idx, "image_name": img.name,
+            "status": "success", "output_file": str(output_file), "retries": 0,
+            "cached": True,
+            "timings": {"cache_seconds": round(time.perf_counter() - t0, 4)},
+        }
+        checkpoint.record(idx, hits[idx])
+    return hits, remaining
+
+
+def _cacheable(record: Dict[str, Any]) -> bool:
+    """该结果是否可以写入缓存（先判断再计算缓存键，不可写入时不必计算图片哈希）
+
+    对冲请求由备用模型胜出、或故障转移到备用模型的结果不属于本模型，不写入缓存；
+    打包请求（pack_size > 1）的结果来自包装后的提示词，与单图请求的缓存键不对应，不写入缓存；
+    提前关闭流（early_stop）的结果只有答案通过增量提取器的围栏/开头判定时才写入。
+    """
+    if record.get("status") != "success" or record.get("cached") or not record.get("output_file"):
+        return False
+    if record.get("hedge_model") or record.get("failover_model") or record.get("packed"):
+        return False
+    if record.get("early_stopped") and not record.get("json_anchored"):
+        return False
+    return True
+
+
+def _store_in_cache(cache: ResultCache, key: str, record: Dict[str, Any], model_name: str) -> bool:
+    """把成功解析的结果写入缓存（从刚保存的结果读取，尚未落盘时取写盘队列中的内容），返回是否写入
+
+    调用方先用 _cacheable 判断。
+    """
+    try:
+        payload = get_result_writer().load(Path(record["output_file"]))
+        if payload.get("status") != "success" or payload.get("result") is None:
+            return False
+        cache.put(key, {"model_name": model_name, "result": payload["result"]})
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _split_duplicates(
+        pending: List[tuple[int, Path]],
+        checkpoint: CheckpointPlan,
+) -> tuple[List[tuple[int, Path]], Dict[int, List[tuple[int, Path]]]]:
+    """按内容哈希去重：返回 (每组第一张组成的待请求列表, {组内第一张序号: 其余重复图片})
+
+    先按文件大小分组，只计算大小相同的图片的哈希（大小不同的内容必然不同）；读不到大小的图片不参与去重。
+    """
+    by_size: Dict[int, List[int]] = {}
+    for idx, img in pending:
+        try:
+            by_size.setdefault(img.stat().st_size, []).append(idx)
+        except OSError:
+            continue
+    candidates = {idx for group in by_size.values() if len(group) > 1 for idx in group}
+    checkpoint.ensure_hashes(candidates)
+
+    first_by_hash: Dict[str, int] = {}
+    unique: List[tuple[int, Path]] = []
+    duplicates: Dict[int, List[tuple[int, Path]]] = {}
+    for idx, img in pending:
+        if idx not in candidates:
+            unique.append((idx, img))
+            continue
+        primary = first_by_hash.setdefault(checkpoint.image_hash(idx), idx)
+        if primary == idx:
+            unique.append((idx, img))
+        else:
+            duplicates.setdefault(primary, []).append((idx, img))
+    return unique, duplicates
+
+
+def _fan_out(
+        result: Dict[str, Any],
+        duplicates: List[tuple[int, Path]],
+        *,
+        checkpoint: CheckpointPlan,
+        output_dir: Path,
+) -> List[Dict[str, Any]]:
+    """把一次请求的结果复制给内容相同的其他图片：各自写一份结果文件并生成 deduplicated 记录"""
+    if not duplicates:
+        return []
+    writer = get_result_writer()
+    payload: Optional[Dict[str, Any]] = None
+    if result.get("output_file"):
+        try:
+            payload = writer.load(Path(result["output_file"]))
+        except (OSError, ValueError):
+            payload = None
+
+    timings = result.get("timings") or {}
+    saved_seconds = timings.get("all_seconds")
+    if saved_seconds is None:
+        saved_seconds = sum(v for v in timings.values() if isinstance(v, (int, float)) and not isinstance(v, bool))
+    usage = result.get("usage") or {}
+
+    records = []
+    for idx, img in duplicates:
+        output_file: Optional[Path] = None
+        if payload is not None:
+            output_file = checkpoint.output_file(idx) or reserve_output_file_path(
+                output_dir, img.stem, extension=".json"
+            )
+            copy = dict(payload, image_name=img.name)
+            copy["context"] = dict(payload.get("context") or {}, image_path=str(img))
+            writer.submit(output_file, copy)
+        record = {
+            "index": idx, "image_name": img.name,
+            "status": result["status"],
+            "output_file": str(output_file) if output_file else None,
+            "retries": 0,
+            "deduplicated": True,
+            "duplicate_of": result.get("image_name"),
+            "saved_seconds": round(float(saved_seconds or 0.0), 4),
+        }
+        if usage.get("total_tokens"):
+            record["saved_tokens"] = usage["total_tokens"]
+        for field in ("error", "error_kind"):
+            if result.get(field):
+                record[field] = result[field]
+        checkpoint.record(idx, record)
+        records.append(record)
+    return records
+
+
+def _run_pack(
+        group: List[tuple[int, Path]],
+        *,
+        router: FailoverRouter,
+        model_info: Optional[str],
+        prompt: str,
+        output_dir: Path,
+        checkpoint: CheckpointPlan,
+        max_image_size: tuple[int, int],
+        max_file_size_mb: int,
+        enable_compression: bool,
+        request_delay: float,
+        verbose: bool,
+        timeout: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+        adaptive_ceiling: Optional[int] = None,
+) -> tuple[List[Dict[str, Any]], List[tuple[int, Path]]]:
+    """发送一个多图打包请求并拆分保存，返回 (成功记录, 需回退为单图请求的图片)
+
+    打包请求本身不重试：任何异常都让整组回退，由单图任务按原有策略重试。
+    与单图请求一样经过 router 选路（结果计入熔断器）、自适应并发名额与配额限制；失败时退还 TPM 预扣。
+    任务取消时立即放弃等待整组回退（单图任务随即以 cancelled 结束），请求超时同样受截止时间限制。
+    """
+    from backend.core.local.result_handler import extract_text_from_message
+
+    controller = get_concurrency_controller() if adaptive_ceiling else None
+    holding_slot = False
+    route: Optional[Route] = None
+    route_settled = False
+    quota = None
+    q_key = ""
+    reserved_tokens = 0
+    try:
+        t_pre = time.perf_counter()
+        image_urls = [
+            _preprocess_image(img, max_image_size, max_file_size_mb, enable_compression, False) for _, img in group
+        ]
+        preprocess_seconds = time.perf_counter() - t_pre
+
+        route = router.pick()
+        client = get_client_pool().get_client(route.api_key, route.api_base_url, timeout)
+        quota = get_quota_limiter() if route.rate_limits is not None else None
+        q_key = quota_key(route.api_base_url, route.model_name)
+        if controller is not None:
+            controller.acquire(route.api_base_url, adaptive_ceiling)
+            holding_slot = True
+        get_rate_limiter().wait(route.api_base_url, request_delay)
+        if quota is not None:
+            _, reserved_tokens = quota.wait(q_key, route.rate_limits)
+        if cancel is not None:
+            cancel.check()
+        t_api = time.perf_counter()
+        completion = _call_cancellable(cancel, lambda: client.chat.completions.create(
+            model=route.model_name, messages=build_packed_messages(prompt, image_urls),
+            **_deadline_options(cancel, timeout),
+        ))
+        api_seconds = time.perf_counter() - t_api
+        route_settled = True
+        router.record(route)
+        if quota is not None:
+            usage = usage_dict(getattr(completion, "usage", None))
+            quota.settle(q_key, reserved_tokens, usage.get("total_tokens") if usage else None)
+            reserved_tokens = 0
+        if holding_slot:
+            holding_slot = False
+            controller.release(route.api_base_url, "success", model=route.model_name)
+        raw_text = extract_text_from_message(completion.choices[0].message)
+    except Exception as e:
+        if cancel is not None and cancel.cancelled and not isinstance(e, CancelledRunError):
+            e = cancel.error()
+        if route is not None and not route_settled:
+            router.record(route, e)
+        if holding_slot:
+            controller.release(route.api_base_url, "overload" if is_overload_error(e) else "error")
+        if quota is not None and reserved_tokens:
+            quota.refund(q_key, reserved_tokens)
+        if verbose:
+            console.warning(with_icon("warning", f"打包请求失败，{len(group)} 张回退为单图请求: {e}"))
+        return [], list(group)
+
+    t_parse = time.perf_counter()
+    slots = split_packed_output(raw_text, len(group))
+    parse_seconds = time.perf_counter() - t_parse
+    records, fallback = save_packed_results(
+        group, slots, output_dir=output_dir,
+        output_files={idx: checkpoint.output_file(idx) for idx, _ in group},
+        model_name=route.model_name, model_info=model_info, prompt=prompt,
+        timings=_pack_timings(len(group), preprocess_seconds, api_seconds, parse_seconds),
+    )
+    return _mark_failover(records, route), fallback
+
+
+def _mark_failover(records: List[Dict[str, Any]], route: Route) -> List[Dict[str, Any]]:
+    """打包请求走了备用模型时，在每条记录上标记 failover_model（与单图请求一致）"""
+    if not route.primary:
+        for record in records:
+            record["failover_model"] = route.label
+    return records
 
-                return {
-                    "index": idx, 
-                    "image_name": image_path.name,
-                    "status": "failed", 
-                    "output_file": str(output_file), 
-                    "error": error_msg, 
-                    "retries": retry_count - 1,
-                    "timings": {
-                        "elapsed_before_fail": round(elapsed, 4),
-                    },
-                }
-             
-            time.sleep(retry_delay)
 
-    # 不应该到达这里
+def _pack_timings(count: int, preprocess_seconds: float, api_seconds: float, parse_seconds: float) -> Dict[str, float]:
+    """打包请求的计时：pack_* 为整个请求的耗时，其余为均摊到每张图片的耗时"""
     return {
-        "index": idx, 
-        "image_name": image_path.name, 
-        "status": "failed",
-        "output_file": None, 
-        "error": "未知错误", 
-        "retries": max_retries
+        "preprocess_seconds": round(preprocess_seconds / count, 4),
+        "api_seconds": round(api_seconds / count, 4),
+        "parse_seconds": round(parse_seconds / count, 4),
+        "pack_api_seconds": round(api_seconds, 4),
+        "pack_parse_seconds": round(parse_seconds, 4),
     }
 
 
-# 保留原有的非流式版本作为备用
-def _process_single_image(
+def _make_image_job(
         image_path: Path,
         idx: int,
         total: int,
@@ -546,146 +963,65 @@ def _process_single_image(
         use_streaming: bool = True,
         enable_streaming_print: bool = True,
         emit: Optional[Callable[[Dict[str, Any]], None]] = None,
-) -> Dict[str, Any]:
+        log_prefix: str = "",
+        prefetcher: Optional[PreprocessPrefetcher] = None,
+        adaptive_ceiling: Optional[int] = None,
+        rate_limits: Optional[RateLimits] = None,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        early_stop: bool = DEFAULT_EARLY_STOP,
+        delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+        delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+        output_file: Optional[Path] = None,
+        hedge: Optional[HedgePolicy] = None,
+        router: Optional[FailoverRouter] = None,
+        cancel: Optional[CancelToken] = None,
+        preprocess_totals: Optional[PreprocessTotals] = None,
+) -> _StreamingImageJob | _CompletionImageJob:
     """
-    处理单张图片（入口函数）
-    
-    默认使用流式版本，可通过 use_streaming=False 切换到非流式
+    创建单张图片任务（入口函数）
+
+    默认使用流式版本，可通过 use_streaming=False 切换到非流式；
+    retry_delay 为首次退避时间，之后指数增长到 retry_max_delay（见 RetryPolicy）；
+    output_file 不为空时直接写入该文件（断点续跑重跑失败图片时复用上次的路径）；
+    hedge 仅作用于流式版本；router 为本次运行共享的故障转移路由器（为空时只用主模型）；
+    preprocess_totals 仅作用于流式版本，累计请求线程内的预处理（没有本次运行专用的预取流水线时用于运行汇总）
     """
+    retry_policy = RetryPolicy(max_retries=max_retries, base_delay=retry_delay, max_delay=retry_max_delay)
+    common = dict(
+        image_path=image_path, idx=idx, total=total,
+        model_name=model_name, model_info=model_info, prompt=prompt,
+        max_image_size=max_image_size, max_file_size_mb=max_file_size_mb,
+        request_delay=request_delay, retry_policy=retry_policy,
+        api_base_url=api_base_url, timeout=timeout, enable_compression=enable_compression,
+        verbose=verbose, output_dir=output_dir, api_key=api_key,
+        preprocessed_image_url=preprocessed_image_url, emit=emit, rate_limits=rate_limits,
+        output_file=output_file, router=router, cancel=cancel,
+    )
     if use_streaming:
-        return _process_single_image_streaming(
-            image_path=image_path,
-            idx=idx,
-            total=total,
-            model_name=model_name,
-            model_info=model_info,
-            prompt=prompt,
-            max_image_size=max_image_size,
-            max_file_size_mb=max_file_size_mb,
-            request_delay=request_delay,
-            max_retries=max_retries,
-            retry_delay=retry_delay,
-            api_base_url=api_base_url,
-            timeout=timeout,
-            enable_compression=enable_compression,
-            verbose=verbose,
-            output_dir=output_dir,
-            api_key=api_key,
-            preprocessed_image_url=preprocessed_image_url,
+        return _StreamingImageJob(
+            **common,
             enable_streaming_print=enable_streaming_print,
-            emit=emit,
+            log_prefix=log_prefix,
+            prefetcher=prefetcher,
+            adaptive_ceiling=adaptive_ceiling,
+            early_stop=early_stop,
+            delta_window_ms=delta_window_ms,
+            delta_max_bytes=delta_max_bytes,
+            hedge=hedge,
+            preprocess_totals=preprocess_totals,
         )
-    
-    # 非流式版本（保留原有逻辑）
-    from backend.core.local.result_handler import extract_text_from_message, parse_json_from_model_output
-    
-    client = get_client_pool().get_client(api_key, api_base_url, timeout)
-    rate_limiter = get_rate_limiter()
-
-    if verbose:
-        console.blank()
-        console.title(with_icon("camera", f"[{idx}/{total}] {image_path.name}"))
+    return _CompletionImageJob(**common)
 
-    output_file = get_output_file_path(output_dir, image_path.stem, extension=".json")
-    retry_count = 0
 
-    while retry_count <= max_retries:
-        try:
-            if retry_count > 0 and verbose:
-                console.warning(with_icon("retry", f"重试({retry_count}/{max_retries})..."))
-                time.sleep(retry_delay)
-
-            preprocess_seconds = 0.0
-            if preprocessed_image_url is not None:
-                image_url = preprocessed_image_url
-            else:
-                t0 = time.perf_counter()
-                image_url = _preprocess_image(
-                    image_path, max_image_size, max_file_size_mb, enable_compression, verbose=False
-                )
-                preprocess_seconds = time.perf_counter() - t0
-
-            messages = [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": image_url}},
-                ],
-            }]
-
-            rate_limiter.wait(api_base_url, request_delay)
-            t_api = time.perf_counter()
-            completion = client.chat.completions.create(model=model_name, messages=messages)
-            api_seconds = time.perf_counter() - t_api
-            result = completion.choices[0].message
-            raw_text = extract_text_from_message(result)
-            t_parse = time.perf_counter()
-            structured_json = parse_json_from_model_output(raw_text)
-            parse_seconds = time.perf_counter() - t_parse
-
-            t_save = time.perf_counter()
-            save_result(
-                output_file, image_path, model_name, model_info, prompt,
-                result_json=structured_json, raw_response=raw_text,
-            )
-            save_seconds = time.perf_counter() - t_save
-
-            if verbose:
-                console.success(with_icon("save", f"已保存 {output_file.name}"))
-
-            return {
-                "index": idx, "image_name": image_path.name,
-                "status": "success", "output_file": str(output_file), "retries": retry_count,
-                "timings": {
-                    "preprocess_seconds": round(preprocess_seconds, 4),
-                    "api_seconds": round(api_seconds, 4),
-                    "parse_seconds": round(parse_seconds, 4),
-                    "save_seconds": round(save_seconds, 4),
-                },
-            }
-
-        except Exception as e:
-            retry_count += 1
-            error_msg = str(e)
-            if verbose:
-                console.error(with_icon("error", f"错误: {error_msg}"))
-            if retry_count > max_retries:
-                save_result(
-                    output_file, image_path, model_name, model_info, prompt,
-                    error_msg=error_msg, raw_response=locals().get("raw_text"),
-                )
-                return {
-                    "index": idx, "image_name": image_path.name,
-                    "status": "failed", "output_file": None, "error": error_msg, "retries": retry_count - 1,
-                }
-            time.sleep(retry_delay)
-
-    return {"index": idx, "image_name": image_path.name, "status": "failed",
-            "output_file": None, "error": "未知错误", "retries": max_retries}
-
-
-def process_images_with_cloud_api(
+def _prepare_run(
         *,
         model_name: str,
-        model_info: Optional[str] = None,
-        input_dir: str = DEFAULT_INPUT_DIR,
-        prompt: str = DEFAULT_PROMPT,
-        max_image_size=DEFAULT_MAX_IMAGE_SIZE,
-        max_file_size_mb: int = DEFAULT_MAX_FILE_SIZE_MB,
-        request_delay: float = DEFAULT_REQUEST_DELAY,
-        max_retries: int = DEFAULT_MAX_RETRIES,
-        retry_delay: float = DEFAULT_RETRY_DELAY,
-        api_base_url: Optional[str] = None,
-        timeout: Optional[float] = 60.0,
-        enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
-        verbose: bool = DEFAULT_VERBOSE,
-        max_workers: int = DEFAULT_MAX_WORKERS,
-        api_key_env: Optional[str] = None,
-        use_streaming: bool = True,
-        enable_streaming_print: bool = True,
-        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
-):
-    """对输入文件夹中的图片逐张调用云API模型，保存结果并返回统计信息"""
+        input_dir: str,
+        api_key_env: Optional[str],
+        api_base_url: Optional[str],
+        verbose: bool,
+) -> tuple[Path, Path, Path, str]:
+    """解析输出/输入目录并校验密钥配置，返回 (project_root, output_dir, input_dir_path, api_key)"""
     project_root = get_project_root()
 
     # 输出目录
@@ -713,110 +1049,66 @@ def process_images_with_cloud_api(
     if verbose:
         console.detail(with_icon("info", f"使用环境变量键: {api_key_env}"))
         console.detail(with_icon("info", f"API Base: {api_base_url}"))
-        if use_streaming:
-            console.detail(with_icon("info", "模式: 流式输出 (streaming)"))
 
-    image_files = get_image_files(input_dir_path, project_root)
+    return project_root, output_dir, input_dir_path, api_key
+
+
+def _check_output_layout(output_layout: str) -> None:
+    if output_layout not in OUTPUT_LAYOUTS:
+        raise ValueError(f"Unknown output_layout {output_layout!r}; expected one of {', '.join(OUTPUT_LAYOUTS)}.")
+
+
+def _open_preprocess_pool(preprocess_backend: str, shared: bool) -> Optional[PreprocessPool]:
+    """校验预处理后端；process 后端且不使用共享流水线时返回进程池（首次使用时启动工作进程，与后续准备工作重叠）"""
+    if preprocess_backend not in PREPROCESS_BACKENDS:
+        raise ValueError(
+            f"Unknown preprocess_backend {preprocess_backend!r}; expected one of {', '.join(PREPROCESS_BACKENDS)}."
+        )
+    if preprocess_backend != BACKEND_PROCESS or shared:
+        return None
+    return get_preprocess_pool()
+
+
+def _open_output_layout(
+        output_dir: Path, run_id: str, output_layout: str, verbose: bool,
+) -> tuple[Path, Optional[ResultsLog]]:
+    """按运行分目录时切换到本次运行的目录并打开 results.jsonl，返回 (结果目录, results_log)"""
+    if output_layout != LAYOUT_RUN:
+        return output_dir, None
+    run_dir = run_output_dir(output_dir, run_id)
+    results_log = open_results_log(run_dir)
     if verbose:
-        console.info(with_icon("image_list", f"找到 {len(image_files)} 张图片"))
-        console.blank()
+        console.detail(with_icon("info", f"运行目录: {run_dir}"))
+    return run_dir, results_log
 
-    start_time = datetime.now()
-    run_records: List[Dict[str, Any]] = []
-    success_count = 0
-    fail_count = 0
-    total = len(image_files)
 
-    # 并行预处理所有图片
-    # 注意：流式模式下为了输出更清晰且需要精确计时（含 preprocess），这里不做提前预处理。
-    preprocessed_images: Dict[Path, Optional[str]] = {}
-    if use_streaming:
-        for img in image_files:
-            preprocessed_images[img] = None
-    else:
-        if max_workers > 1:
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {
-                    executor.submit(
-                        _preprocess_image,
-                        img,
-                        max_image_size,
-                        max_file_size_mb,
-                        enable_compression,
-                        False,
-                    ): img
-                    for img in image_files
-                }
-                for future in futures:
-                    img = futures[future]
-                    try:
-                        preprocessed_images[img] = future.result()
-                    except Exception:
-                        preprocessed_images[img] = None
-        else:
-            for img in image_files:
-                try:
-                    preprocessed_images[img] = _preprocess_image(
-                        img,
-                        max_image_size,
-                        max_file_size_mb,
-                        enable_compression,
-                        False,
-                    )
-                except Exception:
-                    preprocessed_images[img] = None
+def _apply_write_failures(writer: RunSummaryWriter, checkpoint: CheckpointPlan, verbose: bool) -> Dict[str, str]:
+    """结果文件全部落盘后核对本次运行的写入失败：对应图片在运行汇总与检查点清单中改记为失败（resume 时重跑）"""
+    failures = get_result_writer().take_failures(writer.success_files())
+    if failures:
+        for record in writer.mark_failed(failures):
+            checkpoint.record(record["index"], record)
+        if verbose:
+            console.warning(with_icon("warning", f"{len(failures)} 个结果文件写入失败，对应图片计为失败"))
+    return failures
 
-    # 处理图片（流式模式下建议串行，避免输出混乱）
-    if use_streaming:
-        # 流式模式：串行处理，保证输出清晰
-        for idx, img in enumerate(image_files, 1):
-            result = _process_single_image(
-                img, idx, total, model_name, model_info, prompt,
-                max_image_size, max_file_size_mb, request_delay, max_retries, retry_delay,
-                api_base_url, timeout, enable_compression, verbose, output_dir, api_key,
-                preprocessed_images[img],
-                use_streaming=True,
-                enable_streaming_print=enable_streaming_print,
-                emit=emit,
-            )
-            run_records.append(result)
-            if result["status"] == "success":
-                success_count += 1
-            else:
-                fail_count += 1
-    elif max_workers > 1:
-        # 非流式模式：可并行
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(
-                    _process_single_image, img, idx, total, model_name, model_info, prompt,
-                    max_image_size, max_file_size_mb, request_delay, max_retries, retry_delay,
-                    api_base_url, timeout, enable_compression, verbose, output_dir, api_key,
-                    preprocessed_images[img], False
-                )
-                for idx, img in enumerate(image_files, 1)
-            ]
-            for future in futures:
-                result = future.result()
-                run_records.append(result)
-                if result["status"] == "success":
-                    success_count += 1
-                else:
-                    fail_count += 1
-    else:
-        for idx, img in enumerate(image_files, 1):
-            result = _process_single_image(
-                img, idx, total, model_name, model_info, prompt,
-                max_image_size, max_file_size_mb, request_delay, max_retries, retry_delay,
-                api_base_url, timeout, enable_compression, verbose, output_dir, api_key,
-                preprocessed_images[img], use_streaming=False
-            )
-            run_records.append(result)
-            if result["status"] == "success":
-                success_count += 1
-            else:
-                fail_count += 1
 
+def _write_run_summary(
+        *,
+        output_dir: Path,
+        input_dir_path: Path,
+        start_time: datetime,
+        writer: RunSummaryWriter,
+        verbose: bool,
+        settings: Dict[str, Any],
+) -> Dict[str, Any]:
+    """打印完成统计，为本次运行的 run_summary.<run_id>.jsonl 写入 footer 并替换精简的 run_summary.json；
+    settings 为本次运行的参数快照
+
+    逐图记录已在各图片完成时追加到 jsonl，run_summary.json 不再包含 images。
+    """
+    totals = writer.totals()
+    success_count, fail_count, total = totals["success"], totals["failed"], totals["all"]
     end_time = datetime.now()
     elapsed_seconds = (end_time - start_time).total_seconds()
     avg_per_image = elapsed_seconds / total if total > 0 else 0.0
@@ -828,30 +1120,346 @@ def process_images_with_cloud_api(
         console.info(with_icon("success", f"成功: {success_count} 张"))
         console.info(with_icon("warning", f"失败: {fail_count} 张"))
         console.info(with_icon("info", f"总耗时: {elapsed_seconds:.2f} 秒，平均每张: {avg_per_image:.2f} 秒"))
+        preprocess = settings.get("preprocess")
+        if preprocess and preprocess.get("images_per_core_second"):
+            console.info(with_icon("info", (
+                f"预处理: {preprocess['processed']} 张，{preprocess['images_per_core_second']} 张/核·秒"
+                f"（{preprocess['backend']} x{preprocess['workers']}）"
+            )))
         console.info(with_icon("output", f"结果保存在: {output_dir.resolve()}"))
         console.banner("=" * 60)
 
     summary = {
-        "model_name": model_name, "model_info": model_info, "prompt": prompt,
+        "model_name": settings.get("model_name"),
+        "model_info": settings.get("model_info"),
+        "prompt": settings.get("prompt"),
         "run_started_at": start_time.strftime("%Y-%m-%d %H:%M:%S"),
         "run_finished_at": end_time.strftime("%Y-%m-%d %H:%M:%S"),
         "elapsed_seconds": elapsed_seconds,
         "avg_seconds_per_image": avg_per_image,
-        "max_workers": max_workers,
-        "use_streaming": use_streaming,
-        "request_delay": request_delay,
-        "max_retries": max_retries,
-        "retry_delay": retry_delay,
-        "enable_compression": enable_compression,
-        "max_image_size": list(max_image_size),
-        "max_file_size_mb": max_file_size_mb,
+    }
+    summary.update({k: v for k, v in settings.items() if k not in summary})
+    summary.update({
         "input_dir": str(input_dir_path.resolve()),
         "output_dir": str(output_dir.resolve()),
-        "totals": {"success": success_count, "failed": fail_count, "all": total},
-        "images": run_records,
-    }
-    summary_path = output_dir / "run_summary.json"
-    with open(summary_path, "w", encoding="utf-8") as f:
-        json.dump(summary, f, ensure_ascii=False, indent=2)
+        "totals": totals,
+        "images_file": str(writer.path.resolve()),
+    })
+    writer.close({
+        "run_finished_at": summary["run_finished_at"],
+        "elapsed_seconds": elapsed_seconds,
+        "avg_seconds_per_image": avg_per_image,
+        "totals": totals,
+    })
+    write_summary_file(output_dir, summary)
+    # 本次运行的文件都已写完，保存输出目录索引（下次启动时免扫描）
+    get_output_index(output_dir).save()
+    return summary
+
+
+def process_images_with_cloud_api(
+        *,
+        model_name: str,
+        model_info: Optional[str] = None,
+        input_dir: str = DEFAULT_INPUT_DIR,
+        prompt: str = DEFAULT_PROMPT,
+        max_image_size=DEFAULT_MAX_IMAGE_SIZE,
+        max_file_size_mb: int = DEFAULT_MAX_FILE_SIZE_MB,
+        request_delay: float = DEFAULT_REQUEST_DELAY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        api_base_url: Optional[str] = None,
+        timeout: Optional[float] = 60.0,
+        enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
+        verbose: bool = DEFAULT_VERBOSE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        api_key_env: Optional[str] = None,
+        use_streaming: bool = True,
+        enable_streaming_print: bool = True,
+        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        preprocess_lookahead: int = DEFAULT_PREPROCESS_LOOKAHEAD,
+        adaptive_concurrency: bool = DEFAULT_ADAPTIVE_CONCURRENCY,
+        rate_limits: Optional[Dict[str, Any] | RateLimits] = None,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        early_stop: bool = DEFAULT_EARLY_STOP,
+        delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+        delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+        resume: bool = DEFAULT_RESUME,
+        use_cache: bool = DEFAULT_USE_CACHE,
+        pack_size: int = DEFAULT_PACK_SIZE,
+        shared_prefetcher: Optional[PreprocessPrefetcher] = None,
+        hedge: bool = DEFAULT_HEDGE,
+        hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        hedge_model: Optional[str] = None,
+        failover: Optional[Sequence[Dict[str, Any]]] = None,
+        cancel: Optional[CancelToken] = None,
+        output_layout: str = DEFAULT_OUTPUT_LAYOUT,
+        preprocess_backend: str = DEFAULT_PREPROCESS_BACKEND,
+        run_id: Optional[str] = None,
+):
+    """对输入文件夹中的图片逐张调用云API模型，保存结果并返回统计信息
+
+    流式模式下 preprocess_lookahead > 0 时启用预处理流水线（见 PreprocessPrefetcher）；
+    adaptive_concurrency 开启时，max_workers 为并发上限，实际在途流数由 AIMD 控制器按端点调整；
+    rate_limits 为 models.yml 中的 rate_limit 配置（RPM/TPM 令牌桶，见 QuotaRateLimiter）；
+    失败按错误类别决定是否重试，退避从 retry_delay 指数增长到 retry_max_delay（见 retry.RetryPolicy）；
+    early_stop 仅作用于流式模式，完整 JSON 到达后立即关闭流；
+    delta_window_ms / delta_max_bytes 控制 emit 中 delta 事件的合并粒度（均为 0 时逐块发送）；
+    每张图片完成后追加写入检查点清单，resume 开启时跳过上次已成功的图片（见 checkpoint 模块）；
+    发起请求前先查结果缓存，use_cache=False 时跳过查询、只写入新结果（见 result_cache 模块）；
+    pack_size > 1 时先按每组 pack_size 张发送多图打包请求，拆分失败的图片再走单图请求（见 packing 模块）；
+    shared_prefetcher 为多模型对比时各模型共享的预处理流水线（由调用方创建与关闭）；
+    hedge 开启时（仅流式），首个 token 超过最近 TTFT 的 hedge_percentile 百分位仍未到达即发对冲请求，
+    hedge_model 为对冲请求使用的同端点备用模型，默认与主请求相同（见 hedging 模块）。
+    failover 为已解析的备用模型列表（models.yml 中的 failover），主端点熔断时按顺序改用（见 failover 模块）。
+    cancel 为本次运行的取消令牌：取消后剩余图片以 cancelled 失败结束，在途的流立即关闭（见 cancellation 模块）。
+    output_layout="run" 时结果写入 runs/<run_id>/results.jsonl，返回值中的输出目录为该运行目录（见 results_log 模块）。
+    preprocess_backend="process" 时预处理流水线与非流式批量预处理在进程池中压缩图片（见 preprocess_pool 模块），
+    使用 shared_prefetcher 时以共享流水线为准；重试与多图打包仍在请求线程内预处理。
+    run_id 为调用方预先分配的运行 ID（默认新建），之后可用 read_run_summary(output_dir, run_id=...)
+    读取本次运行自己的汇总，不受同一模型目录下并发运行的影响。
+    """
+    _check_output_layout(output_layout)
+    preprocess_pool = _open_preprocess_pool(preprocess_backend, shared_prefetcher is not None)
+    project_root, output_dir, input_dir_path, api_key = _prepare_run(
+        model_name=model_name, input_dir=input_dir, api_key_env=api_key_env,
+        api_base_url=api_base_url, verbose=verbose,
+    )
+    limits = parse_rate_limits(rate_limits)
+    if verbose and limits is not None:
+        console.detail(with_icon("info", f"配额限制: rpm={limits.rpm} tpm={limits.tpm}"))
+    if verbose and use_streaming:
+        mode = f"并发流式 x{max_workers}" if max_workers > 1 else "流式输出"
+        console.detail(with_icon("info", f"模式: {mode} (streaming)"))
+
+    image_files = get_image_files(input_dir_path, project_root)
+    if verbose:
+        console.info(with_icon("image_list", f"找到 {len(image_files)} 张图片"))
+        console.blank()
+
+    start_time = datetime.now()
+    total = len(image_files)
+
+    checkpoint = plan_checkpoint(
+        output_dir, image_files, prompt=prompt, model_name=model_name, resume=resume,
+        reuse_outputs=output_layout != LAYOUT_RUN, run_id=run_id,
+    )
+    output_dir, results_log = _open_output_layout(output_dir, checkpoint.manifest.run_id, output_layout, verbose)
+    pending = checkpoint.pending()
+    if verbose and resume:
+        console.info(with_icon("info", f"断点续跑: 跳过已完成 {len(checkpoint.resumed)} 张，待处理 {len(pending)} 张"))
+    writer = RunSummaryWriter(output_dir, run_header(
+        model_name=model_name, model_info=model_info, prompt=prompt, start_time=start_time,
+        input_dir_path=input_dir_path, output_dir=output_dir, run_id=checkpoint.manifest.run_id, total=total,
+    ))
+    # 无需请求的图片（断点续跑已完成 + 缓存命中）
+    skipped: Dict[int, Dict[str, Any]] = dict(checkpoint.resumed)
+
+    cache = get_result_cache()
+    cache_stats = CacheStats(enabled=use_cache)
+    params = _cache_params(
+        api_base_url, max_image_size, max_file_size_mb, enable_compression, early_stop and use_streaming,
+    )
+
+    def _cache_key(idx: int) -> str:
+        return cache_key(checkpoint.image_hash(idx), prompt, model_name, params)
+
+    if use_cache and pending:
+        checkpoint.ensure_hashes(idx for idx, _ in pending)
+        hits, pending = _serve_from_cache(
+            cache=cache, keys={idx: _cache_key(idx) for idx, _ in pending}, pending=pending,
+            checkpoint=checkpoint, output_dir=output_dir,
+            model_name=model_name, model_info=model_info, prompt=prompt,
+        )
+        skipped.update(hits)
+        cache_stats.add("hits", len(hits))
+        cache_stats.add("misses", len(pending))
+        if verbose and hits:
+            console.info(with_icon("info", f"结果缓存: 命中 {len(hits)} 张，待请求 {len(pending)} 张"))
+    for idx in sorted(skipped):
+        _emit_skipped(emit, skipped[idx], total)
+        writer.add(skipped[idx])
+    # 批内内容相同的图片只请求一次，结果复制给其余图片
+    pending, duplicates = _split_duplicates(pending, checkpoint)
+    if verbose and duplicates:
+        console.info(with_icon("info", f"批内去重: {sum(map(len, duplicates.values()))} 张与其他图片内容相同，不再单独请求"))
+
+    def _finish(idx: int, result: Dict[str, Any]) -> None:
+        """图片得到最终结果：追加检查点清单与运行汇总、写入结果缓存并复制给批内重复图片"""
+        checkpoint.record(idx, result)
+        writer.add(result)
+        if _cacheable(result) and _store_in_cache(cache, _cache_key(idx), result, model_name):
+            cache_stats.add("stores")
+        for record in _fan_out(result, duplicates.get(idx, []), checkpoint=checkpoint, output_dir=output_dir):
+            writer.add(record)
+            _emit_skipped(emit, record, total)
+
+    # 自适应并发仅作用于流式运行（含其中的打包请求）；串行时无并发可调
+    adaptive_ceiling = max_workers if (adaptive_concurrency and use_streaming and max_workers > 1) else None
+    router = FailoverRouter(
+        Route(label=model_name, model_name=model_name, api_base_url=api_base_url, api_key=api_key,
+              rate_limits=limits, primary=True),
+        build_failover_routes(failover, verbose=verbose),
+    )
+
+    # 多图打包：每 pack_size 张合并为一个请求，拆分失败的图片回退为下面的单图请求
+    packed_count = 0
+    if pack_size > 1 and len(pending) > 1:
+        def _pack(group: List[tuple[int, Path]]) -> tuple[List[Dict[str, Any]], List[tuple[int, Path]]]:
+            if cancel is not None and cancel.cancelled:
+                return [], group
+            return _run_pack(
+                group, router=router, model_info=model_info, prompt=prompt,
+                output_dir=output_dir, checkpoint=checkpoint, max_image_size=max_image_size,
+                max_file_size_mb=max_file_size_mb, enable_compression=enable_compression,
+                request_delay=request_delay, verbose=verbose,
+                timeout=timeout, cancel=cancel, adaptive_ceiling=adaptive_ceiling,
+            )
+
+        groups = pack_groups(pending, pack_size)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            pack_outcomes = list(executor.map(_pack, groups))
+        done_in_pack: set[int] = set()
+        for records, _ in pack_outcomes:
+            for record in records:
+                done_in_pack.add(record["index"])
+                _emit_skipped(emit, record, total)
+                _finish(record["index"], record)
+        packed_count = len(done_in_pack)
+        pending = [(idx, img) for idx, img in pending if idx not in done_in_pack]
+        if verbose:
+            console.info(with_icon("info", f"多图打包: {len(groups)} 个请求完成 {packed_count} 张，回退单图 {len(pending)} 张"))
+
+    # 并行预处理所有图片
+    # 注意：流式模式下不做一次性全量预处理，而是用有界前瞻流水线与网络请求重叠，
+    # preprocess_seconds 在流水线线程内实际执行处计时。
+    preprocessed_images: Dict[Path, Optional[str]] = {}
+    prefetcher: Optional[PreprocessPrefetcher] = None
+    preprocess_stats: Optional[Dict[str, Any]] = None
+    preprocess_totals: Optional[PreprocessTotals] = None
+    if use_streaming:
+        for img in image_files:
+            preprocessed_images[img] = None
+        requested = {idx for idx, _ in pending}
+        if shared_prefetcher is not None:
+            prefetcher = shared_prefetcher
+        elif preprocess_lookahead > 0 and pending:
+            prefetcher = PreprocessPrefetcher(
+                [None if idx not in requested else img for idx, img in enumerate(image_files, 1)],
+                max_image_size, max_file_size_mb, enable_compression, preprocess_lookahead,
+                pool=preprocess_pool,
+            )
+        # 没有本次运行专用的预取流水线时（不预取 / 多模型共享流水线），由各图片的预处理结果汇总
+        if prefetcher is None or prefetcher is shared_prefetcher:
+            preprocess_totals = PreprocessTotals(
+                shared_prefetcher.backend if shared_prefetcher is not None else BACKEND_THREAD,
+                shared_prefetcher.workers if shared_prefetcher is not None else max_workers,
+            )
+    else:
+        batch_images, preprocess_stats = _preprocess_batch(
+            [img for _, img in pending], max_image_size, max_file_size_mb, enable_compression,
+            max_workers, preprocess_pool,
+        )
+        preprocessed_images.update(batch_images)
+
+    def _checkpointed(job: _StreamingImageJob | _CompletionImageJob) -> Callable[[], Any]:
+        """包装单次尝试：得到最终结果后立即落盘"""
+        def attempt() -> Dict[str, Any] | RetryDecision:
+            outcome = job.run_attempt()
+            if not isinstance(outcome, RetryDecision):
+                _finish(job.idx, outcome)
+            return outcome
+        return attempt
+
+    concurrent = max_workers > 1 and len(pending) > 1
+    hedge_policy = (
+        HedgePolicy(key=quota_key(api_base_url, model_name), percentile=hedge_percentile, hedge_model=hedge_model)
+        if (hedge and use_streaming) else None
+    )
 
-    return success_count, fail_count, output_dir
+    try:
+        jobs = [
+            _make_image_job(
+                img, idx, total, model_name, model_info, prompt,
+                max_image_size, max_file_size_mb, request_delay, max_retries, retry_delay,
+                api_base_url, timeout, enable_compression, verbose, output_dir, api_key,
+                preprocessed_images[img],
+                use_streaming=use_streaming,
+                enable_streaming_print=enable_streaming_print and not concurrent,
+                emit=emit,
+                log_prefix=f"[{idx}/{total}] " if (concurrent and (verbose or enable_streaming_print)) else "",
+                prefetcher=prefetcher,
+                adaptive_ceiling=adaptive_ceiling,
+                rate_limits=limits,
+                retry_max_delay=retry_max_delay,
+                early_stop=early_stop,
+                delta_window_ms=delta_window_ms,
+                delta_max_bytes=delta_max_bytes,
+                output_file=checkpoint.output_file(idx),
+                hedge=hedge_policy,
+                router=router,
+                cancel=cancel,
+                preprocess_totals=preprocess_totals,
+            )
+            for idx, img in pending
+        ]
+        # 流式与非流式均按 max_workers 并行（串行即 1 个工作线程，保留打字机效果）。
+        # 并发时每张图的 preprocess/TTFT/gen/parse/save 都在各自线程内独立计时，互不影响；
+        # 逐字打印会交错成乱码，因此关闭打字机效果，计时日志加 [idx/total] 前缀区分。
+        # 失败的图片进入延迟重试队列退避，工作线程继续处理其他图片（串行时同样不原地等待）。
+        run_with_deferred_retries([_checkpointed(job) for job in jobs], max_workers, cancel=cancel)
+    finally:
+        if prefetcher is not None and prefetcher is not shared_prefetcher:
+            prefetcher.shutdown()
+    # 结果文件全部落盘后再写汇总，调用方拿到返回值即可读取结果
+    get_result_writer().flush()
+    if results_log is not None:
+        results_log.close()
+    write_failures = _apply_write_failures(writer, checkpoint, verbose)
+    cache_stats.add("evicted", cache.prune())
+
+    _write_run_summary(
+        output_dir=output_dir, input_dir_path=input_dir_path, start_time=start_time,
+        writer=writer, verbose=verbose,
+        settings={
+            "model_name": model_name, "model_info": model_info, "prompt": prompt,
+            "max_workers": max_workers,
+            "use_streaming": use_streaming,
+            "engine": "thread",
+            "request_delay": request_delay,
+            "max_retries": max_retries,
+            "retry_delay": retry_delay,
+            "retry_max_delay": retry_max_delay,
+            "enable_compression": enable_compression,
+            "max_image_size": list(max_image_size),
+            "max_file_size_mb": max_file_size_mb,
+            "preprocess_lookahead": preprocess_lookahead if use_streaming else 0,
+            "shared_preprocess": shared_prefetcher is not None,
+            "preprocess_backend": preprocess_backend,
+            "preprocess": (
+                preprocess_totals.snapshot() if preprocess_totals is not None
+                else prefetcher.snapshot() if prefetcher is not None else preprocess_stats
+            ),
+            "early_stop": early_stop and use_streaming,
+            "run_id": checkpoint.manifest.run_id,
+            "resume": resume,
+            "resumed_count": len(checkpoint.resumed),
+            "result_cache": cache_stats.as_dict(),
+            "deduplication": writer.dedup_summary(),
+            "pack_size": pack_size,
+            "packed_count": packed_count,
+            "hedging": hedge_policy.stats.as_dict() if hedge_policy is not None else {"enabled": False},
+            "failover": router.summary(),
+            "result_writer": get_result_writer().snapshot(write_failures),
+            "output_layout": output_layout,
+            "results_file": RESULTS_FILENAME if results_log is not None else None,
+            "cancelled": cancel.reason if (cancel is not None and cancel.cancelled) else None,
+            "adaptive_concurrency": (
+                get_concurrency_controller().snapshot(api_base_url, model_name) if adaptive_ceiling else None
+            ),
+            "rate_limits": (
+                get_quota_limiter().snapshot(quota_key(api_base_url, model_name)) if limits else None
+            ),
+        },
+    )
+    return writer.success, writer.failed, output_dir
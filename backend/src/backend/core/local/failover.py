@@ -0,0 +1,120 @@
+"""
+故障转移模块
+按 models.yml 中模型的 failover 列表，在主端点熔断时把图片路由到其他厂商的等价模型
+
+- 熔断按端点（api_base_url）统计，见 api_client.CircuitBreaker
+- 每次尝试发请求前选择路由：主模型所在端点放行时用主模型，否则按 failover 顺序取第一个放行的端点
+- 全部熔断时抛出 CircuitOpenError，由重试策略按距下一次探测的时间退避
+- 缺少 API Key 环境变量的备用模型在运行开始时剔除
+
+models.yml 示例（provider:model 字符串或 {provider, model}）：
+
+    failover:
+      - "aliyun:qwen_vl_max"
+      - provider: modelscope
+        model: qwen3-vl-30b-a3b-instruct
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from backend.core.config import console, with_icon
+from backend.core.local.api_client import (
+    CircuitBreaker, CircuitOpenError, RateLimits, get_circuit_breaker, parse_rate_limits,
+)
+from backend.core.local.retry import classify_error
+
+# 计入熔断的失败类别（端点健康问题）；429 由配额/自适应并发处理，4xx 与输出解析失败与端点健康无关
+BREAKER_FAILURE_KINDS = frozenset({"server_error", "timeout", "connection"})
+
+
+@dataclass(frozen=True)
+class Route:
+    """一次请求的目标：模型 + 端点 + 密钥"""
+    label: str
+    model_name: str
+    api_base_url: str
+    api_key: str
+    rate_limits: Optional[RateLimits] = None
+    primary: bool = False
+
+
+def build_failover_routes(failover: Optional[Sequence[Dict[str, Any]]], *, verbose: bool = False) -> List[Route]:
+    """把已解析的备用模型配置（processor.resolve_model 的返回值 + label）转换为路由，缺少密钥的剔除"""
+    routes: List[Route] = []
+    for target in failover or ():
+        api_key = os.environ.get(target.get("env_key") or "")
+        if not api_key or not target.get("api_base_url"):
+            if verbose:
+                console.warning(with_icon(
+                    "warning", f"备用模型 {target.get('label')} 缺少 API Key 或 API Base，已跳过"
+                ))
+            continue
+        routes.append(Route(
+            label=target["label"],
+            model_name=target["model_name"],
+            api_base_url=target["api_base_url"],
+            api_key=api_key,
+            rate_limits=parse_rate_limits(target.get("rate_limit")),
+        ))
+    return routes
+
+
+class FailoverRouter:
+    """单次运行的路由器（线程安全）：选择路由、记录结果并统计故障转移次数"""
+
+    def __init__(
+            self,
+            primary: Route,
+            fallbacks: Sequence[Route] = (),
+            breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.primary = primary
+        self.fallbacks = list(fallbacks)
+        self.breaker = breaker or get_circuit_breaker()
+        self._routed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def pick(self) -> Route:
+        """选择本次尝试的路由；主端点与所有备用端点都熔断时抛出 CircuitOpenError"""
+        for route in (self.primary, *self.fallbacks):
+            if self.breaker.allow(route.api_base_url):
+                if not route.primary:
+                    with self._lock:
+                        self._routed[route.label] = self._routed.get(route.label, 0) + 1
+                return route
+        raise CircuitOpenError(self.primary.api_base_url, self.breaker.retry_in(self.primary.api_base_url))
+
+    def record(self, route: Route, exc: Optional[BaseException] = None) -> Optional[Dict[str, Any]]:
+        """记录请求结果（exc 为 None 表示成功），返回熔断状态变化"""
+        if exc is None:
+            outcome = "success"
+        else:
+            outcome = "failure" if classify_error(exc) in BREAKER_FAILURE_KINDS else "neutral"
+        return self.breaker.record(route.api_base_url, outcome)
+
+    def failover_event(self, route: Route) -> Dict[str, Any]:
+        """故障转移事件的字段"""
+        return {
+            "from_model": self.primary.label,
+            "to_model": route.label,
+            "model_name": route.model_name,
+            "reason": f"circuit_{self.breaker.state(self.primary.api_base_url)}",
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """写入 run_summary.json 的故障转移统计与各端点熔断状态"""
+        endpoints = {}
+        for route in (self.primary, *self.fallbacks):
+            endpoints.setdefault(route.api_base_url, self.breaker.snapshot(route.api_base_url))
+        with self._lock:
+            routed = dict(self._routed)
+        return {
+            "targets": [route.label for route in self.fallbacks],
+            "routed": routed,
+            "failover_count": sum(routed.values()),
+            "breakers": endpoints,
+        }
@@ -0,0 +1,137 @@
+"""
+多模型对比模块
+同一批图片同时交给多个模型处理时的目标解析与合并汇总
+
+- 预处理只做一次：各模型共享同一个 PreprocessPrefetcher（consumers=模型数）
+- 各模型并发运行，速率限制/自适应并发仍按各自的端点与模型独立生效
+- 合并汇总写入 data/outputs/_fanout/fanout_<时间>.json，images 中每行一张图片，
+  每个模型一组 <provider:model>.status / .ttft_seconds / .all_seconds 列
+"""
+from __future__ import annotations
+
+import json
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+# 合并汇总中每个模型的逐图计时列
+TIMING_COLUMNS = ("ttft_seconds", "all_seconds")
+# 非流式记录的分段计时
+_COMPLETION_STAGES = ("preprocess_seconds", "api_seconds", "parse_seconds", "save_seconds")
+
+
+def parse_model_targets(spec: str | Sequence[str] | Sequence[Sequence[str]]) -> List[tuple[str, str]]:
+    """解析 "provider:model,provider:model"（或其列表）为去重后的 [(provider, model), ...]"""
+    if isinstance(spec, str):
+        items: List[Any] = [part for part in spec.split(",")]
+    else:
+        items = list(spec)
+
+    targets: List[tuple[str, str]] = []
+    for item in items:
+        if isinstance(item, str):
+            item = item.strip()
+            if not item:
+                continue
+            provider, sep, model = item.partition(":")
+            if not sep or not provider.strip() or not model.strip():
+                raise ValueError(f"模型格式应为 provider:model，实际为 {item!r}")
+            target = (provider.strip(), model.strip())
+        else:
+            provider, model = item
+            target = (str(provider), str(model))
+        if target not in targets:
+            targets.append(target)
+    if not targets:
+        raise ValueError("至少需要一个 provider:model")
+    return targets
+
+
+def target_label(provider: str, model: str) -> str:
+    return f"{provider}:{model}"
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法百分位，空列表返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return round(ordered[rank], 4)
+
+
+def _image_seconds(record: Dict[str, Any], column: str) -> Optional[float]:
+    timings = record.get("timings") or {}
+    value = timings.get(column)
+    if value is None and column == "all_seconds":
+        # 非流式记录没有 all_seconds，用各段耗时之和近似
+        parts = [timings[k] for k in _COMPLETION_STAGES if isinstance(timings.get(k), (int, float))]
+        value = sum(parts) if parts else None
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def combine_run_summaries(
+        runs: Sequence[Dict[str, Any]],
+        *,
+        start_time: datetime,
+        preprocess: Dict[str, Any],
+) -> Dict[str, Any]:
+    """合并各模型的 run_summary，runs 中每项为 {"provider", "model", "summary"}（失败时为 {"error"}）"""
+    end_time = datetime.now()
+    models: List[Dict[str, Any]] = []
+    rows: Dict[str, Dict[str, Any]] = {}
+
+    for run in runs:
+        label = target_label(run["provider"], run["model"])
+        summary = run.get("summary") or {}
+        records = summary.get("images") or []
+        column = {"provider": run["provider"], "model": run["model"], "label": label}
+        if run.get("error"):
+            column["error"] = run["error"]
+            models.append(column)
+            continue
+
+        live = [r for r in records if not (r.get("resumed") or r.get("cached") or r.get("deduplicated"))]
+        ttfts = [v for v in (_image_seconds(r, "ttft_seconds") for r in live) if v]
+        alls = [v for v in (_image_seconds(r, "all_seconds") for r in live) if v is not None]
+        column.update({
+            "model_name": summary.get("model_name"),
+            "output_dir": summary.get("output_dir"),
+            "totals": summary.get("totals"),
+            "elapsed_seconds": summary.get("elapsed_seconds"),
+            "avg_seconds_per_image": summary.get("avg_seconds_per_image"),
+            "ttft_p50_seconds": _percentile(ttfts, 50),
+            "ttft_p95_seconds": _percentile(ttfts, 95),
+            "all_p50_seconds": _percentile(alls, 50),
+            "all_p95_seconds": _percentile(alls, 95),
+        })
+        models.append(column)
+
+        for record in records:
+            name = record.get("image_name") or ""
+            row = rows.setdefault(name, {"image_name": name})
+            row[f"{label}.status"] = record.get("status")
+            for timing in TIMING_COLUMNS:
+                row[f"{label}.{timing}"] = _image_seconds(record, timing)
+
+    return {
+        "mode": "fanout",
+        "run_started_at": start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "run_finished_at": end_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed_seconds": (end_time - start_time).total_seconds(),
+        "preprocess": preprocess,
+        "models": models,
+        "images": [rows[name] for name in sorted(rows)],
+    }
+
+
+def write_fanout_summary(project_root: Path, summary: Dict[str, Any]) -> Path:
+    """写入 data/outputs/_fanout/fanout_<时间>.json，返回文件路径"""
+    out_dir = project_root / "data" / "outputs" / "_fanout"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"fanout_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json"
+    summary["summary_file"] = str(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return path
@@ -0,0 +1,394 @@
+"""
+对冲请求模块
+流式请求迟迟等不到首个 token 时再发一份相同的请求，哪一路先出 token 就用哪一路，另一路立即关闭
+
+- 触发阈值：同一端点+模型最近 TTFT 的第 P 百分位（积累到 min_samples 个样本后才启用，且不低于 min_delay）
+- 对冲请求可改用同一端点下的备用模型（hedge_model），结果文件记录实际出结果的模型
+- 对冲请求同样经过请求间隔与 RPM/TPM 配额限制，但不占用自适应并发名额；
+  胜出一路的 TPM 预扣按实际用量结算，落败一路的预扣退还（HedgeReservation）
+- 每次运行的请求数、触发次数、对冲胜出次数与被关闭的请求数写入 run_summary.json 的 hedging
+
+竞速只覆盖“发请求 -> 首个 token”阶段；胜出的一路交回调用方继续按原逻辑接收剩余内容。
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import queue
+import threading
+import time
+from collections import deque
+from itertools import chain
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from backend.core.config import DEFAULT_HEDGE_PERCENTILE, DEFAULT_HEDGE_MIN_SAMPLES, DEFAULT_HEDGE_MIN_DELAY
+from backend.core.local.cancellation import CancelToken
+from backend.core.local.stream_session import delta_text
+
+# 每个端点+模型保留的最近 TTFT 样本数
+TTFT_WINDOW = 50
+# 竞速等待期间检查取消的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class TTFTTracker:
+    """按 端点+模型 记录最近的 TTFT（线程安全），用于计算对冲阈值"""
+
+    def __init__(self, window: int = TTFT_WINDOW) -> None:
+        self._window = max(1, int(window))
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, ttft_seconds: Optional[float]) -> None:
+        if ttft_seconds is None or ttft_seconds <= 0:
+            return
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self._window)).append(float(ttft_seconds))
+
+    def percentile(self, key: str, pct: float, min_samples: int) -> Optional[float]:
+        """最近秩法百分位；样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(key) or ())
+        if not samples or len(samples) < max(1, min_samples):
+            return None
+        rank = max(0, min(len(samples) - 1, math.ceil(pct / 100.0 * len(samples)) - 1))
+        return samples[rank]
+
+
+class HedgeStats:
+    """单次运行的对冲统计（线程安全），写入 run_summary.json"""
+
+    def __init__(self, *, percentile: float, hedge_model: Optional[str]) -> None:
+        self.percentile = percentile
+        self.hedge_model = hedge_model
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.wasted = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "percentile": self.percentile,
+            "hedge_model": self.hedge_model,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.hedged - self.hedge_wins,
+            "wasted_requests": self.wasted,
+            "wasted_ratio": round(self.wasted / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class HedgePolicy:
+    """单次运行的对冲配置：阈值计算 + 统计，由引擎创建后传给每个流式任务"""
+
+    def __init__(
+            self,
+            *,
+            key: str,
+            percentile: float = DEFAULT_HEDGE_PERCENTILE,
+            min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+            min_delay: float = DEFAULT_HEDGE_MIN_DELAY,
+            hedge_model: Optional[str] = None,
+            tracker: Optional[TTFTTracker] = None,
+    ) -> None:
+        self.key = key
+        self.percentile = float(percentile)
+        self.min_samples = int(min_samples)
+        self.min_delay = float(min_delay)
+        self.hedge_model = hedge_model or None
+        self.tracker = tracker or get_ttft_tracker()
+        self.stats = HedgeStats(percentile=self.percentile, hedge_model=self.hedge_model)
+
+    def delay(self) -> Optional[float]:
+        """本次请求的对冲等待时间；样本不足时返回 None（不对冲）"""
+        threshold = self.tracker.percentile(self.key, self.percentile, self.min_samples)
+        if threshold is None:
+            return None
+        return max(self.min_delay, threshold)
+
+    def observe(self, ttft_seconds: Optional[float]) -> None:
+        self.tracker.observe(self.key, ttft_seconds)
+
+
+class HedgeReservation:
+    """对冲请求的 TPM 预扣（线程安全）
+
+    竞速结束后调用方用 take() 取出：对冲胜出时按实际用量结算，落败时退还。
+    take() 之后才拿到的预扣（对冲请求还在等配额时竞速已结束）由 hold() 立即退还。
+    """
+
+    def __init__(self, quota: Any) -> None:
+        self._quota = quota
+        self._lock = threading.Lock()
+        self._held: Optional[tuple[str, int]] = None
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def hold(self, key: str, reserved_tokens: int) -> bool:
+        """记录预扣，竞速已结束时退还并返回 False"""
+        with self._lock:
+            if not self._closed:
+                self._held = (key, reserved_tokens)
+                return True
+        self._quota.refund(key, reserved_tokens)
+        return False
+
+    def take(self) -> Optional[tuple[str, int]]:
+        """结束预留并取出 (配额 key, 预扣数)，对冲请求未拿到配额时返回 None"""
+        with self._lock:
+            self._closed = True
+            held, self._held = self._held, None
+        return held
+
+
+class _Racer:
+    """竞速中的一路请求：发请求并读到首个有内容的 chunk 为止"""
+
+    def __init__(self, name: str, model: str, open_stream: Callable[[], Any]) -> None:
+        self.name = name
+        self.model = model
+        self._open = open_stream
+        self.stream: Any = None
+        self.iterator: Any = None
+        self.chunks: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.t_sent: Optional[float] = None
+        self.t_connected: Optional[float] = None
+        self.t_first: Optional[float] = None
+        self.cancelled = False
+
+    @property
+    def hedge(self) -> bool:
+        return self.name == "hedge"
+
+    def own_ttft(self) -> Optional[float]:
+        """从这一路自己发出请求算起的 TTFT（用于更新阈值样本）"""
+        if self.t_first is None or self.t_sent is None:
+            return None
+        return self.t_first - self.t_sent
+
+    def _take(self, chunk: Any) -> bool:
+        self.chunks.append(chunk)
+        if delta_text(chunk):
+            self.t_first = time.perf_counter()
+            return True
+        return False
+
+    def run(self, done: "queue.Queue[_Racer]") -> None:
+        try:
+            self.t_sent = time.perf_counter()
+            self.stream = self._open()
+            self.t_connected = time.perf_counter()
+            if self.cancelled:
+                self.close()
+                return
+            self.iterator = iter(self.stream)
+            for chunk in self.iterator:
+                if self._take(chunk) or self.cancelled:
+                    break
+        except Exception as e:
+            self.error = e
+        done.put(self)
+
+    async def run_async(self) -> None:
+        try:
+            self.t_sent = time.perf_counter()
+            self.stream = await self._open()
+            self.t_connected = time.perf_counter()
+            self.iterator = self.stream.__aiter__()
+            while True:
+                try:
+                    chunk = await self.iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                if self._take(chunk):
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+
+    def chunks_then_rest(self) -> Iterator[Any]:
+        """已读到的 chunk + 剩余的流"""
+        return chain(self.chunks, self.iterator if self.iterator is not None else ())
+
+    async def chunks_then_rest_async(self) -> AsyncIterator[Any]:
+        for chunk in self.chunks:
+            yield chunk
+        if self.iterator is not None:
+            async for chunk in self.iterator:
+                yield chunk
+
+    def close(self) -> None:
+        self.cancelled = True
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    async def close_async(self) -> None:
+        stream = self.stream
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception:
+                pass
+
+
+def _settle(winner: _Racer, losers: List[_Racer], stats: HedgeStats) -> _Racer:
+    if winner.hedge:
+        stats.add("hedge_wins")
+    stats.add("wasted", sum(1 for r in losers if r.error is None))
+    return winner
+
+
+def _next_done(
+        done: "queue.Queue[_Racer]", timeout: Optional[float], cancel: Optional[CancelToken],
+) -> Optional[_Racer]:
+    """等待下一路结束；timeout 为 None 时一直等，期间每 CANCEL_POLL_INTERVAL 秒检查一次取消"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if cancel is not None:
+            cancel.check()
+        wait = CANCEL_POLL_INTERVAL if cancel is not None else None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait = remaining if wait is None else min(wait, remaining)
+        try:
+            return done.get(timeout=wait)
+        except queue.Empty:
+            pass
+
+
+def race_first_token(
+        open_primary: Callable[[], Any],
+        open_hedge: Callable[[], Any],
+        *,
+        primary_model: str,
+        hedge_model: str,
+        hedge_after: float,
+        stats: HedgeStats,
+        on_hedge: Optional[Callable[[], None]] = None,
+        cancel: Optional[CancelToken] = None,
+) -> _Racer:
+    """线程版竞速：主请求 hedge_after 秒内没有首个 token 时发出对冲请求，返回先出 token（或先结束）的一路
+
+    两路都失败时抛出主请求的异常；落败的一路在返回前关闭。
+    任务取消时关闭所有在途的一路并抛出 CancelledRunError。
+    """
+    done: "queue.Queue[_Racer]" = queue.Queue()
+    primary = _Racer("primary", primary_model, open_primary)
+    racers = [primary]
+    winner: Optional[_Racer] = None
+
+    def close_all() -> None:
+        for racer in list(racers):
+            racer.close()
+
+    release_cancel = cancel.on_cancel(close_all) if cancel is not None else None
+    try:
+        stats.add("requests")
+        threading.Thread(target=primary.run, args=(done,), daemon=True, name="hedge-primary").start()
+
+        first = _next_done(done, hedge_after, cancel)
+        if first is not None and first.error is not None:
+            raise first.error
+        if first is None:
+            hedge = _Racer("hedge", hedge_model, open_hedge)
+            racers.append(hedge)
+            stats.add("requests")
+            stats.add("hedged")
+            if on_hedge is not None:
+                on_hedge()
+            threading.Thread(target=hedge.run, args=(done,), daemon=True, name="hedge-secondary").start()
+            finished = 0
+            while finished < len(racers):
+                racer = _next_done(done, None, cancel)
+                finished += 1
+                if racer.error is None:
+                    first = racer
+                    break
+            if first is None:
+                raise primary.error or RuntimeError("对冲请求均失败")
+        if cancel is not None:
+            cancel.check()
+        winner = first
+    finally:
+        if release_cancel is not None:
+            release_cancel()
+        for racer in racers:
+            if racer is not winner:
+                racer.close()
+
+    return _settle(winner, [r for r in racers if r is not winner], stats)
+
+
+async def race_first_token_async(
+        open_primary: Callable[[], Any],
+        open_hedge: Callable[[], Any],
+        *,
+        primary_model: str,
+        hedge_model: str,
+        hedge_after: float,
+        stats: HedgeStats,
+        on_hedge: Optional[Callable[[], None]] = None,
+) -> _Racer:
+    """race_first_token 的 asyncio 版本：落败的一路取消任务并关闭流"""
+    primary = _Racer("primary", primary_model, open_primary)
+    tasks: Dict[asyncio.Task, _Racer] = {asyncio.ensure_future(primary.run_async()): primary}
+    stats.add("requests")
+    winner: Optional[_Racer] = None
+    try:
+        done, _ = await asyncio.wait(set(tasks), timeout=hedge_after)
+        if done:
+            if primary.error is not None:
+                raise primary.error
+            winner = primary
+        else:
+            hedge = _Racer("hedge", hedge_model, open_hedge)
+            tasks[asyncio.ensure_future(hedge.run_async())] = hedge
+            stats.add("requests")
+            stats.add("hedged")
+            if on_hedge is not None:
+                on_hedge()
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if tasks[task].error is None:
+                        winner = tasks[task]
+                        break
+            if winner is None:
+                raise primary.error or RuntimeError("对冲请求均失败")
+    finally:
+        for task, racer in tasks.items():
+            if racer is winner:
+                continue
+            racer.cancelled = True
+            if not task.done():
+                task.cancel()
+            await racer.close_async()
+
+    return _settle(winner, [r for r in tasks.values() if r is not winner], stats)
+
+
+_TTFT_TRACKER = TTFTTracker()
+
+
+def get_ttft_tracker() -> TTFTTracker:
+    """获取全局 TTFT 样本记录（跨运行共享，阈值随端点状况变化）"""
+    return _TTFT_TRACKER
@@ -8,12 +8,19 @@ import base64
 import gc
 import hashlib
 import io
+import math
+import os
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List
+from stat import S_ISREG
+from typing import Any, Optional, List, Dict, Sequence
 
 from backend.core.config import console
+from backend.core.local.preprocess_pool import BACKEND_THREAD, PreprocessPool
 
 try:
     from PIL import Image
@@ -23,6 +30,14 @@ except ImportError:
     HAS_PIL = False
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+# 缩小时先按整数倍盒式缩小到不小于 目标尺寸 x 2 再做 BILINEAR（Pillow resize 的 reducing_gap）
+_REDUCING_GAP = 2.0
+# JPEG 质量搜索：体积约与 libjpeg 量化缩放系数的 -_JPEG_SIZE_EXPONENT 次方成正比（见 _encode_jpeg）
+_JPEG_SIZE_EXPONENT = 0.6
+# 预测时以体积上限的这一比例为目标，留出模型误差
+_JPEG_TARGET_RATIO = 0.98
+# 超过上限时最多编码次数（之后直接用最低质量）
+_JPEG_MAX_ENCODES = 4
 
 
 class ImageCache:
@@ -31,12 +46,14 @@ class ImageCache:
     def __init__(self, max_size: int = 100):
         self._cache: "OrderedDict[str, str]" = OrderedDict()
         self._max_size = max_size
+        # 并发流式/预处理流水线会在多个线程里读写缓存
+        self._lock = threading.Lock()
 
     def _get_cache_key(self, image_path: Path, max_size: tuple, max_file_size_mb: int,
-                       enable_compression: bool) -> str:
-        """生成缓存键"""
+                       enable_compression: bool, file_stat: Optional[os.stat_result] = None) -> str:
+        """生成缓存键（file_stat 为调用方已取得的 stat 结果，省去一次 stat）"""
         try:
-            stat = image_path.stat()
+            stat = file_stat or image_path.stat()
             file_info = f"{stat.st_mtime}_{stat.st_size}"
         except OSError:
             file_info = str(image_path)
@@ -46,34 +63,37 @@ class ImageCache:
         return hashlib.md5(cache_key.encode()).hexdigest()
 
     def get(self, image_path: Path, max_size: tuple, max_file_size_mb: int,
-            enable_compression: bool) -> Optional[str]:
+            enable_compression: bool, file_stat: Optional[os.stat_result] = None) -> Optional[str]:
         """从缓存获取图片URL（并将其标记为最近使用）"""
-        cache_key = self._get_cache_key(image_path, max_size, max_file_size_mb, enable_compression)
-        value = self._cache.get(cache_key)
-        if value is not None:
-            # 标记为最近使用
-            self._cache.move_to_end(cache_key, last=True)
+        cache_key = self._get_cache_key(image_path, max_size, max_file_size_mb, enable_compression, file_stat)
+        with self._lock:
+            value = self._cache.get(cache_key)
+            if value is not None:
+                # 标记为最近使用
+                self._cache.move_to_end(cache_key, last=True)
         return value
 
     def put(self, image_path: Path, max_size: tuple, max_file_size_mb: int,
-            enable_compression: bool, image_url: str):
+            enable_compression: bool, image_url: str, file_stat: Optional[os.stat_result] = None):
         """将图片URL存入缓存，必要时移除最旧条目"""
-        cache_key = self._get_cache_key(image_path, max_size, max_file_size_mb, enable_compression)
+        cache_key = self._get_cache_key(image_path, max_size, max_file_size_mb, enable_compression, file_stat)
 
-        if cache_key in self._cache:
-            # 更新并标记为最近使用
-            self._cache.move_to_end(cache_key, last=True)
-            self._cache[cache_key] = image_url
-            return
+        with self._lock:
+            if cache_key in self._cache:
+                # 更新并标记为最近使用
+                self._cache.move_to_end(cache_key, last=True)
+                self._cache[cache_key] = image_url
+                return
 
-        self._cache[cache_key] = image_url
-        if len(self._cache) > self._max_size:
-            # 弹出最旧（最少使用）的项
-            self._cache.popitem(last=False)
+            self._cache[cache_key] = image_url
+            if len(self._cache) > self._max_size:
+                # 弹出最旧（最少使用）的项
+                self._cache.popitem(last=False)
 
     def clear(self):
         """清空缓存"""
-        self._cache.clear()
+        with self._lock:
+            self._cache.clear()
 
 
 # 全局缓存实例
@@ -96,61 +116,175 @@ def compress_image(
         max_file_size_mb: int = 1,
         *,
         verbose: bool = True,
+        stats: Optional[Dict[str, Any]] = None,
 ) -> tuple[bytes, str]:
-    """压缩图片到指定大小"""
+    """压缩图片到指定大小；stats 不为 None 时写入 JPEG 编码次数与最终质量（encodes / quality）"""
     if not HAS_PIL:
         raise ValueError("需要安装 Pillow 才能压缩图片: pip install Pillow")
 
-    is_large_image = False
+    try:
+        with Image.open(image_path) as img:
+            file_size_mb = image_path.stat().st_size / (1024 * 1024)
+            data = _compress_opened(img, file_size_mb, max_size, max_file_size_mb, verbose=verbose, stats=stats)
+            return data, "image/jpeg"
+    except (IOError, OSError) as e:
+        raise ValueError(f"图片压缩失败: {e}")
+
+
+def _compress_opened(
+        img: "Image.Image",
+        file_size_mb: float,
+        max_size: tuple[int, int],
+        max_file_size_mb: int,
+        *,
+        verbose: bool,
+        stats: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    """在已打开（尚未解码）的图片上缩放、转 RGB 并编码为 JPEG（调用方负责关闭 img）
+
+    需要缩小的 JPEG 先用 draft 在解码时按 1/2、1/4、1/8 缩小到不小于目标尺寸（解码耗时与内存随之下降），
+    再用 BILINEAR 缩放到目标尺寸（Pillow 缩小时按比例放大滤波窗口，有抗锯齿）；
+    其它格式由 reducing_gap 先做整数倍盒式缩小再 BILINEAR。大图不再用 NEAREST 提速，文字边缘不会出现锯齿。
+    """
+    original_size = img.size
+    is_large_image = img.size[0] * img.size[1] > 4000000
     with memory_efficient_processing(do_collect=False):
         try:
-            with Image.open(image_path) as img:
-                original_size = img.size
-                file_size_mb = image_path.stat().st_size / (1024 * 1024)
-                is_large_image = img.size[0] * img.size[1] > 4000000
-
-                if img.size[0] > max_size[0] or img.size[1] > max_size[1] or file_size_mb > max_file_size_mb:
-                    ratio = min(max_size[0] / img.size[0], max_size[1] / img.size[1])
-                    new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                    # Web/批处理优先速度：大图用 NEAREST，其它用 BILINEAR（比 LANCZOS 快很多）
-                    resample_method = Image.Resampling.NEAREST if is_large_image else Image.Resampling.BILINEAR
-                    img = img.resize(new_size, resample_method)
-                    if verbose:
-                        console.detail(f"  图片尺寸: {original_size} -> {new_size}, 文件大小: {file_size_mb:.2f}MB")
-
-                if img.mode in ("RGBA", "LA", "P"):
-                    background = Image.new("RGB", img.size, (255, 255, 255))
-                    if img.mode == "P":
-                        img = img.convert("RGBA")
-                    background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
-                    img = background
-                elif img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                buffer = io.BytesIO()
-                quality = 85 if not is_large_image else 75
-                # optimize=True 会显著增加 CPU 时间，批处理场景优先速度
-                img.save(buffer, format="JPEG", quality=quality, optimize=False)
-
-                while buffer.tell() / (1024 * 1024) > max_file_size_mb and quality > 30:
-                    quality -= 10 if is_large_image else 5
-                    buffer.seek(0)
-                    buffer.truncate(0)
-                    img.save(buffer, format="JPEG", quality=quality, optimize=False)
-
-                buffer.seek(0)
-                result = buffer.read(), "image/jpeg"
-                del img
-                del buffer
-                return result
-        except (IOError, OSError) as e:
-            raise ValueError(f"图片压缩失败: {e}")
+            if img.size[0] > max_size[0] or img.size[1] > max_size[1] or file_size_mb > max_file_size_mb:
+                ratio = min(max_size[0] / img.size[0], max_size[1] / img.size[1])
+                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+                if ratio < 1 and img.format == "JPEG":
+                    img.draft(img.mode, new_size)
+                decoded_size = img.size
+                img = img.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=_REDUCING_GAP)
+                if verbose:
+                    draft = f" (解码 {decoded_size})" if decoded_size != original_size else ""
+                    console.detail(
+                        f"  图片尺寸: {original_size} -> {new_size}{draft}, 文件大小: {file_size_mb:.2f}MB"
+                    )
+
+            if img.mode in ("RGBA", "LA", "P"):
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                if img.mode == "P":
+                    img = img.convert("RGBA")
+                background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            result, quality, encodes = _encode_jpeg(
+                img,
+                max_bytes=int(max_file_size_mb * 1024 * 1024),
+                quality=85 if not is_large_image else 75,
+                min_quality=30 if not is_large_image else 25,
+            )
+            if stats is not None:
+                stats.update(encodes=encodes, quality=quality)
+            if verbose and encodes > 1:
+                console.detail(f"  JPEG 质量: {quality}（编码 {encodes} 次）")
+            del img
+            return result
         finally:
             # 仅在超大图时做一次 GC，避免每张图都 gc.collect() 导致“慢一半”
             if is_large_image:
                 gc.collect()
 
 
+def _save_jpeg(img: "Image.Image", quality: int) -> bytes:
+    buffer = io.BytesIO()
+    # optimize=True 会显著增加 CPU 时间，批处理场景优先速度
+    img.save(buffer, format="JPEG", quality=quality, optimize=False)
+    return buffer.getvalue()
+
+
+def _jpeg_scale(quality: float) -> float:
+    """libjpeg 的质量 -> 量化表缩放系数（百分比）"""
+    return 5000 / quality if quality < 50 else 200 - 2 * quality
+
+
+def _jpeg_quality(scale: float) -> float:
+    """_jpeg_scale 的反函数"""
+    return 5000 / scale if scale > 100 else (200 - scale) / 2
+
+
+def _encode_jpeg(img: "Image.Image", *, max_bytes: int, quality: int, min_quality: int) -> tuple[bytes, int, int]:
+    """按体积上限选择 JPEG 质量，返回 (data, quality, 编码次数)
+
+    先按起始质量编码一次，不超限即返回。超限时用体积模型 size ∝ scale^-k
+    （scale 为 libjpeg 量化缩放系数）预测刚好低于上限的质量再编码：
+    首次用经验指数，之后用最近两次超限的结果拟合 k（割线法），通常 2 次编码即可落在上限内。
+    质量不低于 min_quality，最低质量仍超限时返回该结果（与原逐档下调的行为一致）。
+    """
+    data = _save_jpeg(img, quality)
+    encodes = 1
+    if len(data) <= max_bytes or quality <= min_quality:
+        return data, quality, encodes
+
+    target = max_bytes * _JPEG_TARGET_RATIO
+    exponent = _JPEG_SIZE_EXPONENT
+    previous: Optional[tuple[int, int]] = None
+    while True:
+        if previous is not None:
+            # 用两次超限的 (scale, size) 拟合指数，限制在合理范围内防止噪声放大
+            ds = math.log(_jpeg_scale(quality) / _jpeg_scale(previous[0]))
+            if ds > 0:
+                fitted = math.log(previous[1] / len(data)) / ds
+                exponent = min(1.5, max(0.2, fitted))
+        scale = _jpeg_scale(quality) * (len(data) / target) ** (1 / exponent)
+        next_quality = min(quality - 1, max(min_quality, math.floor(_jpeg_quality(scale))))
+        if encodes + 1 >= _JPEG_MAX_ENCODES:
+            next_quality = min_quality
+        previous = (quality, len(data))
+        quality = next_quality
+        data = _save_jpeg(img, quality)
+        encodes += 1
+        if len(data) <= max_bytes or quality <= min_quality:
+            return data, quality, encodes
+
+
+def load_image_payload(
+        image_path: Path,
+        max_image_size: tuple[int, int] = (1024, 1024),
+        max_file_size_mb: int = 1,
+        *,
+        verbose: bool = True,
+        stats: Optional[Dict[str, Any]] = None,
+        file_size: Optional[int] = None,
+) -> tuple[bytes, str]:
+    """单次读取图片并返回待发送的 (bytes, mime_type)
+
+    文件只打开一次：尺寸来自文件头，需要压缩时直接在同一个句柄上解码、缩放、编码；
+    不需要压缩（尺寸未超限且不超过 0.5MB）时回到文件开头原样读出字节。
+    file_size 为调用方已 stat 得到的文件字节数（如 get_image_url），不传时取自打开的文件描述符。
+    stats 同 compress_image，未压缩时 encodes 为 0。
+    """
+    if not HAS_PIL:
+        raise ValueError("需要安装 Pillow 才能压缩图片: pip install Pillow")
+
+    with open(image_path, "rb") as f:
+        if file_size is None:
+            file_size = os.fstat(f.fileno()).st_size
+        file_size_mb = file_size / (1024 * 1024)
+        with Image.open(f) as img:
+            needs_compression = (
+                img.size[0] > max_image_size[0]
+                or img.size[1] > max_image_size[1]
+                or file_size_mb > 0.5
+            )
+            if needs_compression:
+                try:
+                    data = _compress_opened(
+                        img, file_size_mb, max_image_size, max_file_size_mb, verbose=verbose, stats=stats,
+                    )
+                except (IOError, OSError) as e:
+                    raise ValueError(f"图片压缩失败: {e}")
+                return data, "image/jpeg"
+        if stats is not None:
+            stats["encodes"] = 0
+        f.seek(0)
+        return f.read(), get_image_mime_type(image_path)
+
+
 def get_image_mime_type(image_path: Path) -> str:
     """获取图片文件的MIME类型"""
     ext = image_path.suffix.lower()
@@ -173,12 +307,27 @@ def encode_image_to_base64(image_path: Path, mime_type: str) -> str:
 
 
 def get_image_url(image_path: Path, max_image_size=(1024, 1024), max_file_size_mb=1,
-                  enable_compression=True, verbose=True) -> str:
-    """获取图片的base64 URL，支持缓存和压缩"""
-    if not image_path.exists() or not image_path.is_file():
+                  enable_compression=True, verbose=True, stats: Optional[Dict[str, Any]] = None,
+                  pool: Optional[PreprocessPool] = None) -> str:
+    """获取图片的base64 URL，支持缓存和压缩
+
+    文件只 stat 一次：同一份 stat 结果既用于缓存校验，也把文件大小传给 load_image_payload（不再 fstat），
+    读取与解码也各只一次（见 load_image_payload）。
+
+    stats 不为 None 时写入本次的 JPEG 编码次数与质量（命中缓存或未开启压缩时不写入），
+    以及实际预处理时占用的 CPU 秒数 cpu_seconds（命中缓存时不写入）：
+    本线程的 CPU 时间加上进程池工作进程的 CPU 时间，不含排队、进程启动与等待结果的时间。
+    pool 不为 None 时读取与压缩在预处理进程池中执行（见 preprocess_pool 模块）。
+    """
+    t_cpu = time.thread_time()
+    try:
+        file_stat = image_path.stat()
+    except OSError:
+        file_stat = None
+    if file_stat is None or not S_ISREG(file_stat.st_mode):
         raise FileNotFoundError(f"图片文件不存在: {image_path}")
 
-    cached_url = _IMAGE_CACHE.get(image_path, max_image_size, max_file_size_mb, enable_compression)
+    cached_url = _IMAGE_CACHE.get(image_path, max_image_size, max_file_size_mb, enable_compression, file_stat)
     if cached_url is not None:
         return cached_url
 
@@ -194,32 +343,197 @@ def get_image_url(image_path: Path, max_image_size=(1024, 1024), max_file_size_m
             raise ImportError("需要安装Pillow才能处理大于0.5MB的图片: pip install Pillow")
 
         try:
-            with Image.open(image_path) as img:
-                file_size_mb = image_path.stat().st_size / (1024 * 1024)
-                needs_compression = (
-                    img.size[0] > max_image_size[0]
-                    or img.size[1] > max_image_size[1]
-                    or file_size_mb > 0.5
-                )
-
-            if needs_compression:
-                image_data_bytes, mime_type = compress_image(
-                    image_path, max_image_size, max_file_size_mb, verbose=verbose
+            if pool is not None:
+                image_data_bytes, mime_type = pool.load_payload(
+                    image_path, max_image_size, max_file_size_mb, stats=stats, file_size=file_stat.st_size,
                 )
-                image_data = base64.b64encode(image_data_bytes).decode("utf-8")
-                result_url = f"data:{mime_type};base64,{image_data}"
             else:
-                mime_type = get_image_mime_type(image_path)
-                result_url = encode_image_to_base64(image_path, mime_type)
+                image_data_bytes, mime_type = load_image_payload(
+                    image_path, max_image_size, max_file_size_mb, verbose=verbose, stats=stats,
+                    file_size=file_stat.st_size,
+                )
+            result_url = f"data:{mime_type};base64,{base64.b64encode(image_data_bytes).decode('utf-8')}"
         except (IOError, OSError, ValueError) as e:
             if verbose:
                 console.error(f"  ❌ 错误: {e}")
             raise
 
-    _IMAGE_CACHE.put(image_path, max_image_size, max_file_size_mb, enable_compression, result_url)
+    if stats is not None:
+        stats["cpu_seconds"] = stats.get("cpu_seconds", 0.0) + time.thread_time() - t_cpu
+    _IMAGE_CACHE.put(image_path, max_image_size, max_file_size_mb, enable_compression, result_url, file_stat)
     return result_url
 
 
+class PreprocessPrefetcher:
+    """流式模式下的预处理流水线（生产者/消费者，有界前瞻窗口）
+
+    第 k 张图片发起请求时，第 k+1..k+W 张已在 CPU 线程池中解码/压缩/编码，
+    网络等待与 CPU 预处理重叠。窗口以“已请求的最大序号”为基准推进，
+    因此同时在途的 data URL 最多为 并发数 + W 个，内存有界。
+
+    预处理耗时在线程池内实际执行处测量（墙钟时间，另按 CPU 时间统计吞吐）；消费者额外等待的时间由调用方自行计时。
+    image_files 中为 None 的位置不做预处理（如断点续跑时已完成的图片），序号保持不变。
+    consumers > 1 时供多个模型的运行共享（多模型对比）：同一张图片只预处理一次，
+    被取走 consumers 次后才释放，因此内存上限相应放宽到整批图片。
+    pool 不为 None 时线程只负责分发与拼接 data URL，压缩在进程池中执行：线程数与前瞻窗口至少为进程数，
+    否则多出的进程空闲。
+    """
+
+    def __init__(
+            self,
+            image_files: Sequence[Optional[Path]],
+            max_image_size: tuple[int, int],
+            max_file_size_mb: int,
+            enable_compression: bool,
+            lookahead: int,
+            cpu_workers: Optional[int] = None,
+            consumers: int = 1,
+            pool: Optional[PreprocessPool] = None,
+    ) -> None:
+        self._images = list(image_files)
+        self._consumers = max(1, int(consumers))
+        self._taken: Dict[int, int] = {}
+        self.submitted = 0
+        self.processed = 0
+        self.preprocess_seconds = 0.0
+        self.encodes = 0
+        self.cpu_seconds = 0.0
+        self.cpu_images = 0
+        self._pool = pool
+        self._max_image_size = max_image_size
+        self._max_file_size_mb = max_file_size_mb
+        self._enable_compression = enable_compression
+        self._lookahead = max(0, int(lookahead))
+        if pool is not None:
+            self._lookahead = max(self._lookahead, pool.workers)
+            self.backend = pool.backend
+            self.workers = cpu_workers or pool.workers
+        else:
+            self.backend = BACKEND_THREAD
+            self.workers = cpu_workers or max(1, min(self._lookahead, os.cpu_count() or 1))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preprocess")
+        self._futures: Dict[int, Future] = {}
+        self._next = 0  # 下一个待提交的下标（0-based）
+        self._lock = threading.Lock()
+
+    def _run(self, image_path: Path) -> tuple[str, float, Dict[str, Any]]:
+        t_start = time.perf_counter()
+        stats: Dict[str, Any] = {}
+        url = get_image_url(
+            image_path, self._max_image_size, self._max_file_size_mb, self._enable_compression, verbose=False,
+            stats=stats, pool=self._pool,
+        )
+        elapsed = time.perf_counter() - t_start
+        with self._lock:
+            self.processed += 1
+            self.preprocess_seconds += elapsed
+            self.encodes += stats.get("encodes", 0)
+            if "cpu_seconds" in stats:
+                self.cpu_seconds += stats["cpu_seconds"]
+                self.cpu_images += 1
+        return url, elapsed, stats
+
+    def _submit(self, i: int) -> Future:
+        self.submitted += 1
+        return self._executor.submit(self._run, self._images[i])
+
+    def future(self, idx: int) -> "Future[tuple[str, float, Dict[str, Any]]]":
+        """取出第 idx 张（1-based）图片的预处理 Future，并把窗口推进到 idx+W
+
+        每张图片的预取结果交付 consumers 次；之后再取（如重试）会重新提交一次预处理。
+        """
+        i = idx - 1
+        with self._lock:
+            upto = min(i + self._lookahead, len(self._images) - 1)
+            while self._next <= upto:
+                if self._images[self._next] is not None:
+                    self._futures[self._next] = self._submit(self._next)
+                self._next += 1
+            fut = self._futures.get(i)
+            if fut is None:
+                return self._submit(i)
+            self._taken[i] = self._taken.get(i, 0) + 1
+            if self._taken[i] >= self._consumers:
+                del self._futures[i]
+        return fut
+
+    def take(self, idx: int) -> tuple[str, float, Dict[str, Any]]:
+        """阻塞获取第 idx 张图片的 (data_url, preprocess_seconds, stats)，stats 见 get_image_url"""
+        return self.future(idx).result()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """用于 run_summary 的预处理统计（见 preprocess_summary）"""
+        with self._lock:
+            return preprocess_summary(
+                self.backend, self.workers, self.processed, self.preprocess_seconds, self.encodes,
+                self.cpu_seconds, self.cpu_images,
+            )
+
+    def shutdown(self) -> None:
+        """停止流水线，丢弃尚未开始的预取任务"""
+        with self._lock:
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def preprocess_summary(
+        backend: str,
+        workers: int,
+        processed: int,
+        seconds: float,
+        encodes: int,
+        cpu_seconds: float,
+        cpu_images: int,
+) -> Dict[str, Any]:
+    """预处理统计
+
+    seconds 为各图片预处理的墙钟耗时之和（含排队、进程池启动与进程间传输，不代表 CPU 占用）；
+    cpu_seconds 为 cpu_images 张实际预处理（未命中缓存）的图片占用的 CPU 时间之和（见 get_image_url），
+    images_per_core_second = cpu_images / cpu_seconds，即每核每秒可处理的图片数。
+    线程后端受 GIL 限制时，线程之间互相等待的时间不计入 CPU 时间，该值反映的是单图的 CPU 成本。
+    """
+    return {
+        "backend": backend,
+        "workers": workers,
+        "processed": processed,
+        "preprocess_seconds": round(seconds, 4),
+        "cpu_seconds": round(cpu_seconds, 4),
+        "jpeg_encodes": encodes,
+        "images_per_core_second": round(cpu_images / cpu_seconds, 2) if cpu_seconds > 0 else None,
+    }
+
+
+class PreprocessTotals:
+    """单次运行的预处理累计（线程安全）：没有本次运行专用的预取流水线时，由各图片的预处理结果汇总"""
+
+    def __init__(self, backend: str, workers: int) -> None:
+        self.backend = backend
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.seconds = 0.0
+        self.encodes = 0
+        self.cpu_seconds = 0.0
+        self.cpu_images = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, stats: Dict[str, Any]) -> None:
+        """记录一张图片的预处理墙钟耗时与 get_image_url 的 stats"""
+        with self._lock:
+            self.processed += 1
+            self.seconds += seconds
+            self.encodes += stats.get("encodes", 0)
+            if "cpu_seconds" in stats:
+                self.cpu_seconds += stats["cpu_seconds"]
+                self.cpu_images += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return preprocess_summary(
+                self.backend, self.workers, self.processed, self.seconds, self.encodes,
+                self.cpu_seconds, self.cpu_images,
+            )
+
+
 def get_image_files(input_dir: str | Path, project_root: Path) -> List[Path]:
     """获取目录下所有图片文件"""
     input_path = Path(input_dir)
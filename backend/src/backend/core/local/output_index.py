@@ -0,0 +1,146 @@
+"""
+输出目录索引模块
+按模型输出目录记录每个 (图片名, 扩展名) 已用到的最大编号，查找最新结果文件与分配新文件名都是 O(1)，不再逐张图片遍历目录
+
+- 索引在进程内按目录共享（get_output_index），首次使用时读取目录下的 .output_index.json，
+  该文件记录保存时目录的 mtime，与当前不一致（期间有文件增删）时扫描一次目录重建
+- 分配输出文件名（reserve_output_file_path）时更新索引；每次运行写完汇总后保存索引文件
+- 查找到的文件已被删除时重新扫描目录，结果与逐个扫描一致
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+INDEX_FILENAME = ".output_index.json"
+INDEX_VERSION = 1
+
+# {图片名}_结果{扩展名} / {图片名}_结果_{n}{扩展名}
+_OUTPUT_NAME_RE = re.compile(r"^(?P<stem>.+)_结果(?:_(?P<counter>\d+))?(?P<ext>\.[A-Za-z0-9]+)$")
+
+
+def output_file_name(image_name: str, counter: int, extension: str) -> str:
+    suffix = f"_{counter}" if counter else ""
+    return f"{image_name}_结果{suffix}{extension}"
+
+
+class OutputIndex:
+    """单个输出目录的索引（线程安全）：(图片名, 扩展名) -> 已存在的最大编号（0 表示未编号文件）"""
+
+    def __init__(self, output_dir: Path) -> None:
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / INDEX_FILENAME
+        self._lock = threading.Lock()
+        self._latest: Dict[tuple[str, str], int] = {}
+        self._loaded = False
+        self.scans = 0
+
+    def latest(self, image_name: str, extension: str = ".json") -> Optional[Path]:
+        """最新（编号最大）的输出文件路径，不存在时返回 None"""
+        with self._lock:
+            self._ensure_loaded()
+            counter = self._latest.get((image_name, extension))
+            if counter is None:
+                return None
+            path = self._file(image_name, counter, extension)
+            if path.is_file():
+                return path
+            # 文件已被外部删除：重建后再查一次
+            self._scan()
+            counter = self._latest.get((image_name, extension))
+            return None if counter is None else self._file(image_name, counter, extension)
+
+    def next_counter(self, image_name: str, extension: str = ".json") -> int:
+        """下一个可用的编号（0 表示未编号文件名可用）；记录的最新文件已被删除（如目录被清空）时重新扫描"""
+        with self._lock:
+            self._ensure_loaded()
+            counter = self._latest.get((image_name, extension))
+            if counter is not None and not self._file(image_name, counter, extension).exists():
+                self._scan()
+                counter = self._latest.get((image_name, extension))
+            return 0 if counter is None else counter + 1
+
+    def add(self, image_name: str, counter: int, extension: str = ".json") -> None:
+        """记录新创建的输出文件"""
+        with self._lock:
+            self._ensure_loaded()
+            key = (image_name, extension)
+            if counter > self._latest.get(key, -1):
+                self._latest[key] = counter
+
+    def save(self) -> None:
+        """保存索引文件，并记下保存后的目录 mtime 供下次加载时校验
+
+        索引文件已存在时原地覆盖（不改变目录 mtime）；首次创建时先建空文件再取 mtime。
+        """
+        with self._lock:
+            if not self._loaded or not self.output_dir.is_dir():
+                return
+            try:
+                if not self.path.exists():
+                    self.path.touch()
+                data = {
+                    "version": INDEX_VERSION,
+                    "dir_mtime_ns": self.output_dir.stat().st_mtime_ns,
+                    "entries": [[stem, ext, counter] for (stem, ext), counter in self._latest.items()],
+                }
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+            except OSError:
+                pass
+
+    def _file(self, image_name: str, counter: int, extension: str) -> Path:
+        return self.output_dir / output_file_name(image_name, counter, extension)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._load_sidecar():
+            self._scan()
+
+    def _load_sidecar(self) -> bool:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("version") != INDEX_VERSION:
+                return False
+            if data.get("dir_mtime_ns") != self.output_dir.stat().st_mtime_ns:
+                return False
+            self._latest = {(stem, ext): int(counter) for stem, ext, counter in data.get("entries") or []}
+            return True
+        except (OSError, ValueError, TypeError):
+            return False
+
+    def _scan(self) -> None:
+        """遍历目录重建索引"""
+        self.scans += 1
+        latest: Dict[tuple[str, str], int] = {}
+        try:
+            for path in self.output_dir.iterdir():
+                match = _OUTPUT_NAME_RE.match(path.name)
+                if not match:
+                    continue
+                key = (match.group("stem"), match.group("ext"))
+                counter = int(match.group("counter") or 0)
+                if counter > latest.get(key, -1) and path.is_file():
+                    latest[key] = counter
+        except OSError:
+            pass
+        self._latest = latest
+
+
+_OUTPUT_INDEXES: Dict[Path, OutputIndex] = {}
+_OUTPUT_INDEXES_LOCK = threading.Lock()
+
+
+def get_output_index(output_dir: Path) -> OutputIndex:
+    """获取输出目录的共享索引"""
+    key = Path(output_dir).resolve()
+    with _OUTPUT_INDEXES_LOCK:
+        index = _OUTPUT_INDEXES.get(key)
+        if index is None:
+            index = _OUTPUT_INDEXES[key] = OutputIndex(key)
+        return index
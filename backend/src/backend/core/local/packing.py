@@ -0,0 +1,140 @@
+"""
+多图打包请求模块
+把 K 张小图放进同一个请求，摊薄连接、提示词 token 与 TTFT 的固定开销
+
+- 提示词外面包一层说明，要求模型只输出一个 JSON 数组，每个元素为 {"image_index": i, "result": ...}
+- 响应按 image_index 拆回每张图片各自的结果文件
+- 某个位置缺失或无法解析时，该图片回退为单图请求（整个打包请求失败时全部回退）
+
+打包请求为非流式调用；计时、重试等单图逻辑仍由各引擎的单图任务负责。
+"""
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from backend.core.local.result_handler import (
+    ModelOutputError, parse_json_from_model_output, reserve_output_file_path, save_result,
+)
+
+
+def pack_groups(pending: Sequence[tuple[int, Path]], pack_size: int) -> List[List[tuple[int, Path]]]:
+    """按顺序每 pack_size 张分为一组；只剩一张的组不值得打包，留给单图请求"""
+    size = max(1, int(pack_size))
+    groups = [list(pending[i:i + size]) for i in range(0, len(pending), size)]
+    return [g for g in groups if len(g) > 1]
+
+
+def packed_prompt(prompt: str, count: int) -> str:
+    """在原提示词外包一层多图说明"""
+    return (
+        f"下面共有 {count} 张图片，按出现顺序编号为 1 到 {count}。\n"
+        "请对每张图片分别完成下方的任务，图片之间互不影响。\n"
+        "只输出一个 JSON 数组，不要输出其他文字；数组中每个元素的格式为 "
+        '{"image_index": 图片编号, "result": 该图片按任务要求输出的 JSON}，'
+        f"必须包含全部 {count} 张图片。\n\n"
+        f"任务：\n{prompt}"
+    )
+
+
+def build_packed_messages(prompt: str, image_urls: Sequence[str]) -> List[Dict[str, Any]]:
+    """构建多图消息：包装后的提示词 + 按顺序排列的图片"""
+    content: List[Dict[str, Any]] = [{"type": "text", "text": packed_prompt(prompt, len(image_urls))}]
+    for url in image_urls:
+        content.append({"type": "image_url", "image_url": {"url": url}})
+    return [{"role": "user", "content": content}]
+
+
+def split_packed_output(raw_text: str, count: int) -> Dict[int, Any]:
+    """把打包响应拆成 {图片编号(1-based): 结果}；对应不上编号的位置不出现在返回值中（由调用方回退为单图请求）
+
+    - 只要有元素带 image_index，就只按 image_index 对应：编号合法、唯一且带 result 的元素才采用，
+      缺少或无法解析编号、编号越界或重复、缺少 result 的元素一律丢弃，不按位置猜测
+    - 没有任何元素带 image_index 时，兼容模型直接返回结果数组的情况：长度恰好为 count 才按位置对应
+    - 包装对象 {"image_index": …, "result": …} 本身永远不会被当作结果保存
+    """
+    try:
+        parsed = parse_json_from_model_output(raw_text)
+    except ModelOutputError:
+        return {}
+    if isinstance(parsed, dict):
+        # 有的模型会再包一层 {"results": [...]}
+        lists = [v for v in parsed.values() if isinstance(v, list)]
+        parsed = lists[0] if len(lists) == 1 else None
+    if not isinstance(parsed, list):
+        return {}
+
+    if any(isinstance(item, dict) and "image_index" in item for item in parsed):
+        return _split_by_index(parsed, count)
+    if len(parsed) != count:
+        return {}
+    slots: Dict[int, Any] = {}
+    for slot, item in enumerate(parsed, 1):
+        if isinstance(item, dict) and set(item) == {"result"}:
+            item = item["result"]
+        if item is not None:
+            slots[slot] = item
+    return slots
+
+
+def _split_by_index(items: Sequence[Any], count: int) -> Dict[int, Any]:
+    """按 image_index 对应；同一编号出现多次时无法判断哪个正确，该编号整体丢弃"""
+    slots: Dict[int, Any] = {}
+    duplicated = set()
+    for item in items:
+        if not isinstance(item, dict) or item.get("result") is None:
+            continue
+        slot = _slot_number(item.get("image_index"))
+        if slot is None or not 1 <= slot <= count:
+            continue
+        if slot in slots:
+            duplicated.add(slot)
+            continue
+        slots[slot] = item["result"]
+    for slot in duplicated:
+        slots.pop(slot, None)
+    return slots
+
+
+def _slot_number(value: Any) -> Optional[int]:
+    """image_index 转为整数：接受整数、整数值的浮点数（如 2.0）与整数字符串（如 "2"），其余视为无效"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def save_packed_results(
+        group: Sequence[tuple[int, Path]],
+        slots: Dict[int, Any],
+        *,
+        output_dir: Path,
+        output_files: Dict[int, Optional[Path]],
+        model_name: str,
+        model_info: Optional[str],
+        prompt: str,
+        timings: Dict[str, float],
+) -> tuple[List[Dict[str, Any]], List[tuple[int, Path]]]:
+    """保存拆分出的每张图片结果，返回 (成功记录, 需要回退为单图请求的图片)"""
+    records: List[Dict[str, Any]] = []
+    fallback: List[tuple[int, Path]] = []
+    for slot, (idx, img) in enumerate(group, 1):
+        if slot not in slots:
+            fallback.append((idx, img))
+            continue
+        t_save = time.perf_counter()
+        output_file = output_files.get(idx) or reserve_output_file_path(output_dir, img.stem, extension=".json")
+        save_result(output_file, img, model_name, model_info, prompt, result_json=slots[slot], background=True)
+        records.append({
+            "index": idx, "image_name": img.name,
+            "status": "success", "output_file": str(output_file), "retries": 0,
+            "packed": True, "pack_size": len(group), "pack_slot": slot,
+            "timings": dict(timings, save_seconds=round(time.perf_counter() - t_save, 4)),
+        })
+    return records, fallback
@@ -0,0 +1,172 @@
+"""
+进程池预处理后端
+Pillow 的解码/缩放/编码只在部分阶段释放 GIL，调色板/透明通道合成、字节拷贝等仍受 GIL 限制，
+线程池预处理在 2~3 核以上基本不再扩展。preprocess_backend="process" 时改由进程池执行：
+
+- 传入文件路径，返回压缩后的字节（及 MIME 类型、JPEG 编码统计与工作进程的 CPU 时间）；
+  base64 与 data URL 在主进程中拼接
+- 进程数为本进程可用的 CPU 核数（available_cores）
+- 每个工作进程启动时预先导入 Pillow 并注册全部格式插件（Image.init），首张图片不再承担导入开销
+- 统一用 spawn 启动（各平台行为一致，也不会在已有多个线程的进程里 fork）
+- 进程池在进程内共享（get_preprocess_pool），首次使用时创建，进程退出时关闭
+- stat、缓存查询与未开启压缩时的原样读取仍在主进程完成（见 get_image_url 的 pool 参数），
+  文件大小随任务传给工作进程，不再重复 stat
+- 工作进程异常退出（如被 OOM 杀掉）时，该图片回退到当前线程处理，下次使用时重建进程池；
+  连续 _MAX_POOL_FAILURES 次都没能处理完一张图片（如启动脚本缺少 if __name__ == "__main__" 保护，
+  spawn 出的进程无法启动）时，本进程后续不再使用进程池
+"""
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from backend.core.config import console, with_icon
+
+BACKEND_THREAD = "thread"
+BACKEND_PROCESS = "process"
+PREPROCESS_BACKENDS = (BACKEND_THREAD, BACKEND_PROCESS)
+
+# 进程池连续损坏这么多次后停用，改在调用方线程内预处理
+_MAX_POOL_FAILURES = 3
+
+
+def available_cores() -> int:
+    """本进程可用的 CPU 核数（考虑 CPU 亲和性与容器的 cpuset 限制）"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return max(1, os.cpu_count() or 1)
+
+
+def _init_worker() -> None:
+    """工作进程初始化：Ctrl+C 交给主进程处理，预先导入 Pillow 与图片处理模块"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from PIL import Image
+
+    import backend.core.local.image_utils  # noqa: F401
+
+    Image.init()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _load_payload(
+        image_path: str, max_image_size: tuple[int, int], max_file_size_mb: int, file_size: Optional[int],
+) -> tuple[bytes, str, Dict[str, Any]]:
+    """在工作进程中执行：读取并压缩一张图片，返回 (bytes, mime_type, stats)
+
+    stats["cpu_seconds"] 为本进程处理这张图片占用的 CPU 时间（time.process_time），不含排队与传输。
+    """
+    from backend.core.local.image_utils import load_image_payload
+
+    t_cpu = time.process_time()
+    stats: Dict[str, Any] = {}
+    data, mime_type = load_image_payload(
+        Path(image_path), max_image_size, max_file_size_mb, verbose=False, stats=stats, file_size=file_size,
+    )
+    stats["cpu_seconds"] = time.process_time() - t_cpu
+    return data, mime_type, stats
+
+
+class PreprocessPool:
+    """预处理进程池（线程安全）：load_payload 阻塞等待结果，由调用方的线程提供并发"""
+
+    backend = BACKEND_PROCESS
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = max(1, int(workers or available_cores()))
+        self.fallbacks = 0
+        self.disabled = False
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def warm_up(self) -> None:
+        """提前启动全部工作进程（不等待就绪），进程的启动与导入和调用方的其它准备工作重叠"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+
+    def load_payload(
+            self,
+            image_path: Path,
+            max_image_size: tuple[int, int],
+            max_file_size_mb: int,
+            *,
+            stats: Optional[Dict[str, Any]] = None,
+            file_size: Optional[int] = None,
+    ) -> tuple[bytes, str]:
+        """在工作进程中读取并压缩图片，参数与返回值同 load_image_payload"""
+        from backend.core.local.image_utils import load_image_payload
+
+        if self.disabled:
+            return load_image_payload(
+                image_path, max_image_size, max_file_size_mb, verbose=False, stats=stats, file_size=file_size,
+            )
+        executor = self._get_executor()
+        try:
+            data, mime_type, worker_stats = executor.submit(
+                _load_payload, str(image_path), tuple(max_image_size), max_file_size_mb, file_size,
+            ).result()
+        except BrokenProcessPool:
+            self._on_broken(executor)
+            return load_image_payload(
+                image_path, max_image_size, max_file_size_mb, verbose=False, stats=stats, file_size=file_size,
+            )
+        self._failures = 0
+        if stats is not None:
+            stats.update(worker_stats)
+        return data, mime_type
+
+    def _on_broken(self, executor: ProcessPoolExecutor) -> None:
+        """丢弃已损坏的进程池（下次使用时重建），连续损坏过多时停用"""
+        with self._lock:
+            self.fallbacks += 1
+            if self._executor is executor:
+                self._executor = None
+                self._failures += 1
+                if self._failures >= _MAX_POOL_FAILURES and not self.disabled:
+                    self.disabled = True
+                    console.warning(with_icon("warning", "预处理进程池反复异常退出，本进程后续改在线程内预处理"))
+        executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_PREPROCESS_POOL: Optional[PreprocessPool] = None
+_PREPROCESS_POOL_LOCK = threading.Lock()
+
+
+def get_preprocess_pool() -> PreprocessPool:
+    """获取全局预处理进程池（首次调用时创建并启动工作进程，进程退出时关闭）"""
+    global _PREPROCESS_POOL
+    with _PREPROCESS_POOL_LOCK:
+        if _PREPROCESS_POOL is None:
+            _PREPROCESS_POOL = PreprocessPool()
+            _PREPROCESS_POOL.warm_up()
+            atexit.register(_PREPROCESS_POOL.shutdown)
+        return _PREPROCESS_POOL
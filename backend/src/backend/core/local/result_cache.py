@@ -0,0 +1,172 @@
+"""
+结果缓存模块
+按 图片内容哈希 + 规范化提示词 + 模型 + 请求参数 缓存模型输出，相同请求不再重复计费与等待
+
+- 缓存位于 data/cache/results/<key 前两位>/<key>.json，写入时先写临时文件再 os.replace，
+  多个进程同时写同一条也不会读到半个文件
+- TTL：读取时发现过期即删除并按未命中处理
+- 容量：每次运行结束后 prune()，删除过期条目，超出上限时按最近访问时间淘汰最旧的
+  （mtime 为写入时间，用于 TTL；atime 在命中时显式刷新，用于 LRU，不依赖挂载参数）
+- 只缓存 JSON 解析成功的单图请求结果（打包请求的结果不写入）；bypass（use_cache=False）时不读缓存，但仍写入新结果刷新缓存
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from backend.core.config import DEFAULT_CACHE_TTL_SECONDS, DEFAULT_CACHE_MAX_MB
+from backend.util import project_root as get_project_root
+
+
+def normalize_prompt(prompt: str) -> str:
+    """去掉首尾空白与行尾空格、统一换行符，避免无意义的格式差异导致缓存未命中"""
+    lines = (prompt or "").replace("\r\n", "\n").replace("\r", "\n").strip().split("\n")
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def cache_key(image_sha256: str, prompt: str, model_name: str, params: Dict[str, Any]) -> str:
+    """params 为影响模型输出的请求参数（端点、压缩尺寸等）"""
+    material = json.dumps(
+        {
+            "image": image_sha256,
+            "prompt": hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest(),
+            "model": model_name,
+            "params": params,
+        },
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """磁盘结果缓存（线程安全）"""
+
+    def __init__(self, root: Path, ttl_seconds: float, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """命中时返回缓存条目并刷新访问时间；不存在、过期或损坏时返回 None"""
+        path = self._path(key)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        created_at = stat.st_mtime
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            created_at = float(entry.get("created_at", created_at))
+        except (OSError, ValueError, AttributeError):
+            self._remove(path)
+            return None
+        if self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """原子写入一条缓存"""
+        path = self._path(key)
+        payload = dict(entry, key=key, created_at=time.time())
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        if self.max_bytes > 0 and len(data) > self.max_bytes:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def prune(self) -> int:
+        """删除过期条目，超出容量时按访问时间淘汰最旧的，返回删除条数"""
+        if not self.root.is_dir():
+            return 0
+        with self._lock:
+            now = time.time()
+            removed = 0
+            entries = []
+            for path in self.root.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if self.ttl_seconds > 0 and now - stat.st_mtime > self.ttl_seconds:
+                    self._remove(path)
+                    removed += 1
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if self.max_bytes > 0 and total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    self._remove(path)
+                    total -= size
+                    removed += 1
+            return removed
+
+
+class CacheStats:
+    """单次运行的缓存命中统计（线程安全），写入 run_summary.json"""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evicted": self.evicted,
+        }
+
+
+_RESULT_CACHE: Optional[ResultCache] = None
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """获取全局结果缓存（首次调用时按项目根目录创建）"""
+    global _RESULT_CACHE
+    with _RESULT_CACHE_LOCK:
+        if _RESULT_CACHE is None:
+            _RESULT_CACHE = ResultCache(
+                get_project_root() / "data" / "cache" / "results",
+                ttl_seconds=DEFAULT_CACHE_TTL_SECONDS,
+                max_bytes=int(DEFAULT_CACHE_MAX_MB * 1024 * 1024),
+            )
+        return _RESULT_CACHE
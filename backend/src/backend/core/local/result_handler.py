@@ -6,10 +6,19 @@ from __future__ import annotations
 
 import json
 import re
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
+from backend.core.local.output_index import get_output_index, output_file_name
+from backend.core.local.result_writer import get_result_writer
+from backend.core.local.results_log import active_results_log
+
+
+class ModelOutputError(ValueError):
+    """模型返回内容为空或不是合法 JSON（属于输出问题而非接口故障，重试时无需指数退避）"""
+
 
 def extract_text_from_message(message: Any) -> str:
     """从模型返回的消息中提取文本内容"""
@@ -33,7 +42,7 @@ def extract_text_from_message(message: Any) -> str:
 def parse_json_from_model_output(raw_text: str) -> Dict[str, Any] | List[Any] | Any:
     """从模型返回的原始文本中解析出JSON数据"""
     if not raw_text:
-        raise ValueError("模型未返回任何内容，请检查提示词和模型配置")
+        raise ModelOutputError("模型未返回任何内容，请检查提示词和模型配置")
 
     stripped = raw_text.strip()
     candidates = [stripped]
@@ -59,27 +68,177 @@ def parse_json_from_model_output(raw_text: str) -> Dict[str, Any] | List[Any] |
         except json.JSONDecodeError:
             continue
 
-    raise ValueError(
+    raise ModelOutputError(
         f"模型输出不是合法的JSON数据，请检查提示词是否要求模型返回JSON格式。\n原始输出: {raw_text[:100]}...")
 
 
+# 增量 JSON 提取用的结构字符扫描
+_VALUE_START_RE = re.compile(r"[{\[]")
+_IN_VALUE_RE = re.compile(r'[{}\[\]"]')
+_IN_STRING_RE = re.compile(r'["\\]')
+# 候选值之前只有空白与代码围栏（从输出开头算起）
+_PREAMBLE_RE = re.compile(r"(?:\s|```(?:json)?)*", re.IGNORECASE)
+# 候选值紧跟在 ```json / ``` 围栏之后
+_FENCE_TAIL_RE = re.compile(r"```(?:json)?\s*$", re.IGNORECASE)
+# 保留的值外文本尾部长度（足够判断围栏）
+_GAP_TAIL = 32
+
+
+class IncrementalJSONExtractor:
+    """流式增量 JSON 提取器：边接收 delta 边扫描，第一个作为答案出现的顶层对象/数组闭合时立即解析
+
+    - 值外部只查找 `{` / `[`，同时记录值之前的文本
+    - 只有紧跟在 ```json（或 ```）围栏之后、或之前只有空白与围栏的候选才可作为答案提前采用；
+      说明文字中的 `[1]` 引用、`{}` 示例即使能被 json.loads 解析也不采用，继续向后找
+    - 值内部只在结构字符（括号、引号、转义）处停下，跟踪嵌套深度与字符串状态，整体单遍扫描
+    - 深度归零时对可采用的片段做一次 json.loads；失败则丢弃片段继续向后找
+    - 只缓存当前候选片段与值外文本的尾部，内存随输出线性增长
+
+    没有可提前采用的值时（例如答案前有说明文字且没有围栏、顶层是数字/字符串）
+    由调用方在流结束后回退到整段文本的容错解析（_extract_json_from_text），结果与非流式一致。
+    """
+
+    def __init__(self) -> None:
+        self.value: Any = None
+        self.done = False
+        self.failed_candidates = 0
+        self.parse_seconds = 0.0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf: List[str] = []
+        # 当前候选值之前的值外文本（只保留尾部）与是否从开头起只有空白/围栏
+        self._gap = ""
+        self._clean_preamble = True
+        self._anchored = False
+
+    def feed(self, text: str) -> bool:
+        """喂入一段文本，返回是否已得到完整的 JSON 值"""
+        if self.done or not text:
+            return self.done
+        n = len(text)
+        pos = 0
+        seg_start = 0
+        while pos < n:
+            if self._depth == 0:
+                match = _VALUE_START_RE.search(text, pos)
+                if match is None:
+                    self._skip(text[pos:])
+                    return False
+                self._skip(text[pos:match.start()])
+                self._start_candidate()
+                seg_start = match.start()
+                self._depth = 1
+                pos = match.end()
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = _IN_STRING_RE.search(text, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                continue
+
+            match = _IN_VALUE_RE.search(text, pos)
+            if match is None:
+                break
+            ch = match.group()
+            pos = match.end()
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buf.append(text[seg_start:pos])
+                    if self._try_complete():
+                        return True
+
+        if self._depth > 0:
+            self._buf.append(text[seg_start:])
+        return False
+
+    def _skip(self, text: str) -> None:
+        """记录值外文本；超出尾部长度时先确认被丢弃的部分是否只有空白与围栏"""
+        if not text:
+            return
+        self._gap += text
+        if len(self._gap) > _GAP_TAIL * 2:
+            dropped, self._gap = self._gap[:-_GAP_TAIL], self._gap[-_GAP_TAIL:]
+            if self._clean_preamble and not _PREAMBLE_RE.fullmatch(dropped):
+                self._clean_preamble = False
+
+    def _start_candidate(self) -> None:
+        """遇到 `{` / `[`：判断该候选是否可作为答案"""
+        self._anchored = bool(
+            _FENCE_TAIL_RE.search(self._gap)
+            or (self._clean_preamble and _PREAMBLE_RE.fullmatch(self._gap))
+        )
+        self._gap = ""
+
+    def _try_complete(self) -> bool:
+        candidate = "".join(self._buf)
+        self._buf = []
+        # 候选本身也算作之后候选之前的内容
+        self._clean_preamble = False
+        if not self._anchored:
+            return False
+        t_parse = time.perf_counter()
+        try:
+            self.value = json.loads(candidate)
+            self.done = True
+        except json.JSONDecodeError:
+            self.failed_candidates += 1
+        self.parse_seconds += time.perf_counter() - t_parse
+        return self.done
+
+
 def get_output_file_path(output_dir: Path, image_name: str, extension: str = ".json") -> Path:
-    """获取输出文件路径，自动处理重名"""
+    """获取输出文件路径，自动处理重名（编号由输出目录索引给出，不再逐个探测）"""
     output_dir.mkdir(parents=True, exist_ok=True)
-    base_filename = f"{image_name}_结果{extension}"
-    output_file = output_dir / base_filename
-
-    if output_file.exists():
-        counter = 1
-        while True:
-            numbered_filename = f"{image_name}_结果_{counter}{extension}"
-            output_file = output_dir / numbered_filename
-            if not output_file.exists():
-                break
-            counter += 1
+    counter = get_output_index(output_dir).next_counter(image_name, extension)
+    output_file = output_dir / output_file_name(image_name, counter, extension)
+    # 索引落后于磁盘（如其他进程刚写入）时顺延
+    while output_file.exists():
+        counter += 1
+        output_file = output_dir / output_file_name(image_name, counter, extension)
     return output_file
 
 
+def reserve_output_file_path(output_dir: Path, image_name: str, extension: str = ".json") -> Path:
+    """获取并占用输出文件路径（并发安全）。
+
+    与 get_output_file_path 的编号规则一致，但通过独占创建空文件占位，
+    避免多个线程同时处理同名图片（如 a.png / a.jpg）时拿到同一路径互相覆盖。
+    编号从输出目录索引记录的最大编号之后开始，创建成功后更新索引。
+    按运行分目录布局时返回 results.jsonl 内的成员路径，不创建文件（见 results_log 模块）。
+    """
+    results_log = active_results_log(output_dir)
+    if results_log is not None:
+        return results_log.reserve_name(image_name, extension)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = get_output_index(output_dir)
+    counter = index.next_counter(image_name, extension)
+    while True:
+        output_file = output_dir / output_file_name(image_name, counter, extension)
+        try:
+            with open(output_file, "x", encoding="utf-8"):
+                pass
+            index.add(image_name, counter, extension)
+            return output_file
+        except FileExistsError:
+            counter += 1
+
+
 def get_latest_output_file_path(output_dir: Path, image_name: str, extension: str = ".json") -> Optional[Path]:
     """获取已存在的最新输出文件路径（用于读取），自动处理编号后缀。
 
@@ -88,10 +247,8 @@ def get_latest_output_file_path(output_dir: Path, image_name: str, extension: st
     - 若存在编号文件，优先返回编号最大的那个；否则返回未编号文件
     - 若不存在匹配文件，返回 None
 
-    健壮性增强：
-    - 处理空 image_name
-    - 处理特殊字符转义
-    - 处理文件系统异常
+    通过输出目录索引查找（见 output_index 模块），不再每次遍历目录；
+    目录不存在、image_name 为空或文件系统异常时返回 None。
     """
     if not output_dir or not image_name:
         return None
@@ -100,41 +257,10 @@ def get_latest_output_file_path(output_dir: Path, image_name: str, extension: st
         output_dir = Path(output_dir)
         if not output_dir.exists() or not output_dir.is_dir():
             return None
+        latest = get_output_index(output_dir).latest(str(image_name), str(extension))
     except (TypeError, OSError):
         return None
-
-    # 转义 image_name 中的正则特殊字符
-    escaped_name = re.escape(str(image_name))
-    escaped_ext = re.escape(str(extension))
-    pattern = re.compile(rf"^{escaped_name}_结果(?:_(\d+))?{escaped_ext}$")
-
-    candidates: List[tuple[int, float, Path]] = []
-    try:
-        for path in output_dir.iterdir():
-            try:
-                if not path.is_file():
-                    continue
-                match = pattern.match(path.name)
-                if not match:
-                    continue
-                counter = int(match.group(1) or 0)
-                try:
-                    mtime = path.stat().st_mtime
-                except OSError:
-                    mtime = 0.0
-                candidates.append((counter, mtime, path))
-            except (OSError, ValueError):
-                # 跳过无法访问的文件
-                continue
-    except (FileNotFoundError, PermissionError, OSError):
-        return None
-
-    if not candidates:
-        return None
-
-    # 按编号降序，同编号按修改时间降序
-    candidates.sort(key=lambda x: (x[0], x[1]), reverse=True)
-    return candidates[0][2]
+    return output_dir / latest.name if latest is not None else None
 
 
 def save_result(
@@ -146,8 +272,13 @@ def save_result(
         result_json: Optional[Dict[str, Any] | List[Any] | Any] = None,
         error_msg: Optional[str] = None,
         raw_response: Optional[str] = None,
+        background: bool = False,
 ):
-    """将处理结果保存到JSON文件中"""
+    """将处理结果保存到JSON文件中
+
+    background=True 时只把结果交给后台写盘线程（见 result_writer 模块），读取前需先 flush()；
+    否则在当前线程写入。两种方式都先写临时文件再替换，不会留下写了一半的文件。
+    """
     payload = {
         "image_name": image_path.name,
         "processed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -170,5 +301,8 @@ def save_result(
         if raw_response and result_json is None:
             payload["raw_model_output"] = raw_response
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    writer = get_result_writer()
+    if background:
+        writer.submit(output_file, payload)
+    else:
+        writer.write_now(output_file, payload)
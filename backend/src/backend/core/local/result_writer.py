@@ -0,0 +1,288 @@
+"""
+结果写盘模块
+工作线程解析完模型输出后只把结果交给后台写盘线程，序列化与文件 I/O 不再占用网络工作线程
+
+- 有界队列（DEFAULT_WRITER_QUEUE_SIZE）：写盘跟不上时 submit 阻塞，形成背压
+- 写盘线程每次取出队列中已有的任务（最多 DEFAULT_WRITER_BATCH_SIZE 个）批量写入，同一文件只写最后一次提交的内容
+- 每个文件先写同目录下的临时文件再 os.replace，读取方只会看到完整的文件
+- 尚未落盘的结果可通过 load() 从内存读取（结果缓存、批内去重复制结果时使用）
+- 目标目录是按运行分目录布局的运行目录时，结果追加到该目录的 results.jsonl（见 results_log 模块）
+- 每次运行结束前 flush()，进程退出时（atexit）再 flush 一次
+- 写入失败的结果文件按路径记录，运行结束时由该次运行用 take_failures() 取走自己的部分，
+  对应图片在运行汇总中改记为失败（写盘线程为进程级单例，同时进行的多次运行互不影响）
+
+持久性保证：
+- DEFAULT_RESULT_FSYNC 关闭（默认）：进程崩溃不会留下写了一半的结果文件（只会是占位空文件或完整文件），
+  但断电/系统崩溃时可能丢失最近写入的结果
+- DEFAULT_RESULT_FSYNC 开启：rename 前对文件 fsync，每批结束后对涉及的目录 fsync 一次，flush() 返回即已落盘
+- 检查点清单可能先于结果文件写入；resume 时输出文件为空的占位文件视为未完成，会重跑
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from backend.core.config import (
+    console, with_icon,
+    DEFAULT_WRITER_QUEUE_SIZE, DEFAULT_WRITER_BATCH_SIZE, DEFAULT_RESULT_FSYNC,
+)
+from backend.core.local.results_log import ResultsLog, active_results_log, read_result
+
+
+class _WriteTask:
+    __slots__ = ("path", "payload", "is_text", "seq", "log", "offset", "data")
+
+    def __init__(self, path: Path, payload: Any, is_text: bool, seq: int) -> None:
+        self.path = path
+        self.payload = payload
+        self.is_text = is_text
+        self.seq = seq
+        # 追加到 results.jsonl 时的目标与已分配的偏移
+        self.log: Optional[ResultsLog] = None
+        self.offset = 0
+        self.data = b""
+
+
+class ResultWriter:
+    """后台写盘线程（首次提交时启动），线程安全"""
+
+    def __init__(
+            self,
+            queue_size: int = DEFAULT_WRITER_QUEUE_SIZE,
+            batch_size: int = DEFAULT_WRITER_BATCH_SIZE,
+            fsync: bool = DEFAULT_RESULT_FSYNC,
+    ) -> None:
+        self.batch_size = max(1, int(batch_size))
+        self.fsync = bool(fsync)
+        self._queue: "queue.Queue[_WriteTask]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._lock = threading.Lock()
+        # 已提交尚未落盘的内容：path -> 最近一次提交的任务
+        self._pending: Dict[Path, _WriteTask] = {}
+        # 已分配尚未落盘的备份文件名
+        self._reserved: Set[Path] = set()
+        # 写入失败的结果文件：path -> 错误信息（之后同一路径写入成功时清除）
+        self._failures: Dict[Path, str] = {}
+        self._seq = 0
+        self._thread: Optional[threading.Thread] = None
+        self.files = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.max_backlog = 0
+
+    # ---------- 提交 ----------
+    def submit(self, path: Path, payload: Any) -> None:
+        """提交一个 JSON 结果文件（payload 提交后不应再修改）"""
+        self._submit(Path(path), payload, is_text=False)
+
+    def submit_text(self, path: Path, text: str) -> None:
+        """提交一个文本文件（如模型原始输出备份）"""
+        self._submit(Path(path), text, is_text=True)
+
+    def _submit(self, path: Path, payload: Any, *, is_text: bool) -> None:
+        log = None if is_text else active_results_log(path.parent)
+        with self._lock:
+            self._seq += 1
+            task = _WriteTask(path, payload, is_text, self._seq)
+            if log is not None:
+                task.log = log
+                task.offset, task.data = log.allocate(path.name, payload)
+            self._pending[path] = task
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._thread.start()
+        self._queue.put(task)
+        backlog = self._queue.qsize()
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    def write_now(self, path: Path, payload: Any) -> None:
+        """在当前线程同步写入一个 JSON 结果文件（同样先写临时文件再替换；运行目录下直接追加到 results.jsonl）"""
+        path = Path(path)
+        with self._lock:
+            # 覆盖同一路径时，排队中的旧内容作废
+            self._pending.pop(path, None)
+        log = active_results_log(path.parent)
+        if log is not None:
+            log.write_at(*log.allocate(path.name, payload))
+            log.sync(self.fsync)
+            return
+        self._write_file(path, _dump(payload))
+
+    # ---------- 读取 ----------
+    def load(self, path: Path) -> Any:
+        """读取 JSON 结果：尚未落盘时直接返回内存中的内容，否则读文件"""
+        path = Path(path)
+        with self._lock:
+            task = self._pending.get(path)
+        if task is not None and not task.is_text:
+            return task.payload
+        return read_result(path)
+
+    def reserve_backup_path(self, output_dir: Path, image_stem: str) -> Path:
+        """分配备份文件名：与磁盘上已有文件及尚未落盘的备份都不重名"""
+        with self._lock:
+            backup_file = Path(output_dir) / f"{image_stem}_backup.txt"
+            counter = 1
+            while backup_file in self._reserved or backup_file.exists():
+                backup_file = Path(output_dir) / f"{image_stem}_backup_{counter}.txt"
+                counter += 1
+            self._reserved.add(backup_file)
+            return backup_file
+
+    # ---------- 刷新 ----------
+    def flush(self) -> None:
+        """等待已提交的文件全部写完"""
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+        if running:
+            self._queue.join()
+
+    def take_failures(self, paths: Iterable[Path | str]) -> Dict[str, str]:
+        """取走这些结果文件的写入失败记录，返回 {路径: 错误信息}（应在 flush() 之后调用）"""
+        failures: Dict[str, str] = {}
+        with self._lock:
+            for path in paths:
+                error = self._failures.pop(Path(path), None)
+                if error is not None:
+                    failures[str(path)] = error
+        return failures
+
+    def snapshot(self, failures: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """用于 run_summary 的状态快照：files/batches 等为进程内累计，errors/failed_files 为本次运行（take_failures 的结果）"""
+        failures = failures or {}
+        return {
+            "files": self.files,
+            "batches": self.batches,
+            "errors": len(failures),
+            "failed_files": sorted(failures),
+            "write_seconds": round(self.write_seconds, 4),
+            "max_backlog": self.max_backlog,
+            "fsync": self.fsync,
+        }
+
+    # ---------- 写盘线程 ----------
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[_WriteTask]) -> None:
+        t0 = time.perf_counter()
+        dirs: Set[Path] = set()
+        logs: Dict[ResultsLog, List[_WriteTask]] = {}
+        for task in batch:
+            with self._lock:
+                latest = self._pending.get(task.path)
+            # 同一文件在队列中有更新的内容时跳过旧的（write_now 覆盖后 latest 为 None）；
+            # results.jsonl 中的行已分配偏移，必须写入
+            if latest is not task and task.log is None:
+                continue
+            try:
+                if task.log is not None:
+                    task.log.write_at(task.offset, task.data)
+                    logs.setdefault(task.log, []).append(task)
+                else:
+                    data = task.payload if task.is_text else _dump(task.payload)
+                    self._write_file(task.path, data, sync_dir=False)
+                    dirs.add(task.path.parent)
+                    self._mark(task, None)
+                self.files += 1
+            except Exception as exc:
+                self._mark(task, exc)
+                console.error(with_icon("error", f"结果写入失败: {task.path} ({exc})"))
+            finally:
+                with self._lock:
+                    if self._pending.get(task.path) is task:
+                        del self._pending[task.path]
+                    self._reserved.discard(task.path)
+        for log, tasks in logs.items():
+            error: Optional[BaseException] = None
+            try:
+                log.sync(self.fsync)
+            except OSError as exc:
+                error = exc
+                console.error(with_icon("error", f"结果写入失败: {log.path} ({exc})"))
+            # 未能同步的行不算写入成功
+            for task in tasks:
+                self._mark(task, error)
+        if self.fsync:
+            for directory in dirs:
+                _fsync_dir(directory)
+        self.batches += 1
+        self.write_seconds += time.perf_counter() - t0
+
+    def _mark(self, task: _WriteTask, exc: Optional[BaseException]) -> None:
+        """记录结果文件的写入结果（备份文本不对应图片记录，不记录）"""
+        if task.is_text:
+            return
+        with self._lock:
+            if exc is None:
+                self._failures.pop(task.path, None)
+            else:
+                self._failures[task.path] = str(exc)
+
+    def _write_file(self, path: Path, data: str, *, sync_dir: bool = True) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            raise
+        if self.fsync and sync_dir:
+            _fsync_dir(path.parent)
+
+
+def _dump(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, indent=2)
+
+
+def _fsync_dir(directory: Path) -> None:
+    """让 rename 本身落盘（Windows 不支持打开目录，直接跳过）"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_RESULT_WRITER: Optional[ResultWriter] = None
+_RESULT_WRITER_LOCK = threading.Lock()
+
+
+def get_result_writer() -> ResultWriter:
+    """获取全局写盘线程（首次调用时创建，并注册进程退出时的 flush）"""
+    global _RESULT_WRITER
+    with _RESULT_WRITER_LOCK:
+        if _RESULT_WRITER is None:
+            _RESULT_WRITER = ResultWriter()
+            atexit.register(_RESULT_WRITER.flush)
+        return _RESULT_WRITER
@@ -0,0 +1,255 @@
+"""
+按运行分目录的输出布局
+output_layout="run" 时每次运行写入 data/outputs/<模型目录>/runs/<run_id>/，每张图片的结果不再单独成文件，
+而是追加到该目录下的 results.jsonl；output_layout="files"（默认，兼容模式）仍在模型目录下每张图片写一个 JSON 文件
+
+- results.jsonl 每行一个结果，内容与单文件布局的结果 JSON 相同，另加 output_name（沿用 {图片名}_结果.json 的命名）
+- 记录中的 output_file 为 <运行目录>/<output_name>，即 results.jsonl 内的成员路径（磁盘上没有同名文件），
+  统一用 read_result / result_exists 读取与判断，单文件布局的路径同样适用
+- 提交结果时先按行长度分配字节偏移，再由后台写盘线程写到该偏移（见 result_writer 模块），
+  运行结束时把偏移索引写入 results.index.json（{output_name: [offset, length]}），按图片读取时只读一行
+- 运行中途退出没有索引文件时，逐行扫描 results.jsonl 重建索引（写了一半的行跳过，未写入的空洞不影响其后的行）
+- 检查点清单仍在模型目录下，resume 跨运行目录生效
+- 正在写入的 results.jsonl 登记到运行结束（close）为止；只读打开的按最近使用保留 READ_CACHE_SIZE 个，避免长期运行的服务进程无限增长
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+LAYOUT_FILES = "files"
+LAYOUT_RUN = "run"
+OUTPUT_LAYOUTS = (LAYOUT_FILES, LAYOUT_RUN)
+
+RUNS_DIRNAME = "runs"
+RESULTS_FILENAME = "results.jsonl"
+RESULTS_INDEX_FILENAME = "results.index.json"
+# 只读打开的 results.jsonl（含已结束的运行）最多缓存的个数，超出时淘汰最久未使用的
+READ_CACHE_SIZE = 16
+
+
+def run_output_dir(model_dir: Path, run_id: str) -> Path:
+    """按运行分目录时本次运行的输出目录"""
+    return Path(model_dir) / RUNS_DIRNAME / run_id
+
+
+class ResultsLog:
+    """单个运行目录的 results.jsonl（线程安全）
+
+    allocate() 在提交方线程中分配偏移，write_at() 只由写盘线程调用，行写入顺序不必与分配顺序一致。
+    """
+
+    def __init__(self, run_dir: Path, *, writable: bool = False) -> None:
+        self.run_dir = Path(run_dir)
+        self.path = self.run_dir / RESULTS_FILENAME
+        self.index_path = self.run_dir / RESULTS_INDEX_FILENAME
+        self.writable = writable
+        self._lock = threading.Lock()
+        self._offsets: Dict[str, tuple[int, int]] = {}
+        self._names: Set[str] = set()
+        self._end = 0
+        self._file = None
+        self._indexed = writable
+        if writable:
+            self.run_dir.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "wb")
+
+    # ---------- 写入 ----------
+    def reserve_name(self, image_name: str, extension: str = ".json") -> Path:
+        """分配本次运行内不重名的成员路径（与单文件布局的编号规则一致，但不创建文件）"""
+        with self._lock:
+            counter = 0
+            while True:
+                suffix = f"_{counter}" if counter else ""
+                name = f"{image_name}_结果{suffix}{extension}"
+                if name not in self._names:
+                    self._names.add(name)
+                    return self.run_dir / name
+                counter += 1
+
+    def allocate(self, name: str, payload: Any) -> tuple[int, bytes]:
+        """序列化一行并分配偏移，返回 (offset, data)"""
+        data = (json.dumps({"output_name": name, **payload}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            offset = self._end
+            self._end += len(data)
+            self._offsets[name] = (offset, len(data))
+            self._names.add(name)
+        return offset, data
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        with self._lock:
+            if self._file is None:
+                raise ValueError(f"{self.path} 已关闭")
+            self._file.seek(offset)
+            self._file.write(data)
+
+    def sync(self, fsync: bool = False) -> None:
+        """把已写入的行交给操作系统（fsync 时同时落盘）"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """关闭 results.jsonl 并写入偏移索引（调用前需先 flush 写盘线程），同时注销正在写入的登记"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            self.writable = False
+            index = {name: list(entry) for name, entry in self._offsets.items()}
+        try:
+            tmp = self.index_path.with_name(f".{self.index_path.name}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp, self.index_path)
+        finally:
+            _release_results_log(self)
+
+    # ---------- 读取 ----------
+    def has(self, name: str) -> bool:
+        with self._lock:
+            self._ensure_index()
+            return name in self._offsets
+
+    def read(self, name: str) -> Any:
+        """按偏移读取一个结果"""
+        with self._lock:
+            self._ensure_index()
+            entry = self._offsets.get(name)
+            if self._file is not None:
+                self._file.flush()
+        if entry is None:
+            raise FileNotFoundError(str(self.run_dir / name))
+        offset, length = entry
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            payload = json.loads(f.read(length).decode("utf-8"))
+        payload.pop("output_name", None)
+        return payload
+
+    def _ensure_index(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            self._offsets = {name: (int(entry[0]), int(entry[1])) for name, entry in index.items()}
+            return
+        except (OSError, ValueError, TypeError, IndexError):
+            pass
+        self._offsets = _scan_offsets(self.path)
+
+    def __repr__(self) -> str:
+        return f"ResultsLog({self.run_dir})"
+
+
+def _scan_offsets(path: Path) -> Dict[str, tuple[int, int]]:
+    """逐行扫描 results.jsonl 重建偏移索引；损坏的行（写了一半或未写入的空洞）跳过
+
+    未写入的空洞是一段 \\x00，其中没有换行，会和后面的行连成一行：从该行最后一个 \\x00 之后开始解析
+    （合法的 JSON 行里不会出现 \\x00），空洞之后的记录按其实际偏移登记，不随空洞一起丢弃。
+    """
+    offsets: Dict[str, tuple[int, int]] = {}
+    try:
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                start = line.rfind(b"\x00") + 1
+                try:
+                    name = json.loads(line[start:].decode("utf-8")).get("output_name")
+                except (ValueError, AttributeError):
+                    name = None
+                if name:
+                    offsets[name] = (offset + start, len(line) - start)
+                offset += len(line)
+    except OSError:
+        pass
+    return offsets
+
+
+# 正在写入的 results.jsonl（close 时注销）与只读打开的 results.jsonl（按最近使用淘汰）
+_ACTIVE_LOGS: Dict[Path, ResultsLog] = {}
+_READ_LOGS: OrderedDict[Path, ResultsLog] = OrderedDict()
+_RESULTS_LOGS_LOCK = threading.Lock()
+
+
+def _cache_read_log(key: Path, log: ResultsLog) -> None:
+    """登记只读的 results.jsonl，超出 READ_CACHE_SIZE 时淘汰最久未使用的（调用方持有锁）"""
+    _READ_LOGS[key] = log
+    _READ_LOGS.move_to_end(key)
+    while len(_READ_LOGS) > READ_CACHE_SIZE:
+        _READ_LOGS.popitem(last=False)
+
+
+def _release_results_log(log: ResultsLog) -> None:
+    """运行结束：注销正在写入的登记，已关闭的 log 带着完整索引转入只读缓存"""
+    key = log.run_dir.resolve()
+    with _RESULTS_LOGS_LOCK:
+        if _ACTIVE_LOGS.get(key) is log:
+            del _ACTIVE_LOGS[key]
+            _cache_read_log(key, log)
+
+
+def open_results_log(run_dir: Path) -> ResultsLog:
+    """为本次运行创建 results.jsonl 并登记，之后写入该目录的结果都追加到其中（close 时注销）"""
+    log = ResultsLog(run_dir, writable=True)
+    key = log.run_dir.resolve()
+    with _RESULTS_LOGS_LOCK:
+        _READ_LOGS.pop(key, None)
+        _ACTIVE_LOGS[key] = log
+    return log
+
+
+def active_results_log(directory: Path) -> Optional[ResultsLog]:
+    """目录对应的、正在写入的 results.jsonl；单文件布局或运行已结束时为 None"""
+    with _RESULTS_LOGS_LOCK:
+        log = _ACTIVE_LOGS.get(Path(directory).resolve())
+    return log if log is not None and log.writable else None
+
+
+def get_results_log(directory: Path) -> Optional[ResultsLog]:
+    """目录对应的 results.jsonl（正在写入的或磁盘上已有的），没有时为 None"""
+    key = Path(directory).resolve()
+    with _RESULTS_LOGS_LOCK:
+        log = _ACTIVE_LOGS.get(key)
+        if log is not None:
+            return log
+        log = _READ_LOGS.get(key)
+        if log is None:
+            if not (key / RESULTS_FILENAME).is_file():
+                return None
+            log = ResultsLog(key)
+        _cache_read_log(key, log)
+        return log
+
+
+def read_result(path: Path) -> Any:
+    """读取一张图片的结果 JSON：单文件布局读文件，按运行分目录时从 results.jsonl 按偏移读取"""
+    path = Path(path)
+    if path.is_file():
+        return json.loads(path.read_text(encoding="utf-8"))
+    log = get_results_log(path.parent)
+    if log is None:
+        raise FileNotFoundError(str(path))
+    return log.read(path.name)
+
+
+def result_exists(path: Path) -> bool:
+    """结果是否已写出（单文件布局下占位的空文件不算）"""
+    path = Path(path)
+    try:
+        if path.stat().st_size > 0:
+            return True
+    except OSError:
+        pass
+    log = get_results_log(path.parent)
+    return log is not None and log.has(path.name)
@@ -0,0 +1,222 @@
+"""
+重试调度模块
+包含错误分类、指数退避（带抖动，遵守 Retry-After）以及延迟重试队列
+
+- classify_error(): 把异常归类为 rate_limited / server_error / timeout / connection / circuit_open /
+  client_error / invalid_output / cancelled / unknown，其中 client_error（400/401/403/404/422 等）与 cancelled 不重试
+- RetryPolicy.decide(): 根据分类与重试次数给出是否重试及退避时间
+- DeferredRetryQueue: 按就绪时间排序的重试队列，失败图片退避期间不占用工作线程
+- run_with_deferred_retries(): 线程池调度器，优先执行已就绪的重试，否则取新图片
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from backend.core.local.api_client import CircuitOpenError, error_status_code
+from backend.core.local.cancellation import CancelToken, CancelledRunError
+from backend.core.local.result_handler import ModelOutputError
+
+# 可重试的错误类别；client_error 为请求本身有问题（参数/鉴权/不存在的模型），重试无意义
+RETRYABLE_KINDS = frozenset({
+    "rate_limited", "server_error", "timeout", "connection", "invalid_output", "circuit_open", "unknown",
+})
+# 服务端过载类错误：指数退避；其余可重试错误使用固定的 base_delay
+BACKOFF_KINDS = frozenset({"rate_limited", "server_error", "timeout", "connection", "unknown"})
+
+# Retry-After 的合理上限，防止异常响应头让任务挂起过久
+MAX_RETRY_AFTER_SECONDS = 300.0
+
+
+def classify_error(exc: BaseException) -> str:
+    """把请求异常归类，供重试策略与日志使用"""
+    if isinstance(exc, ModelOutputError):
+        return "invalid_output"
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(exc, CancelledRunError):
+        return "cancelled"
+
+    code = error_status_code(exc)
+    if code is not None:
+        if code == 429:
+            return "rate_limited"
+        if code == 408:
+            return "timeout"
+        if code >= 500:
+            return "server_error"
+        if 400 <= code < 500:
+            return "client_error"
+
+    name = type(exc).__name__.lower()
+    if "timeout" in name or isinstance(exc, TimeoutError):
+        return "timeout"
+    if "connection" in name or isinstance(exc, ConnectionError):
+        return "connection"
+    return "unknown"
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """读取响应头中的 Retry-After / retry-after-ms（秒数或 HTTP 日期），没有则返回 None
+
+    本地产生的异常（如 CircuitOpenError）可直接带 retry_after 属性。
+    """
+    explicit = getattr(exc, "retry_after", None)
+    if isinstance(explicit, (int, float)):
+        return max(0.0, float(explicit))
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        retry_ms = headers.get("retry-after-ms")
+        if retry_ms is not None:
+            return max(0.0, float(retry_ms) / 1000.0)
+        value = headers.get("retry-after")
+    except Exception:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass(frozen=True)
+class RetryDecision:
+    """一次失败后的处理结论：retry 为 False 时 delay 无意义"""
+    retry: bool
+    kind: str
+    delay: float = 0.0
+    retry_after: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """指数退避 + 抖动
+
+    第 n 次重试的退避时间为 base_delay * multiplier^(n-1)，不超过 max_delay，
+    再乘以 [1 - jitter, 1] 的随机系数打散同时失败的请求；服务端给出 Retry-After 时至少等待该时间。
+    invalid_output 等非过载错误只等待 base_delay。
+    """
+    max_retries: int
+    base_delay: float
+    max_delay: float = 60.0
+    multiplier: float = 2.0
+    jitter: float = 0.5
+
+    def decide(self, exc: BaseException, retry_count: int) -> RetryDecision:
+        """retry_count 为本次失败后的累计失败次数（从 1 开始）"""
+        kind = classify_error(exc)
+        if kind not in RETRYABLE_KINDS or retry_count > self.max_retries:
+            return RetryDecision(retry=False, kind=kind)
+
+        base = max(0.0, float(self.base_delay))
+        if kind in BACKOFF_KINDS:
+            delay = min(max(base, float(self.max_delay)), base * self.multiplier ** (retry_count - 1))
+            delay *= 1.0 - random.uniform(0.0, max(0.0, min(1.0, self.jitter)))
+        else:
+            delay = base
+
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER_SECONDS))
+        return RetryDecision(retry=True, kind=kind, delay=delay, retry_after=retry_after)
+
+
+class DeferredRetryQueue:
+    """按就绪时间排序的延迟重试队列（非线程安全，由调度线程独占使用）"""
+
+    def __init__(self) -> None:
+        self._heap: List[tuple[float, int, Any]] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item: Any, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), next(self._seq), item))
+
+    def pop_ready(self) -> Optional[Any]:
+        """弹出一个已到就绪时间的任务，没有则返回 None"""
+        if self._heap and self._heap[0][0] <= time.monotonic():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def next_ready_in(self) -> Optional[float]:
+        """距最早一个任务就绪的秒数，队列为空时返回 None"""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def release_all(self) -> None:
+        """所有任务立即就绪（任务取消时使用）"""
+        self._heap = [(0.0, seq, item) for _, seq, item in self._heap]
+        heapq.heapify(self._heap)
+
+
+def run_with_deferred_retries(
+        attempts: Sequence[Callable[[], Any]],
+        max_workers: int,
+        cancel: Optional[CancelToken] = None,
+) -> List[Dict[str, Any]]:
+    """在线程池中执行各图片任务，失败重试进入延迟队列而不是在工作线程里 sleep
+
+    attempts[i]() 每次只做一次尝试：返回 dict 表示最终结果，返回 RetryDecision 表示需在 delay 秒后重试。
+    任何时刻在途任务数不超过 max_workers；已就绪的重试优先于尚未开始的图片。
+    cancel 触发后退避中的重试立即就绪（由 attempt 自行以 cancelled 结束）。
+    返回值按 attempts 顺序排列。
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(attempts)
+    fresh = deque(range(len(attempts)))
+    deferred = DeferredRetryQueue()
+    max_workers = max(1, int(max_workers))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running: Dict[Any, int] = {}
+        while fresh or deferred or running:
+            if cancel is not None and cancel.cancelled:
+                deferred.release_all()
+            # 填满空闲工作线程：就绪的重试优先
+            while len(running) < max_workers:
+                i = deferred.pop_ready()
+                if i is None:
+                    if not fresh:
+                        break
+                    i = fresh.popleft()
+                running[executor.submit(attempts[i])] = i
+
+            if not running:
+                # 只剩退避中的重试
+                if cancel is not None:
+                    cancel.wait(deferred.next_ready_in() or 0.0)
+                else:
+                    time.sleep(deferred.next_ready_in() or 0.0)
+                continue
+
+            timeout = deferred.next_ready_in() if len(running) < max_workers else None
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                outcome = future.result()
+                if isinstance(outcome, RetryDecision):
+                    deferred.push(i, outcome.delay)
+                else:
+                    results[i] = outcome
+
+    return results  # type: ignore[return-value]
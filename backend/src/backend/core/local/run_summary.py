@@ -0,0 +1,288 @@
+"""
+运行汇总模块
+每张图片得到最终结果时追加一行到输出目录下本次运行的 run_summary.<run_id>.jsonl，
+运行结束后写入 footer 与精简的 run_summary.json
+
+逐图记录按 run_id 分文件：同一模型目录下并发的多次运行（如两个 API 任务）各写各的文件，互不覆盖；
+run_summary.json 只在运行结束时整体替换（先写临时文件再 os.replace），始终指向最近一次完成的运行。
+
+run_summary.<run_id>.jsonl 每行一个 JSON 对象，按 type 区分：
+- header：运行开始时写入（模型、提示词、输入/输出目录、run_id、开始时间）
+- image：每张图片一行，按完成顺序追加并立即 flush，进程中途退出时已完成的部分不会丢失
+- footer：运行结束时写入（结束时间、耗时、totals）；没有 footer 表示运行未正常结束
+
+运行结束时若有结果文件写入失败，对应的 image 行改为失败（error_kind=write_failed）后整体重写该文件，totals 随之修正。
+
+run_summary.json 只保存汇总与参数快照（不含逐图记录，images_file 指向 jsonl），
+读取方使用 iter_run_records / read_run_summary 逐行读取，不再一次性加载整个文件；
+传入 run_id 时读取该次运行自己的记录（运行中或已结束），不受同目录其它运行的影响。
+旧版的 run_summary.jsonl（不带 run_id）仍可读取。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+SUMMARY_FILENAME = "run_summary.json"
+# 旧版逐图记录文件（不带 run_id），只读
+RECORDS_FILENAME = "run_summary.jsonl"
+RECORDS_GLOB = "run_summary.*.jsonl"
+
+
+def records_filename(run_id: str) -> str:
+    """本次运行的逐图记录文件名"""
+    return f"run_summary.{run_id}.jsonl"
+
+
+class RunSummaryWriter:
+    """追加写入的运行汇总（线程安全），同时累计 totals 与批内去重统计，不在内存中保留逐图记录"""
+
+    def __init__(self, output_dir: Path, header: Dict[str, Any]) -> None:
+        self.run_id = header["run_id"]
+        self.path = Path(output_dir) / records_filename(self.run_id)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.success = 0
+        self.failed = 0
+        self._dedup = {"duplicates": 0, "saved_requests": 0, "saved_seconds": 0.0, "saved_tokens": 0}
+        self._lock = threading.Lock()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._write({"type": "header", **header})
+
+    @property
+    def total(self) -> int:
+        return self.success + self.failed
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {"success": self.success, "failed": self.failed, "all": self.success + self.failed}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """追加一张图片的最终记录并立即落盘"""
+        line = json.dumps({"type": "image", **record}, ensure_ascii=False) + "\n"
+        with self._lock:
+            if record.get("status") == "success":
+                self.success += 1
+            else:
+                self.failed += 1
+            if record.get("deduplicated"):
+                self._dedup["duplicates"] += 1
+                self._dedup["saved_requests"] += 1
+                self._dedup["saved_seconds"] += record.get("saved_seconds") or 0.0
+                self._dedup["saved_tokens"] += record.get("saved_tokens") or 0
+            self._file.write(line)
+            self._file.flush()
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        for record in records:
+            self.add(record)
+
+    def success_files(self) -> List[str]:
+        """本次运行中成功图片的输出文件（运行结束时核对写盘失败用）"""
+        with self._lock:
+            self._file.flush()
+        return [
+            record["output_file"] for record in _iter_images(self.path)
+            if record.get("status") == "success" and record.get("output_file")
+        ]
+
+    def mark_failed(self, failures: Dict[str, str]) -> List[Dict[str, Any]]:
+        """把输出文件写入失败（failures: 路径 -> 错误信息）的成功记录改为失败，重写本次运行的 jsonl 并修正 totals
+
+        返回改写后的记录（供调用方同步写入检查点清单）。
+        """
+        changed: List[Dict[str, Any]] = []
+        with self._lock:
+            self._file.close()
+            tmp = self.path.with_name(f".{self.path.name}.tmp")
+            with open(self.path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+                for line in src:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        entry = None
+                    if (isinstance(entry, dict) and entry.get("type") == "image"
+                            and entry.get("status") == "success" and entry.get("output_file") in failures):
+                        entry.update({
+                            "status": "failed",
+                            "error": f"结果写入失败: {failures[entry['output_file']]}",
+                            "error_kind": "write_failed",
+                        })
+                        self.success -= 1
+                        self.failed += 1
+                        line = json.dumps(entry, ensure_ascii=False) + "\n"
+                        changed.append({k: v for k, v in entry.items() if k != "type"})
+                    dst.write(line)
+            os.replace(tmp, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return changed
+
+    def dedup_summary(self) -> Dict[str, Any]:
+        """批内去重节省的请求数、耗时与 token"""
+        with self._lock:
+            return {**self._dedup, "saved_seconds": round(self._dedup["saved_seconds"], 4)}
+
+    def close(self, footer: Dict[str, Any]) -> None:
+        """写入 footer 并关闭文件"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(json.dumps({"type": "footer", **footer}, ensure_ascii=False) + "\n")
+            self._file.close()
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+
+def _iter_lines(path: Path) -> Iterator[Dict[str, Any]]:
+    """逐行读取 jsonl；损坏的行（如进程中途退出时写了一半）直接跳过"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict):
+                yield entry
+
+
+def _iter_images(records_path: Path) -> Iterator[Dict[str, Any]]:
+    for entry in _iter_lines(records_path):
+        if entry.pop("type", None) == "image":
+            yield entry
+
+
+def write_summary_file(output_dir: Path, summary: Dict[str, Any]) -> Path:
+    """运行结束时整体替换 run_summary.json（读取方不会读到写了一半的文件）"""
+    summary_path = Path(output_dir) / SUMMARY_FILENAME
+    tmp = summary_path.with_name(f".{SUMMARY_FILENAME}.{summary.get('run_id') or os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, summary_path)
+    return summary_path
+
+
+def _read_summary_file(output_dir: Path) -> Dict[str, Any]:
+    summary_path = Path(output_dir) / SUMMARY_FILENAME
+    try:
+        summary = json.loads(summary_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return summary if isinstance(summary, dict) else {}
+
+
+def _records_path(output_dir: Path, run_id: Optional[str] = None) -> Optional[Path]:
+    """逐图记录文件：指定 run_id 时为该次运行的文件；否则依次取 run_summary.json 指向的文件、
+    最近修改的 run_summary.<run_id>.jsonl、旧版 run_summary.jsonl"""
+    output_dir = Path(output_dir)
+    if run_id:
+        path = output_dir / records_filename(run_id)
+        return path if path.is_file() else None
+    images_file = _read_summary_file(output_dir).get("images_file")
+    if images_file and Path(images_file).is_file():
+        return Path(images_file)
+    candidates = []
+    for path in output_dir.glob(RECORDS_GLOB):
+        try:
+            candidates.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    if candidates:
+        return max(candidates)[1]
+    legacy = output_dir / RECORDS_FILENAME
+    return legacy if legacy.is_file() else None
+
+
+def iter_run_records(output_dir: Path, run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """逐条读取图片记录（按完成顺序）：run_id 为空时为本目录最近一次运行；旧版 run_summary.json 中的 images 也兼容"""
+    records_path = _records_path(output_dir, run_id)
+    if records_path is not None:
+        yield from _iter_images(records_path)
+        return
+    if not run_id:
+        yield from _read_summary_file(output_dir).get("images") or []
+
+
+def read_run_summary(
+        output_dir: Path,
+        *,
+        run_id: Optional[str] = None,
+        include_images: bool = True,
+) -> Dict[str, Any]:
+    """读取运行汇总；include_images 时附带按图片序号排列的 images
+
+    run_id 为空时读取本目录最近一次运行；指定 run_id 时只读该次运行。
+    run_summary.json 属于另一次运行或尚未写出（运行中、中途退出）时，由记录文件的 header 与逐图记录重建，
+    没有 footer 的标记 complete=False。
+    """
+    output_dir = Path(output_dir)
+    records_path = _records_path(output_dir, run_id)
+    summary = _read_summary_file(output_dir)
+    if "images" in summary and records_path is None and not run_id:
+        # 旧版格式：逐图记录就在 run_summary.json 中
+        if not include_images:
+            summary.pop("images")
+        return summary
+    if records_path is None:
+        return {}
+    if summary.get("images_file") != str(records_path.resolve()):
+        summary = _rebuild_summary(records_path)
+
+    if include_images:
+        summary["images"] = sorted(_iter_images(records_path), key=lambda r: r.get("index") or 0)
+    return summary
+
+
+def _rebuild_summary(records_path: Path) -> Dict[str, Any]:
+    """由 jsonl 重建汇总（run_summary.json 尚未写出时）"""
+    summary: Dict[str, Any] = {}
+    success = failed = 0
+    footer: Optional[Dict[str, Any]] = None
+    for entry in _iter_lines(records_path):
+        kind = entry.pop("type", None)
+        if kind == "header":
+            summary.update(entry)
+        elif kind == "footer":
+            footer = entry
+        elif kind == "image":
+            if entry.get("status") == "success":
+                success += 1
+            else:
+                failed += 1
+    summary["totals"] = {"success": success, "failed": failed, "all": success + failed}
+    if footer is not None:
+        summary.update(footer)
+    summary["complete"] = footer is not None
+    summary["images_file"] = str(records_path.resolve())
+    return summary
+
+
+def run_header(
+        *,
+        model_name: str,
+        model_info: Optional[str],
+        prompt: str,
+        start_time: datetime,
+        input_dir_path: Path,
+        output_dir: Path,
+        run_id: str,
+        total: int,
+) -> Dict[str, Any]:
+    return {
+        "model_name": model_name,
+        "model_info": model_info,
+        "prompt": prompt,
+        "run_started_at": start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "input_dir": str(Path(input_dir_path).resolve()),
+        "output_dir": str(Path(output_dir).resolve()),
+        "run_id": run_id,
+        "images_total": total,
+    }
@@ -0,0 +1,622 @@
+"""
+单图流式会话模块
+封装单张图片一次流式调用中的计时、事件、日志、JSON 解析与结果保存，
+供线程版 (cloud_processor) 与 asyncio 版 (async_processor) 引擎共用。
+
+引擎只负责驱动网络 I/O（同步 for / 异步 async for），其余逻辑全部在这里，
+保证两种引擎输出的事件、日志与 run_summary 记录完全一致。
+"""
+from __future__ import annotations
+
+import json
+import re
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable
+
+from backend.core.config import console, with_icon, DEFAULT_DELTA_WINDOW_MS, DEFAULT_DELTA_MAX_BYTES
+from backend.core.local.result_handler import IncrementalJSONExtractor, save_result
+from backend.core.local.result_writer import get_result_writer
+
+
+def _extract_json_from_text(raw_text: str) -> tuple[Any, bool, str]:
+    """
+    从模型输出中容错提取 JSON
+
+    返回: (parsed_json, is_valid, error_reason)
+    - 成功: (json_obj, True, "")
+    - 失败: (None, False, "错误原因")
+    """
+    if not raw_text or not raw_text.strip():
+        return None, False, "empty_response"
+
+    stripped = raw_text.strip()
+    candidates = []
+
+    # 1. 尝试直接解析
+    candidates.append(stripped)
+
+    # 2. 提取 ```json codeblock
+    if "```" in stripped:
+        # 匹配 ```json ... ``` 或 ``` ... ```
+        codeblock_pattern = r"```(?:json)?\s*([\s\S]*?)```"
+        matches = re.findall(codeblock_pattern, stripped, re.IGNORECASE)
+        for match in matches:
+            candidate = match.strip()
+            if candidate:
+                candidates.append(candidate)
+
+    # 3. 提取最外层 {} 对象
+    brace_match = re.search(r"\{[\s\S]*\}", stripped)
+    if brace_match:
+        candidates.append(brace_match.group(0))
+
+    # 4. 提取最外层 [] 数组
+    bracket_match = re.search(r"\[[\s\S]*\]", stripped)
+    if bracket_match:
+        candidates.append(bracket_match.group(0))
+
+    # 尝试解析每个候选
+    for candidate in candidates:
+        try:
+            parsed = json.loads(candidate)
+            return parsed, True, ""
+        except json.JSONDecodeError:
+            continue
+
+    return None, False, f"no_valid_json_found (tried {len(candidates)} candidates)"
+
+
+def _save_backup_txt(output_dir: Path, image_stem: str, full_text: str) -> Path:
+    """保存原始输出为 .txt 备份文件（交给后台写盘线程）"""
+    writer = get_result_writer()
+    backup_file = writer.reserve_backup_path(output_dir, image_stem)
+    writer.submit_text(backup_file, full_text)
+    return backup_file
+
+
+def build_messages(prompt: str, image_url: str) -> List[Dict[str, Any]]:
+    """构建单图多模态消息"""
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": image_url}},
+        ],
+    }]
+
+
+def delta_text(chunk: Any) -> str:
+    """从流式 chunk 中提取 delta 文本，没有内容时返回空串"""
+    if chunk.choices and len(chunk.choices) > 0:
+        delta = chunk.choices[0].delta
+        if delta and hasattr(delta, "content") and delta.content:
+            return delta.content
+    return ""
+
+
+def chunk_usage(chunk: Any) -> Any:
+    """流式 chunk 中的 usage（开启 stream_options.include_usage 后最后一个 chunk 携带），没有时返回 None"""
+    return getattr(chunk, "usage", None)
+
+
+def usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    """把 usage 对象规整为 {prompt_tokens, completion_tokens, total_tokens}"""
+    if usage is None:
+        return None
+    get = usage.get if isinstance(usage, dict) else (lambda name: getattr(usage, name, None))
+    fields = {}
+    for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = get(name)
+        if isinstance(value, (int, float)):
+            fields[name] = int(value)
+    if "total_tokens" not in fields and fields:
+        fields["total_tokens"] = fields.get("prompt_tokens", 0) + fields.get("completion_tokens", 0)
+    return fields or None
+
+
+def preprocess_timings(stats: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """把预处理统计（get_image_url 的 stats）转为 timings 字段；未执行预处理（如命中缓存）时为空"""
+    if not stats or "encodes" not in stats:
+        return {}
+    fields: Dict[str, Any] = {"preprocess_encodes": stats["encodes"]}
+    if stats.get("quality") is not None:
+        fields["preprocess_quality"] = stats["quality"]
+    return fields
+
+
+class StreamSession:
+    """单张图片的流式处理会话
+
+    生命周期：
+        begin_attempt() -> mark_request() -> mark_connected() -> feed()* -> finish_stream()
+        -> parse() -> save() -> success_record()
+    任一步骤抛错时：on_exception()，需要重试时 retry_scheduled()，不再重试时 save_failure() -> failure_record()
+
+    除 save()/save_failure() 外的方法都会发事件，调用方需保证它们在 emit 可用的线程/事件循环中执行；
+    save()/save_failure() 只做文件 I/O 与打印，可放到工作线程执行。
+    """
+
+    def __init__(
+            self,
+            *,
+            image_path: Path,
+            idx: int,
+            total: int,
+            model_name: str,
+            model_info: Optional[str],
+            prompt: str,
+            output_dir: Path,
+            output_file: Path,
+            verbose: bool,
+            enable_streaming_print: bool,
+            emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            log_prefix: str = "",
+            early_stop: bool = False,
+            delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+            delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+    ) -> None:
+        self.image_path = image_path
+        self.idx = idx
+        self.total = total
+        self.model_name = model_name
+        self._primary_model = model_name
+        self.model_info = model_info
+        self.prompt = prompt
+        self.output_dir = output_dir
+        self.output_file = output_file
+        self.verbose = verbose
+        self.enable_streaming_print = enable_streaming_print
+        self.log_output = bool(verbose or enable_streaming_print)
+        self._emit_cb = emit
+        self._log_prefix = log_prefix
+        self.early_stop = early_stop
+        # delta 事件合并：首块立即发送，之后累计到时间窗口或字节上限再发
+        self._delta_window_s = max(0.0, float(delta_window_ms or 0)) / 1000.0
+        self._delta_max_bytes = max(0, int(delta_max_bytes or 0))
+        self._delta_buf: List[str] = []
+        self._delta_bytes = 0
+        self._t_delta_flush: Optional[float] = None
+
+        self.preprocess_seconds = 0.0
+        self.preprocess_wait_seconds: Optional[float] = None
+        self.preprocess_stats: Dict[str, Any] = {}
+        self.quota_wait_seconds: Optional[float] = None
+        self.begin_attempt()
+
+    # ---------- 输出 ----------
+    def emit(self, event: str, **fields: Any) -> None:
+        """发送带图片序号的事件；回调失败不影响主流程"""
+        if self._emit_cb is None:
+            return
+        payload = {
+            "event": event,
+            "index": self.idx,
+            "total": self.total,
+            "image_name": self.image_path.name,
+        }
+        payload.update(fields)
+        try:
+            self._emit_cb(payload)
+        except Exception:
+            # 流式输出不应因 UI/回调失败而中断主流程
+            pass
+
+    def log(self, line: str) -> None:
+        """打印计时日志（并发时加图片前缀，且不需要换行分隔打字机输出）"""
+        if not self.log_output:
+            return
+        if self._log_prefix:
+            line = self._log_prefix + line.lstrip("\n")
+        print(line, flush=True)
+
+    # ---------- 流式阶段 ----------
+    def begin_attempt(self) -> None:
+        """开始一次（重）试，重置本次尝试的计时与输出"""
+        self.t0: Optional[float] = None
+        self.t_connected: Optional[float] = None
+        self.t_first: Optional[float] = None
+        self.t_end_stream: Optional[float] = None
+        self.connect_seconds = 0.0
+        self.thinking_seconds: Optional[float] = None
+        self.char_count = 0
+        self.usage: Optional[Dict[str, int]] = None
+        self.t_json_ready: Optional[float] = None
+        self.stopped_early = False
+        self._t_delta_flush = None
+        self._parts: List[str] = []
+        self._json = IncrementalJSONExtractor()
+        # 对冲请求：本次尝试是否发出了对冲、哪一路胜出（hedge 胜出且用了备用模型时结果记为该模型）
+        self.model_name = self._primary_model
+        self.hedge_after: Optional[float] = None
+        self.hedge_winner: Optional[str] = None
+        # 故障转移：主端点熔断时本次尝试改用的备用模型（provider:model）
+        self.failover_to: Optional[str] = None
+
+    def set_preprocess(
+            self,
+            preprocess_seconds: float,
+            wait_seconds: Optional[float] = None,
+            stats: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """记录预处理耗时
+
+        preprocess_seconds 为预处理实际执行耗时（流水线模式下在 CPU 线程池内测量）；
+        wait_seconds 为流水线模式下本线程/协程真正阻塞等待预处理结果的时间；
+        stats 为 get_image_url 写入的 JPEG 编码次数与质量。
+        """
+        self.preprocess_seconds = preprocess_seconds
+        self.preprocess_wait_seconds = wait_seconds
+        self.preprocess_stats = dict(stats or {})
+        fields: Dict[str, Any] = {"preprocess_seconds": round(preprocess_seconds, 4)}
+        if wait_seconds is not None:
+            fields["preprocess_wait_seconds"] = round(wait_seconds, 4)
+        fields.update(preprocess_timings(self.preprocess_stats))
+        self.emit("preprocess_done", **fields)
+
+    def set_quota_wait(self, wait_seconds: float) -> None:
+        """记录本次尝试等待 RPM/TPM 配额的时间"""
+        self.quota_wait_seconds = wait_seconds
+        if wait_seconds > 0:
+            self.log(f"[RATE] quota_wait={wait_seconds:.3f}s")
+            self.emit("quota_wait", wait_seconds=round(wait_seconds, 4))
+
+    def set_usage(self, usage: Any) -> None:
+        """记录流式 usage 报告（通常在最后一个 chunk）"""
+        fields = usage_dict(usage)
+        if fields:
+            self.usage = fields
+
+    def used_tokens(self) -> Optional[int]:
+        """本次尝试接口报告的 total_tokens（未报告时为 None）"""
+        return self.usage.get("total_tokens") if self.usage else None
+
+    def mark_request(self) -> None:
+        """请求发起（速率限制等待之后）"""
+        self.t0 = time.perf_counter()
+
+    def mark_connected(self, at: Optional[float] = None) -> None:
+        """拿到流式响应对象（通常等价于拿到响应头）；对冲竞速时 at 为胜出一路实际连上的时间"""
+        self.t_connected = at if at is not None else time.perf_counter()
+        self.connect_seconds = self.t_connected - self.t0
+        self.emit("connect_done", connect_seconds=round(self.connect_seconds, 4))
+
+    def failover(self, *, to_model: str, model_name: str, **fields: Any) -> None:
+        """本次尝试改用备用模型（结果文件记录实际使用的模型）"""
+        self.failover_to = to_model
+        self.model_name = model_name
+        self.log(f"[FAILOVER] -> {to_model} ({fields.get('reason')})")
+        self.emit("failover", to_model=to_model, model_name=model_name, **fields)
+
+    def circuit_changed(self, change: Optional[Dict[str, Any]]) -> None:
+        """端点熔断状态变化时记录日志并发事件"""
+        if not change:
+            return
+        self.log(f"[CIRCUIT] {change['endpoint']} {change['previous_state']}->{change['state']}")
+        self.emit("circuit", **change)
+
+    def hedge_started(self, after_seconds: float, model_name: str) -> None:
+        """首个 token 超过阈值未到，已发出对冲请求"""
+        self.hedge_after = after_seconds
+        self.log(f"\n[HEDGE] no token after {after_seconds:.3f}s, hedging model={model_name}")
+        self.emit("hedge", after_seconds=round(after_seconds, 4), model=model_name)
+
+    def set_hedge(self, winner: str, model_name: str) -> None:
+        """记录竞速结果（未发出对冲请求时忽略）"""
+        if self.hedge_after is None:
+            return
+        self.hedge_winner = winner
+        if winner == "hedge":
+            self.model_name = model_name
+        self.log(f"[HEDGE] winner={winner}")
+
+    def feed(self, content: str) -> None:
+        """接收一段 delta 文本"""
+        if not content:
+            return
+        if self.t_first is None:
+            # 记录 TTFT（第一个 token 到达时间）
+            self.t_first = time.perf_counter()
+            self.thinking_seconds = self.t_first - self.t_connected
+            ttft = self.t_first - self.t0
+            self.log(f"\n[TIME] TTFT={ttft:.3f}s")
+            self.emit(
+                "ttft",
+                ttft_seconds=round(ttft, 4),
+                thinking_seconds=round(self.thinking_seconds, 4),
+            )
+
+        # 打字机效果输出
+        if self.enable_streaming_print:
+            print(content, end="", flush=True)
+        self._queue_delta(content)
+
+        self._parts.append(content)
+        self.char_count += len(content)
+
+        # 增量 JSON 提取：顶层对象闭合的瞬间即完成解析
+        if self.t_json_ready is None and self._json.feed(content):
+            self.t_json_ready = time.perf_counter()
+            self.flush_deltas()
+            self.emit("json_ready", json_ready_seconds=round(self.t_json_ready - self.t0, 4))
+
+    def _queue_delta(self, content: str) -> None:
+        """按时间窗口 / 字节上限合并 delta 事件，减少下游的编码与写入次数"""
+        if self._emit_cb is None:
+            return
+        if not self._delta_window_s and not self._delta_max_bytes:
+            self.emit("delta", content=content, chunks=1)
+            return
+        self._delta_buf.append(content)
+        self._delta_bytes += len(content.encode("utf-8"))
+        if self._t_delta_flush is None:
+            # 首块立即发送，保证前端尽快看到输出
+            self.flush_deltas()
+            return
+        if ((self._delta_max_bytes and self._delta_bytes >= self._delta_max_bytes)
+                or (self._delta_window_s and time.perf_counter() - self._t_delta_flush >= self._delta_window_s)):
+            self.flush_deltas()
+
+    def flush_deltas(self) -> None:
+        """发送已合并但尚未发出的 delta（流结束、出错或 JSON 就绪前调用）"""
+        self._t_delta_flush = time.perf_counter()
+        if not self._delta_buf:
+            return
+        content, chunks = "".join(self._delta_buf), len(self._delta_buf)
+        self._delta_buf = []
+        self._delta_bytes = 0
+        self.emit("delta", content=content, chunks=chunks)
+
+    def should_stop(self) -> bool:
+        """开启 early_stop 且增量提取器已采用答案 JSON 时返回 True，调用方应立即关闭流
+
+        只认 ```json 围栏内、或开头只有空白的完整值（IncrementalJSONExtractor 的判定）；
+        说明文字里能解析的片段不会提前截断输出。
+        """
+        if not self.early_stop or not self._json.done:
+            return False
+        if not self.stopped_early:
+            self.stopped_early = True
+            self.log(f"\n[STOP] early_stop after JSON complete chars={self.char_count}")
+        return True
+
+    @property
+    def full_text(self) -> str:
+        return "".join(self._parts)
+
+    def ttft(self) -> Optional[float]:
+        """本次尝试的 TTFT（未收到任何内容时为 None）"""
+        if self.char_count <= 0 or self.t_first is None or self.t0 is None:
+            return None
+        return self.t_first - self.t0
+
+    def concurrency_changed(self, change: Optional[Dict[str, Any]]) -> None:
+        """自适应并发上限变化时记录日志并发事件"""
+        if not change:
+            return
+        self.log(f"[CONC] limit={change['previous_limit']}->{change['limit']} reason={change['reason']}")
+        self.emit("concurrency", **change)
+
+    def finish_stream(self) -> None:
+        """流式结束"""
+        self.t_end_stream = time.perf_counter()
+        self.flush_deltas()
+
+        # 如果没有收到任何内容
+        if self.t_first is None:
+            self.t_first = self.t_end_stream
+            self.log("\n[TIME] TTFT=N/A (no content)")
+
+        self.gen_seconds = self.t_end_stream - self.t_first
+        self.stream_total_seconds = self.t_end_stream - self.t0
+        self.log(
+            f"\n[TIME] gen={self.gen_seconds:.3f}s total={self.stream_total_seconds:.3f}s "
+            f"chars={self.char_count}"
+        )
+        self.emit(
+            "stream_done",
+            connect_seconds=round(self.connect_seconds, 4),
+            thinking_seconds=round(self.thinking_seconds or 0.0, 4),
+            gen_seconds=round(self.gen_seconds, 4),
+            stream_total_seconds=round(self.stream_total_seconds, 4),
+            char_count=self.char_count,
+            usage=self.usage,
+            early_stop=self.stopped_early,
+        )
+
+    # ---------- 后处理 ----------
+    def parse(self) -> None:
+        """JSON 后处理：流式阶段已增量解析出结果时直接取用，否则回退到整段文本的容错提取"""
+        t_parse_start = time.perf_counter()
+        if self._json.done:
+            self.parsed_json, self.is_valid, self.error_reason = self._json.value, True, ""
+        else:
+            self.parsed_json, self.is_valid, self.error_reason = _extract_json_from_text(self.full_text)
+        self.parse_seconds = time.perf_counter() - t_parse_start
+
+        if self.is_valid:
+            self.log(f"[JSON] parse={self.parse_seconds:.3f}s valid=True")
+        else:
+            self.log(f"[JSON] parse={self.parse_seconds:.3f}s valid=False reason={self.error_reason}")
+        self.emit(
+            "parse_done",
+            parse_seconds=round(self.parse_seconds, 4),
+            json_valid=bool(self.is_valid),
+            error_reason="" if self.is_valid else self.error_reason,
+        )
+
+    def save(self) -> None:
+        """保存结果：交给后台写盘线程，save_seconds 只含提交耗时（写盘队列满时会阻塞，可在工作线程执行）"""
+        t_save_start = time.perf_counter()
+        full_text = self.full_text
+
+        if self.is_valid:
+            # JSON 解析成功，正常保存
+            save_result(
+                self.output_file, self.image_path, self.model_name, self.model_info, self.prompt,
+                result_json=self.parsed_json, raw_response=full_text, background=True,
+            )
+            self.t_save_end = time.perf_counter()
+            self.save_seconds = self.t_save_end - t_save_start
+            self.log(f"[SAVE] save={self.save_seconds:.3f}s path={self.output_file}")
+
+            # 保留原有日志
+            if self.verbose:
+                console.success(with_icon("save", f"已保存 {self.output_file.name}"))
+        else:
+            # JSON 解析失败，保存备份
+            self.log(f"[ERR] JSON_PARSE_FAILED reason={self.error_reason}")
+
+            # 保存 .txt 备份
+            backup_file = _save_backup_txt(self.output_dir, self.image_path.stem, full_text)
+
+            # 同时保存带错误信息的 JSON
+            save_result(
+                self.output_file, self.image_path, self.model_name, self.model_info, self.prompt,
+                error_msg=f"JSON解析失败: {self.error_reason}",
+                raw_response=full_text, background=True,
+            )
+
+            self.t_save_end = time.perf_counter()
+            self.save_seconds = self.t_save_end - t_save_start
+            self.log(f"[SAVE] save={self.save_seconds:.3f}s backup={backup_file}")
+
+            if self.verbose:
+                console.warning(with_icon("warning", f"JSON解析失败，已保存备份: {backup_file.name}"))
+
+    def timings(self) -> Dict[str, float]:
+        timings = {
+            "preprocess_seconds": round(self.preprocess_seconds, 4),
+            "connect_seconds": round(self.connect_seconds, 4),
+            "thinking_seconds": round(self.thinking_seconds or 0.0, 4),
+            "ttft_seconds": round((self.t_first - self.t0) if self.t_first else 0, 4),
+            "gen_seconds": round(self.gen_seconds, 4),
+            "stream_total_seconds": round(self.stream_total_seconds, 4),
+            "parse_seconds": round(self.parse_seconds, 4),
+            "save_seconds": round(self.save_seconds, 4),
+            "all_seconds": round(self.t_save_end - self.t0, 4),
+        }
+        if self.preprocess_wait_seconds is not None:
+            timings["preprocess_wait_seconds"] = round(self.preprocess_wait_seconds, 4)
+        timings.update(preprocess_timings(self.preprocess_stats))
+        if self.quota_wait_seconds is not None:
+            timings["quota_wait_seconds"] = round(self.quota_wait_seconds, 4)
+        if self.t_json_ready is not None:
+            timings["json_ready_seconds"] = round(self.t_json_ready - self.t0, 4)
+        if self.early_stop:
+            timings["early_stop"] = self.stopped_early
+        return timings
+
+    def success_record(self, retries: int) -> Dict[str, Any]:
+        """全链路耗时 + image_done 事件，返回 run_summary 记录"""
+        all_time = self.t_save_end - self.t0
+        self.log(f"[TIME] all={all_time:.3f}s")
+
+        status = "success" if self.is_valid else "json_parse_failed"
+        timings = self.timings()
+        extra_fields: Dict[str, Any] = {}
+        if self.hedge_winner is not None:
+            extra_fields = {
+                "hedged": True,
+                "hedge_winner": self.hedge_winner,
+                "hedge_after_seconds": round(self.hedge_after, 4),
+            }
+            if self.model_name != self._primary_model:
+                extra_fields["hedge_model"] = self.model_name
+        if self.failover_to is not None:
+            extra_fields["failover_model"] = self.failover_to
+        if self.stopped_early:
+            # 提前关闭流的结果只有答案来自增量提取器时才可写入结果缓存
+            extra_fields["early_stopped"] = True
+            extra_fields["json_anchored"] = bool(self._json.done)
+        self.emit("image_done", status=status, output_file=str(self.output_file), timings=timings, **extra_fields)
+
+        record = {
+            "index": self.idx,
+            "image_name": self.image_path.name,
+            "status": status,
+            "output_file": str(self.output_file),
+            "retries": retries,
+            "json_valid": self.is_valid,
+            "timings": dict(timings),
+            "char_count": self.char_count,
+        }
+        record.update(extra_fields)
+        if self.usage:
+            record["usage"] = dict(self.usage)
+        return record
+
+    # ---------- 失败处理 ----------
+    def elapsed(self) -> float:
+        """本次尝试已耗时（尚未发起请求时为 0）"""
+        return time.perf_counter() - self.t0 if self.t0 else 0
+
+    def on_exception(self, error_msg: str, retry_count: int, max_retries: int) -> None:
+        self.flush_deltas()
+        elapsed = self.elapsed()
+        self.log(f"[ERR] EXCEPTION retry={retry_count}/{max_retries} elapsed={elapsed:.3f}s error={error_msg}")
+        self.emit(
+            "exception",
+            retry=retry_count,
+            max_retries=max_retries,
+            elapsed_seconds=round(elapsed, 4),
+            error=error_msg,
+        )
+        if self.verbose:
+            console.error(with_icon("error", f"错误: {error_msg}"))
+
+    def retry_scheduled(self, decision: Any, retry_count: int) -> None:
+        """记录重试计划（decision 为 retry.RetryDecision）"""
+        self.log(f"[RETRY] kind={decision.kind} delay={decision.delay:.3f}s retry={retry_count}")
+        fields: Dict[str, Any] = {
+            "retry": retry_count,
+            "error_kind": decision.kind,
+            "delay_seconds": round(decision.delay, 4),
+        }
+        if decision.retry_after is not None:
+            fields["retry_after_seconds"] = round(decision.retry_after, 4)
+        self.emit("retry_scheduled", **fields)
+
+    def save_failure(self, error_msg: str) -> None:
+        """重试耗尽后保存错误信息（仅文件 I/O，可在工作线程执行）"""
+        self.elapsed_before_fail = self.elapsed()
+        t_save_start = time.perf_counter()
+        full_text = self.full_text
+
+        # 如果有部分输出，保存备份
+        if full_text:
+            backup_file = _save_backup_txt(self.output_dir, self.image_path.stem, full_text)
+            self.log(f"[SAVE] backup={backup_file}")
+
+        save_result(
+            self.output_file, self.image_path, self.model_name, self.model_info, self.prompt,
+            error_msg=error_msg, raw_response=full_text or None, background=True,
+        )
+
+        self.t_save_end = time.perf_counter()
+        save_seconds = self.t_save_end - t_save_start
+        self.log(f"[SAVE] error_save={save_seconds:.3f}s path={self.output_file}")
+
+        all_time = self.t_save_end - self.t0 if self.t0 else self.elapsed_before_fail
+        self.log(f"[TIME] all={all_time:.3f}s (failed)")
+
+    def failure_record(self, error_msg: str, retries: int, error_kind: Optional[str] = None) -> Dict[str, Any]:
+        timings = {"elapsed_before_fail": round(self.elapsed_before_fail, 4)}
+        self.emit(
+            "image_done",
+            status="failed",
+            output_file=str(self.output_file),
+            error=error_msg,
+            error_kind=error_kind,
+            timings=timings,
+        )
+        return {
+            "index": self.idx,
+            "image_name": self.image_path.name,
+            "status": "failed",
+            "output_file": str(self.output_file),
+            "error": error_msg,
+            "error_kind": error_kind,
+            "retries": retries,
+            "timings": dict(timings),
+        }
@@ -4,13 +4,15 @@
 """
 from __future__ import annotations
 
+import asyncio
 import errno
 import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Sequence
+from typing import Optional, Dict, Any, List, Sequence, Callable
 from uuid import uuid4
 
 from backend.core.config import (
@@ -18,14 +20,23 @@ from backend.core.config import (
     DEFAULT_INPUT_DIR, DEFAULT_PROMPT, DEFAULT_MAX_IMAGE_SIZE,
     DEFAULT_MAX_FILE_SIZE_MB, DEFAULT_REQUEST_DELAY, DEFAULT_MAX_RETRIES,
     DEFAULT_RETRY_DELAY, DEFAULT_ENABLE_COMPRESSION, DEFAULT_VERBOSE,
-    DEFAULT_MAX_WORKERS, _load_default_prompt,
+    DEFAULT_MAX_WORKERS, DEFAULT_PREPROCESS_LOOKAHEAD, DEFAULT_ADAPTIVE_CONCURRENCY, DEFAULT_EARLY_STOP,
+    DEFAULT_DELTA_WINDOW_MS, DEFAULT_DELTA_MAX_BYTES, DEFAULT_RESUME,
+    DEFAULT_USE_CACHE, DEFAULT_PACK_SIZE, DEFAULT_HEDGE, DEFAULT_HEDGE_PERCENTILE, DEFAULT_JOB_DEADLINE,
+    DEFAULT_OUTPUT_LAYOUT, DEFAULT_PREPROCESS_BACKEND,
+    _load_default_prompt,
 )
 from backend.core.config_loader import get_provider, get_model
+from backend.core.local.cancellation import CancelToken
+from backend.core.local.checkpoint import new_run_id
 from backend.core.local.result_handler import get_latest_output_file_path
+from backend.core.local.results_log import read_result, result_exists
+from backend.core.local.run_summary import read_run_summary
 from backend.util import project_root as get_project_root
 
 # 延迟导入处理模块
 _cloud_api_processor = None
+_cloud_api_processor_async = None
 
 
 def _get_cloud_api_processor():
@@ -37,12 +48,212 @@ def _get_cloud_api_processor():
     return _cloud_api_processor
 
 
+def _get_cloud_api_processor_async():
+    """获取云API处理器（asyncio 版）"""
+    global _cloud_api_processor_async
+    if _cloud_api_processor_async is None:
+        from backend.core.local.async_processor import process_images_with_cloud_api_async
+        _cloud_api_processor_async = process_images_with_cloud_api_async
+    return _cloud_api_processor_async
+
+
 # 兼容旧接口
 def process_images_with_model(**kwargs):
     """云API处理"""
     return _get_cloud_api_processor()(**kwargs)
 
 
+def _resolve_model(provider_key: str, model_key: str, *, with_failover: bool = True) -> Dict[str, Any]:
+    """解析厂商/模型配置，返回 model_name / model_info / api_base_url / env_key / rate_limit / failover"""
+    provider = get_provider(provider_key)
+    model_config = get_model(provider_key, model_key)
+    provider_defaults = provider["info"].get("defaults", {}) if isinstance(provider.get("info"), dict) else {}
+    return {
+        "model_name": model_config["name"],
+        "model_info": model_config.get("info"),
+        "api_base_url": model_config.get("api_base_url"),
+        "env_key": model_config.get("env_key") or provider_defaults.get("env_key", "API_KEY"),
+        "rate_limit": model_config.get("rate_limit"),
+        "failover": _resolve_failover(model_config.get("failover")) if with_failover else [],
+    }
+
+
+def _resolve_failover(spec: Any) -> List[Dict[str, Any]]:
+    """解析 models.yml 中的 failover 列表（provider:model 字符串或 {provider, model}），无法解析的条目跳过"""
+    from backend.core.local.fanout import parse_model_targets, target_label
+
+    if not spec:
+        return []
+    items = [
+        (item.get("provider"), item.get("model")) if isinstance(item, dict) else item
+        for item in (spec if isinstance(spec, list) else [spec])
+    ]
+    resolved: List[Dict[str, Any]] = []
+    try:
+        targets = parse_model_targets(items)
+    except (TypeError, ValueError) as e:
+        console.warning(with_icon("warning", f"failover 配置无效，已忽略: {e}"))
+        return []
+    for provider_key, model_key in targets:
+        try:
+            # 备用模型自己的 failover 不再展开，避免循环
+            target = _resolve_model(provider_key, model_key, with_failover=False)
+        except Exception as e:
+            console.warning(with_icon("warning", f"备用模型 {provider_key}:{model_key} 不存在，已跳过: {e}"))
+            continue
+        target["label"] = target_label(provider_key, model_key)
+        resolved.append(target)
+    return resolved
+
+
+def _fanout_prefetcher(input_dir: str | Path, consumers: int, options: Dict[str, Any]):
+    """为多模型对比创建共享预处理流水线，返回 (图片列表, prefetcher)"""
+    from backend.core.local.image_utils import PreprocessPrefetcher, get_image_files
+    from backend.core.local.preprocess_pool import BACKEND_PROCESS, get_preprocess_pool
+
+    project_root = get_project_root()
+    input_path = Path(input_dir)
+    if not input_path.is_absolute():
+        input_path = project_root / input_path
+    image_files = get_image_files(input_path, project_root)
+    prefetcher = PreprocessPrefetcher(
+        image_files,
+        options.get("max_image_size", DEFAULT_MAX_IMAGE_SIZE),
+        options.get("max_file_size_mb", DEFAULT_MAX_FILE_SIZE_MB),
+        options.get("enable_compression", DEFAULT_ENABLE_COMPRESSION),
+        lookahead=options.get("preprocess_lookahead", DEFAULT_PREPROCESS_LOOKAHEAD),
+        consumers=consumers,
+        pool=get_preprocess_pool() if options.get("preprocess_backend") == BACKEND_PROCESS else None,
+    )
+    return image_files, prefetcher
+
+
+def _fanout_finish(
+        runs: List[Dict[str, Any]],
+        *,
+        image_files: Sequence[Path],
+        prefetcher,
+        start_time: datetime,
+) -> Dict[str, Any]:
+    """合并各模型的运行结果并写入对比汇总"""
+    from backend.core.local.fanout import combine_run_summaries, write_fanout_summary
+
+    summary = combine_run_summaries(
+        runs,
+        start_time=start_time,
+        preprocess={
+            "images": len(image_files),
+            "shared_by": len(runs),
+            "submitted": prefetcher.submitted,
+            **prefetcher.snapshot(),
+        },
+    )
+    write_fanout_summary(get_project_root(), summary)
+    return summary
+
+
+def _read_run_summary(output_dir: Path, run_id: Optional[str] = None) -> Dict[str, Any]:
+    summary = read_run_summary(output_dir, run_id=run_id)
+    if summary:
+        summary.setdefault("output_dir", str(Path(output_dir).resolve()))
+    return summary
+
+
+def _tagged_emit(emit: Optional[Callable[[Dict[str, Any]], None]], label: str):
+    """给每个事件加上 model 字段，区分多模型对比中各模型的事件流"""
+    if emit is None:
+        return None
+    return lambda ev: emit(dict(ev, model=label))
+
+
+def run_fanout(
+        *,
+        targets: Sequence[tuple[str, str]],
+        input_dir: str | Path,
+        prompt: str,
+        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **options: Any,
+) -> tuple[Dict[str, Any], Dict[str, tuple[Path, str]]]:
+    """多模型对比（线程引擎）：同一批图片只预处理一次，各模型在各自线程中并发运行
+
+    options 为 process_images_with_cloud_api 的其余参数；返回 (合并汇总, {label: (output_dir, run_id)})。
+    """
+    from backend.core.local.fanout import target_label
+
+    image_files, prefetcher = _fanout_prefetcher(input_dir, len(targets), options)
+    start_time = datetime.now()
+    output_dirs: Dict[str, tuple[Path, str]] = {}
+
+    def run_one(target: tuple[str, str]) -> Dict[str, Any]:
+        provider_key, model_key = target
+        label = target_label(provider_key, model_key)
+        run_id = new_run_id()
+        try:
+            model = _resolve_model(provider_key, model_key)
+            _, _, output_dir = _get_cloud_api_processor()(
+                model_name=model["model_name"], model_info=model["model_info"], input_dir=str(input_dir),
+                prompt=prompt, api_base_url=model["api_base_url"], api_key_env=model["env_key"],
+                rate_limits=model["rate_limit"], failover=model["failover"], enable_streaming_print=False,
+                emit=_tagged_emit(emit, label), shared_prefetcher=prefetcher, run_id=run_id, **options,
+            )
+            output_dirs[label] = (output_dir, run_id)
+            return {"provider": provider_key, "model": model_key, "summary": _read_run_summary(output_dir, run_id)}
+        except Exception as e:
+            console.error(with_icon("error", f"{label} 运行失败: {e}"))
+            return {"provider": provider_key, "model": model_key, "error": str(e)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="fanout") as executor:
+            runs = list(executor.map(run_one, targets))
+    finally:
+        prefetcher.shutdown()
+    return _fanout_finish(runs, image_files=image_files, prefetcher=prefetcher, start_time=start_time), output_dirs
+
+
+async def run_fanout_async(
+        *,
+        targets: Sequence[tuple[str, str]],
+        input_dir: str | Path,
+        prompt: str,
+        emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **options: Any,
+) -> tuple[Dict[str, Any], Dict[str, tuple[Path, str]]]:
+    """多模型对比（asyncio 引擎）：各模型的运行在同一事件循环中并发"""
+    from backend.core.local.fanout import target_label
+
+    image_files, prefetcher = await asyncio.to_thread(_fanout_prefetcher, input_dir, len(targets), options)
+    start_time = datetime.now()
+    output_dirs: Dict[str, tuple[Path, str]] = {}
+
+    async def run_one(target: tuple[str, str]) -> Dict[str, Any]:
+        provider_key, model_key = target
+        label = target_label(provider_key, model_key)
+        run_id = new_run_id()
+        try:
+            model = _resolve_model(provider_key, model_key)
+            _, _, output_dir = await _get_cloud_api_processor_async()(
+                model_name=model["model_name"], model_info=model["model_info"], input_dir=str(input_dir),
+                prompt=prompt, api_base_url=model["api_base_url"], api_key_env=model["env_key"],
+                rate_limits=model["rate_limit"], failover=model["failover"], enable_streaming_print=False,
+                emit=_tagged_emit(emit, label), shared_prefetcher=prefetcher, run_id=run_id, **options,
+            )
+            output_dirs[label] = (output_dir, run_id)
+            summary = await asyncio.to_thread(_read_run_summary, output_dir, run_id)
+            return {"provider": provider_key, "model": model_key, "summary": summary}
+        except Exception as e:
+            console.error(with_icon("error", f"{label} 运行失败: {e}"))
+            return {"provider": provider_key, "model": model_key, "error": str(e)}
+
+    try:
+        runs = list(await asyncio.gather(*(run_one(t) for t in targets)))
+    finally:
+        prefetcher.shutdown()
+    summary = await asyncio.to_thread(
+        _fanout_finish, runs, image_files=image_files, prefetcher=prefetcher, start_time=start_time
+    )
+    return summary, output_dirs
+
+
 def run_pipeline(
         *,
         provider_key: str,
@@ -59,9 +270,45 @@ def run_pipeline(
         enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
         verbose: bool = DEFAULT_VERBOSE,
         max_workers: int = DEFAULT_MAX_WORKERS,
+        preprocess_lookahead: int = DEFAULT_PREPROCESS_LOOKAHEAD,
+        adaptive_concurrency: bool = DEFAULT_ADAPTIVE_CONCURRENCY,
+        early_stop: bool = DEFAULT_EARLY_STOP,
+        resume: bool = DEFAULT_RESUME,
+        use_cache: bool = DEFAULT_USE_CACHE,
+        pack_size: int = DEFAULT_PACK_SIZE,
+        hedge: bool = DEFAULT_HEDGE,
+        hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        hedge_model: Optional[str] = None,
+        fanout_models: Optional[Sequence[tuple[str, str]]] = None,
+        deadline: float = DEFAULT_JOB_DEADLINE,
+        output_layout: str = DEFAULT_OUTPUT_LAYOUT,
+        preprocess_backend: str = DEFAULT_PREPROCESS_BACKEND,
         extra_metadata: Optional[Dict[str, Any]] = None,
 ) -> None:
-    """统一入口: 调用云端API处理图片"""
+    """统一入口: 调用云端API处理图片
+
+    fanout_models 非空时为多模型对比：provider_key/model_key 与 fanout_models 中的模型
+    共享一次预处理并发运行，另外写入合并汇总（见 fanout 模块）。
+    deadline > 0 时超过该秒数即取消剩余图片（见 cancellation 模块）。
+    output_layout="run" 时每次运行写入独立的 runs/<run_id>/ 目录，结果汇总在 results.jsonl（见 results_log 模块）。
+    preprocess_backend="process" 时在按 CPU 核数创建的进程池中压缩图片（见 preprocess_pool 模块）。
+    """
+    cancel = CancelToken(deadline_seconds=deadline) if deadline and deadline > 0 else None
+    if fanout_models:
+        _run_fanout_pipeline(
+            targets=[(provider_key, model_key), *fanout_models], input_dir=input_dir, prompt=prompt,
+            max_image_size=max_image_size, max_file_size_mb=max_file_size_mb,
+            request_delay=request_delay, max_retries=max_retries, retry_delay=retry_delay,
+            timeout=timeout, enable_compression=enable_compression, verbose=verbose,
+            max_workers=max_workers, preprocess_lookahead=preprocess_lookahead,
+            adaptive_concurrency=adaptive_concurrency, early_stop=early_stop,
+            resume=resume, use_cache=use_cache, pack_size=pack_size,
+            hedge=hedge, hedge_percentile=hedge_percentile, hedge_model=hedge_model, cancel=cancel,
+            output_layout=output_layout,
+            preprocess_backend=preprocess_backend,
+        )
+        return
+
     provider = get_provider(provider_key)
     provider_info = provider["info"]
     model_config = get_model(provider_key, model_key)
@@ -101,7 +348,74 @@ def run_pipeline(
         api_base_url=api_base_url, timeout=timeout,
         enable_compression=enable_compression, verbose=verbose,
         max_workers=max_workers, api_key_env=env_key,
+        preprocess_lookahead=preprocess_lookahead,
+        adaptive_concurrency=adaptive_concurrency,
+        rate_limits=model_config.get("rate_limit"),
+        failover=_resolve_failover(model_config.get("failover")),
+        early_stop=early_stop,
+        resume=resume,
+        use_cache=use_cache,
+        pack_size=pack_size,
+        hedge=hedge,
+        hedge_percentile=hedge_percentile,
+        hedge_model=hedge_model,
+        cancel=cancel,
+        output_layout=output_layout,
+        preprocess_backend=preprocess_backend,
     )
+    if cancel is not None:
+        cancel.close()
+
+
+def _run_fanout_pipeline(*, targets: Sequence[tuple[str, str]], input_dir: str, prompt: str, **options: Any) -> None:
+    """命令行多模型对比：逐模型打印结果目录，最后打印对比汇总路径"""
+    from backend.core.local.fanout import parse_model_targets
+
+    targets = parse_model_targets(list(targets))
+    resolved_prompt = prompt
+    if not resolved_prompt:
+        try:
+            resolved_prompt = _load_default_prompt()
+        except Exception:
+            pass
+    if not resolved_prompt:
+        resolved_prompt = DEFAULT_PROMPT
+
+    for provider_key, model_key in targets:
+        env_key = _resolve_model(provider_key, model_key)["env_key"]
+        if not os.environ.get(env_key):
+            console.warning(with_icon("warning", f"未检测到环境变量 {env_key}"))
+
+    console.banner("=" * 60)
+    console.title(with_icon("rocket", f"多模型对比: {', '.join(f'{p}:{m}' for p, m in targets)}"))
+    console.info(with_icon("input", f"输入文件夹: {input_dir}"))
+    console.banner("=" * 60)
+    console.blank()
+
+    summary, _ = run_fanout(targets=targets, input_dir=input_dir, prompt=resolved_prompt, **options)
+
+    for column in summary["models"]:
+        if column.get("error"):
+            console.error(with_icon("error", f"{column['label']}: {column['error']}"))
+            continue
+        totals = column.get("totals") or {}
+        console.info(
+            f"{column['label']}: 成功 {totals.get('success', 0)}/{totals.get('all', 0)}，"
+            f"耗时 {column.get('elapsed_seconds')}s，TTFT p50/p95 "
+            f"{column.get('ttft_p50_seconds')}/{column.get('ttft_p95_seconds')}s，"
+            f"结果目录 {column.get('output_dir')}"
+        )
+    preprocess = summary["preprocess"]
+    throughput = ""
+    if preprocess.get("images_per_core_second"):
+        throughput = (f"，{preprocess['images_per_core_second']} 张/核·秒"
+                      f"（{preprocess['backend']} x{preprocess['workers']}）")
+    console.info(with_icon(
+        "info",
+        f"预处理 {preprocess['submitted']} 次（{preprocess['images']} 张图片，{preprocess['shared_by']} 个模型共享）"
+        f"{throughput}",
+    ))
+    console.success(with_icon("success", f"对比汇总: {summary['summary_file']}"))
 
 
 class Processor:
@@ -148,6 +462,42 @@ class Processor:
             self._stage_file(src_path, destination)
         return session_dir
 
+    def resolve_model(self, provider_key: str, model_key: str) -> Dict[str, Any]:
+        """解析厂商/模型配置，返回 model_name / model_info / api_base_url / env_key"""
+        return _resolve_model(provider_key, model_key)
+
+    def collect_results(self, output_dir: Path, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """读取运行汇总（逐图记录逐行读取）及每张图片的结果（结果文件或 results.jsonl），组装 {"summary", "results"}
+
+        run_id 为本次运行的 ID 时只读取这次运行的记录与结果文件，同一模型目录下并发的其它运行不会混入。
+        """
+        per_image_payloads: List[Dict[str, Any]] = []
+        summary_data = read_run_summary(output_dir, run_id=run_id)
+        if summary_data:
+            summary_data.setdefault("output_dir", str(output_dir.resolve()))
+            for record in summary_data.get("images", []) or []:
+                image_name = record.get("image_name") or ""
+                image_stem = Path(image_name).stem if image_name else ""
+
+                # 记录中的输出文件缺失时（如旧版汇总）才退回到同名图片最新的输出文件
+                output_file = record.get("output_file")
+                if not (output_file and result_exists(Path(output_file))) and image_stem:
+                    latest_output = get_latest_output_file_path(output_dir, image_stem, extension=".json")
+                    if latest_output:
+                        record["output_file"] = str(latest_output)
+
+                output_file = record.get("output_file")
+                if output_file:
+                    payload_path = Path(output_file)
+                    try:
+                        payload = read_result(payload_path)
+                    except (OSError, json.JSONDecodeError):
+                        continue
+                    payload["_output_file"] = str(payload_path)
+                    per_image_payloads.append(payload)
+
+        return {"summary": summary_data, "results": per_image_payloads}
+
     def process(
             self,
             *,
@@ -164,62 +514,163 @@ class Processor:
             enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
             verbose: bool = False,
             max_workers: int = DEFAULT_MAX_WORKERS,
+            adaptive_concurrency: bool = DEFAULT_ADAPTIVE_CONCURRENCY,
+            early_stop: bool = DEFAULT_EARLY_STOP,
+            resume: bool = DEFAULT_RESUME,
+            use_cache: bool = DEFAULT_USE_CACHE,
+            delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+            delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+            pack_size: int = DEFAULT_PACK_SIZE,
+            hedge: bool = DEFAULT_HEDGE,
+            hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+            hedge_model: Optional[str] = None,
+            fanout_models: Optional[Sequence[tuple[str, str]]] = None,
+            emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            cancel: Optional[CancelToken] = None,
+            output_layout: str = DEFAULT_OUTPUT_LAYOUT,
+            preprocess_backend: str = DEFAULT_PREPROCESS_BACKEND,
     ) -> Dict[str, Any]:
-        """批量处理图片"""
-        path_list = [Path(p) if not isinstance(p, Path) else p for p in images]
-        session_dir = self._prepare_session_dir(path_list)
+        """批量处理图片
 
-        provider = get_provider(provider_key)
-        model_config = get_model(provider_key, model_key)
+        fanout_models 非空时为多模型对比，返回 {"summary": 对比汇总, "runs": {provider:model: 单模型结果}}。
+        cancel 为 cancellation.CancelToken：取消后剩余图片以 cancelled 失败结束，在途请求立即关闭。
+        """
+        path_list = [Path(p) if not isinstance(p, Path) else p for p in images]
+        if fanout_models:
+            from backend.core.local.fanout import parse_model_targets
 
-        model_name = model_config["name"]
-        model_info = model_config.get("info")
-        api_base_url = model_config.get("api_base_url")
-        provider_defaults = provider["info"].get("defaults", {}) if isinstance(provider.get("info"), dict) else {}
-        env_key = model_config.get("env_key") or provider_defaults.get("env_key", "API_KEY")
+            targets = parse_model_targets([(provider_key, model_key), *fanout_models])
+            session_dir = self._prepare_session_dir(path_list)
+            try:
+                summary, output_dirs = run_fanout(
+                    targets=targets, input_dir=str(session_dir), prompt=prompt or DEFAULT_PROMPT,
+                    emit=emit, max_image_size=max_image_size, max_file_size_mb=max_file_size_mb,
+                    request_delay=request_delay, max_retries=max_retries, retry_delay=retry_delay,
+                    timeout=timeout, enable_compression=enable_compression, verbose=verbose,
+                    max_workers=max_workers, adaptive_concurrency=adaptive_concurrency,
+                    early_stop=early_stop, delta_window_ms=delta_window_ms, delta_max_bytes=delta_max_bytes,
+                    resume=resume, use_cache=use_cache, pack_size=pack_size,
+                    hedge=hedge, hedge_percentile=hedge_percentile, hedge_model=hedge_model, cancel=cancel,
+                    output_layout=output_layout,
+                    preprocess_backend=preprocess_backend,
+                )
+                return {
+                    "summary": summary,
+                    "runs": {
+                        label: self.collect_results(d, run_id) for label, (d, run_id) in output_dirs.items()
+                    },
+                }
+            finally:
+                shutil.rmtree(session_dir, ignore_errors=True)
 
-        resolved_prompt = prompt or DEFAULT_PROMPT
+        session_dir = self._prepare_session_dir(path_list)
+        model = self.resolve_model(provider_key, model_key)
+        run_id = new_run_id()
 
-        summary_data: Dict[str, Any] = {}
-        per_image_payloads: List[Dict[str, Any]] = []
         try:
             _, _, output_dir = _get_cloud_api_processor()(
-                model_name=model_name, model_info=model_info, input_dir=str(session_dir),
-                prompt=resolved_prompt, max_image_size=max_image_size,
+                model_name=model["model_name"], model_info=model["model_info"], input_dir=str(session_dir),
+                prompt=prompt or DEFAULT_PROMPT, max_image_size=max_image_size,
                 max_file_size_mb=max_file_size_mb, request_delay=request_delay,
                 max_retries=max_retries, retry_delay=retry_delay,
-                api_base_url=api_base_url, timeout=timeout,
+                api_base_url=model["api_base_url"], timeout=timeout,
                 enable_compression=enable_compression, verbose=verbose,
-                max_workers=max_workers, api_key_env=env_key,
+                max_workers=max_workers, api_key_env=model["env_key"],
+                adaptive_concurrency=adaptive_concurrency, rate_limits=model["rate_limit"],
+                failover=model["failover"],
+                early_stop=early_stop, delta_window_ms=delta_window_ms, delta_max_bytes=delta_max_bytes,
+                resume=resume, use_cache=use_cache, pack_size=pack_size,
+                hedge=hedge, hedge_percentile=hedge_percentile, hedge_model=hedge_model, emit=emit,
+                cancel=cancel, output_layout=output_layout,
+                preprocess_backend=preprocess_backend, run_id=run_id,
             )
-
-            summary_path = output_dir / "run_summary.json"
-            if summary_path.is_file():
-                summary_data = json.loads(summary_path.read_text(encoding="utf-8"))
-                summary_data.setdefault("output_dir", str(output_dir.resolve()))
-                for record in summary_data.get("images", []):
-                    image_name = record.get("image_name") or ""
-                    image_stem = Path(image_name).stem if image_name else ""
-
-                    latest_output = get_latest_output_file_path(output_dir, image_stem,
-                                                                extension=".json") if image_stem else None
-                    if latest_output:
-                        record["output_file"] = str(latest_output)
-
-                    output_file = record.get("output_file")
-                    if output_file:
-                        payload_path = Path(output_file)
-                        if payload_path.is_file():
-                            try:
-                                payload = json.loads(payload_path.read_text(encoding="utf-8"))
-                                payload["_output_file"] = str(payload_path)
-                                per_image_payloads.append(payload)
-                            except json.JSONDecodeError:
-                                continue
-
-            return {"summary": summary_data, "results": per_image_payloads}
+            return self.collect_results(output_dir, run_id)
         finally:
             try:
                 shutil.rmtree(session_dir, ignore_errors=True)
             except Exception:
                 pass
+
+    async def process_async(
+            self,
+            *,
+            provider_key: str,
+            model_key: str,
+            images: Sequence[str | Path],
+            prompt: Optional[str] = None,
+            max_image_size: tuple[int, int] = DEFAULT_MAX_IMAGE_SIZE,
+            max_file_size_mb: int = DEFAULT_MAX_FILE_SIZE_MB,
+            request_delay: float = DEFAULT_REQUEST_DELAY,
+            max_retries: int = DEFAULT_MAX_RETRIES,
+            retry_delay: float = DEFAULT_RETRY_DELAY,
+            timeout: Optional[float] = 60.0,
+            enable_compression: bool = DEFAULT_ENABLE_COMPRESSION,
+            verbose: bool = False,
+            max_workers: int = DEFAULT_MAX_WORKERS,
+            adaptive_concurrency: bool = DEFAULT_ADAPTIVE_CONCURRENCY,
+            early_stop: bool = DEFAULT_EARLY_STOP,
+            delta_window_ms: float = DEFAULT_DELTA_WINDOW_MS,
+            delta_max_bytes: int = DEFAULT_DELTA_MAX_BYTES,
+            resume: bool = DEFAULT_RESUME,
+            use_cache: bool = DEFAULT_USE_CACHE,
+            pack_size: int = DEFAULT_PACK_SIZE,
+            hedge: bool = DEFAULT_HEDGE,
+            hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+            hedge_model: Optional[str] = None,
+            fanout_models: Optional[Sequence[tuple[str, str]]] = None,
+            emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            cancel: Optional[CancelToken] = None,
+            output_layout: str = DEFAULT_OUTPUT_LAYOUT,
+            preprocess_backend: str = DEFAULT_PREPROCESS_BACKEND,
+    ) -> Dict[str, Any]:
+        """批量处理图片（asyncio 引擎，供 FastAPI 路由直接 await）"""
+        path_list = [Path(p) if not isinstance(p, Path) else p for p in images]
+        if fanout_models:
+            from backend.core.local.fanout import parse_model_targets
+
+            targets = parse_model_targets([(provider_key, model_key), *fanout_models])
+            session_dir = await asyncio.to_thread(self._prepare_session_dir, path_list)
+            try:
+                summary, output_dirs = await run_fanout_async(
+                    targets=targets, input_dir=str(session_dir), prompt=prompt or DEFAULT_PROMPT,
+                    emit=emit, max_image_size=max_image_size, max_file_size_mb=max_file_size_mb,
+                    request_delay=request_delay, max_retries=max_retries, retry_delay=retry_delay,
+                    timeout=timeout, enable_compression=enable_compression, verbose=verbose,
+                    max_workers=max_workers, adaptive_concurrency=adaptive_concurrency,
+                    early_stop=early_stop, delta_window_ms=delta_window_ms, delta_max_bytes=delta_max_bytes,
+                    resume=resume, use_cache=use_cache, pack_size=pack_size,
+                    hedge=hedge, hedge_percentile=hedge_percentile, hedge_model=hedge_model, cancel=cancel,
+                    output_layout=output_layout,
+                    preprocess_backend=preprocess_backend,
+                )
+                runs = {}
+                for label, (d, run_id) in output_dirs.items():
+                    runs[label] = await asyncio.to_thread(self.collect_results, d, run_id)
+                return {"summary": summary, "runs": runs}
+            finally:
+                await asyncio.to_thread(shutil.rmtree, session_dir, True)
+
+        session_dir = await asyncio.to_thread(self._prepare_session_dir, path_list)
+        model = self.resolve_model(provider_key, model_key)
+        run_id = new_run_id()
+
+        try:
+            _, _, output_dir = await _get_cloud_api_processor_async()(
+                model_name=model["model_name"], model_info=model["model_info"], input_dir=str(session_dir),
+                prompt=prompt or DEFAULT_PROMPT, max_image_size=max_image_size,
+                max_file_size_mb=max_file_size_mb, request_delay=request_delay,
+                max_retries=max_retries, retry_delay=retry_delay,
+                api_base_url=model["api_base_url"], timeout=timeout,
+                enable_compression=enable_compression, verbose=verbose,
+                max_workers=max_workers, api_key_env=model["env_key"],
+                adaptive_concurrency=adaptive_concurrency, rate_limits=model["rate_limit"],
+                failover=model["failover"],
+                early_stop=early_stop, delta_window_ms=delta_window_ms, delta_max_bytes=delta_max_bytes,
+                resume=resume, use_cache=use_cache, pack_size=pack_size,
+                hedge=hedge, hedge_percentile=hedge_percentile, hedge_model=hedge_model,
+                enable_streaming_print=False, emit=emit, cancel=cancel, output_layout=output_layout,
+                preprocess_backend=preprocess_backend, run_id=run_id,
+            )
+            return await asyncio.to_thread(self.collect_results, output_dir, run_id)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, session_dir, True)
@@ -1,21 +1,106 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import queue
 import shutil
 import tempfile
 import threading
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
+from uuid import uuid4
 
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 
+from backend.core.local.cancellation import CancelToken, REASON_CLIENT_DISCONNECTED, get_job_registry
+from backend.core.local.preprocess_pool import PREPROCESS_BACKENDS
+from backend.core.local.results_log import OUTPUT_LAYOUTS
 from backend.state import get_config_service, get_processor
 from backend.util import safe_filename
 
 router = APIRouter(tags=["tasks"])
 
+# 处理引擎：thread 为原线程池引擎（默认），async 为 asyncio + AsyncOpenAI
+ENGINES = ("thread", "async")
+
+# 流式任务协程的强引用，避免客户端断开后任务被 GC 回收
+_BACKGROUND_JOBS: "set[asyncio.Task]" = set()
+
+
+def _check_engine(engine: str) -> str:
+    engine = (engine or "thread").strip().lower()
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine 必须是 {'/'.join(ENGINES)} 之一")
+    return engine
+
+
+def _check_output_layout(output_layout: str) -> str:
+    output_layout = (output_layout or "files").strip().lower()
+    if output_layout not in OUTPUT_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"output_layout 必须是 {'/'.join(OUTPUT_LAYOUTS)} 之一")
+    return output_layout
+
+
+def _check_preprocess_backend(preprocess_backend: str) -> str:
+    preprocess_backend = (preprocess_backend or "thread").strip().lower()
+    if preprocess_backend not in PREPROCESS_BACKENDS:
+        raise HTTPException(
+            status_code=400, detail=f"preprocess_backend 必须是 {'/'.join(PREPROCESS_BACKENDS)} 之一",
+        )
+    return preprocess_backend
+
+
+def _record_task(provider: str, model: str, result: dict, file_count: int) -> None:
+    """写入任务历史，失败静默忽略"""
+    try:
+        summary = result.get("summary", {}) if isinstance(result, dict) else {}
+        totals = summary.get("totals", {}) if isinstance(summary, dict) else {}
+        get_config_service().add_task_record(
+            provider=provider,
+            model=model,
+            file_count=int(totals.get("all") or file_count),
+            success_count=int(totals.get("success") or 0),
+            failed_count=int(totals.get("failed") or 0),
+            output_dir=summary.get("output_dir"),
+        )
+    except Exception:
+        pass
+
+
+def _register_job(job_id: Optional[str], deadline_seconds: float) -> tuple[str, CancelToken]:
+    """创建取消令牌并登记任务（可由 DELETE /tasks/{job_id} 取消），job_id 重复返回 409"""
+    job_id = (job_id or "").strip() or uuid4().hex
+    if job_id in get_job_registry().job_ids():
+        raise HTTPException(status_code=409, detail=f"任务 {job_id} 正在运行")
+    token = CancelToken(deadline_seconds=deadline_seconds)
+    get_job_registry().register(job_id, token)
+    return job_id, token
+
+
+def _parse_fanout(fanout_models: Optional[str]) -> Optional[list[tuple[str, str]]]:
+    """解析表单中的 "provider:model,provider:model"，格式错误返回 400"""
+    if not fanout_models or not fanout_models.strip():
+        return None
+    from backend.core.local.fanout import parse_model_targets
+
+    try:
+        return parse_model_targets(fanout_models)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"fanout_models: {e}")
+
+
+def _record_fanout_tasks(result: dict, file_count: int) -> None:
+    """多模型对比：每个模型各写一条任务历史"""
+    summary = result.get("summary", {}) if isinstance(result, dict) else {}
+    runs = result.get("runs", {}) if isinstance(result, dict) else {}
+    for column in summary.get("models", []) or []:
+        if column.get("error"):
+            continue
+        run = runs.get(column.get("label")) or {"summary": column}
+        _record_task(column["provider"], column["model"], run, file_count)
+
 
 @router.post("/tasks/process")
 async def process_images(
@@ -29,10 +114,28 @@ async def process_images(
     timeout: float = Form(60.0),
     enable_compression: bool = Form(True),
     max_workers: int = Form(1),
+    adaptive_concurrency: bool = Form(False),
+    early_stop: bool = Form(False),
+    resume: bool = Form(False),
+    use_cache: bool = Form(True),
+    pack_size: int = Form(1),
+    hedge: bool = Form(False),
+    hedge_percentile: float = Form(95.0),
+    hedge_model: Optional[str] = Form(None),
+    fanout_models: Optional[str] = Form(None),
+    deadline_seconds: float = Form(0.0),
+    job_id: Optional[str] = Form(None),
+    engine: str = Form("thread"),
+    output_layout: str = Form("files"),
+    preprocess_backend: str = Form("thread"),
     files: list[UploadFile] = File(...),
 ) -> dict:
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
+    engine = _check_engine(engine)
+    output_layout = _check_output_layout(output_layout)
+    preprocess_backend = _check_preprocess_backend(preprocess_backend)
+    fanout = _parse_fanout(fanout_models)
 
     resolved_prompt = prompt
     if prompt_id:
@@ -53,37 +156,45 @@ async def process_images(
             dst.write_bytes(await f.read())
             image_paths.append(dst)
 
+        options = dict(
+            provider_key=provider,
+            model_key=model,
+            images=image_paths,
+            prompt=resolved_prompt,
+            request_delay=request_delay,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            timeout=timeout,
+            enable_compression=enable_compression,
+            max_workers=max_workers,
+            adaptive_concurrency=adaptive_concurrency,
+            early_stop=early_stop,
+            resume=resume,
+            use_cache=use_cache,
+            pack_size=pack_size,
+            hedge=hedge,
+            hedge_percentile=hedge_percentile,
+            hedge_model=hedge_model or None,
+            fanout_models=fanout,
+            output_layout=output_layout,
+            preprocess_backend=preprocess_backend,
+            verbose=False,
+        )
+        job_id, token = _register_job(job_id, deadline_seconds)
         try:
-            result = get_processor().process(
-                provider_key=provider,
-                model_key=model,
-                images=image_paths,
-                prompt=resolved_prompt,
-                request_delay=request_delay,
-                max_retries=max_retries,
-                retry_delay=retry_delay,
-                timeout=timeout,
-                enable_compression=enable_compression,
-                max_workers=max_workers,
-                verbose=False,
-            )
+            if engine == "async":
+                result = await get_processor().process_async(**options, cancel=token)
+            else:
+                result = await run_in_threadpool(lambda: get_processor().process(**options, cancel=token))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            get_job_registry().remove(job_id)
 
-    try:
-        summary = result.get("summary", {}) if isinstance(result, dict) else {}
-        totals = summary.get("totals", {}) if isinstance(summary, dict) else {}
-        get_config_service().add_task_record(
-            provider=provider,
-            model=model,
-            file_count=int(totals.get("all") or len(files)),
-            success_count=int(totals.get("success") or 0),
-            failed_count=int(totals.get("failed") or 0),
-            output_dir=summary.get("output_dir"),
-        )
-    except Exception:
-        pass
-
+    if fanout:
+        _record_fanout_tasks(result, len(files))
+    else:
+        _record_task(provider, model, result, len(files))
     return result
 
 
@@ -99,10 +210,30 @@ async def process_images_stream(
     timeout: float = Form(60.0),
     enable_compression: bool = Form(True),
     max_workers: int = Form(1),
+    adaptive_concurrency: bool = Form(False),
+    early_stop: bool = Form(False),
+    resume: bool = Form(False),
+    use_cache: bool = Form(True),
+    pack_size: int = Form(1),
+    hedge: bool = Form(False),
+    hedge_percentile: float = Form(95.0),
+    hedge_model: Optional[str] = Form(None),
+    delta_window_ms: float = Form(50.0),
+    delta_max_bytes: int = Form(4096),
+    fanout_models: Optional[str] = Form(None),
+    deadline_seconds: float = Form(0.0),
+    job_id: Optional[str] = Form(None),
+    engine: str = Form("thread"),
+    output_layout: str = Form("files"),
+    preprocess_backend: str = Form("thread"),
     files: list[UploadFile] = File(...),
 ):
     if not files:
         raise HTTPException(status_code=400, detail="未上传文件")
+    engine = _check_engine(engine)
+    output_layout = _check_output_layout(output_layout)
+    preprocess_backend = _check_preprocess_backend(preprocess_backend)
+    fanout = _parse_fanout(fanout_models)
 
     resolved_prompt = prompt
     if prompt_id:
@@ -114,6 +245,7 @@ async def process_images_stream(
     if not resolved_prompt:
         raise HTTPException(status_code=400, detail="prompt 或 prompt_id 必填")
 
+    job_id, token = _register_job(job_id, deadline_seconds)
     tmp_dir = Path(tempfile.mkdtemp(prefix="api_models_connect_stream_"))
     image_paths: list[Path] = []
     try:
@@ -124,114 +256,192 @@ async def process_images_stream(
             image_paths.append(dst)
     except Exception:
         shutil.rmtree(tmp_dir, ignore_errors=True)
+        get_job_registry().remove(job_id)
         raise
 
-    q: "queue.Queue[dict | None]" = queue.Queue()
+    processor = get_processor()
+    # 正常结束后不再因连接关闭而取消
+    finished = threading.Event()
+
+    def run_start_event() -> dict:
+        m = processor.resolve_model(provider, model)
+        return {
+            "event": "run_start",
+            "job_id": job_id,
+            "provider": provider,
+            "model": model,
+            "model_name": m["model_name"],
+            "api_key_env": m["env_key"],
+            "api_base_url": m["api_base_url"],
+            "mode": "streaming",
+            "engine": engine,
+            "max_workers": max_workers,
+            "adaptive_concurrency": adaptive_concurrency,
+            "early_stop": early_stop,
+            "resume": resume,
+            "use_cache": use_cache,
+            "pack_size": pack_size,
+            "output_layout": output_layout,
+            "preprocess_backend": preprocess_backend,
+            "hedge": hedge,
+            "rate_limit": m["rate_limit"],
+            "failover": [t["label"] for t in m["failover"]],
+            "delta_window_ms": delta_window_ms,
+            "delta_max_bytes": delta_max_bytes,
+            "fanout_models": [f"{p}:{m}" for p, m in fanout] if fanout else None,
+            "deadline_seconds": deadline_seconds or None,
+        }
+
+    options = dict(
+        provider_key=provider,
+        model_key=model,
+        images=image_paths,
+        prompt=resolved_prompt,
+        request_delay=request_delay,
+        max_retries=max_retries,
+        retry_delay=retry_delay,
+        timeout=timeout,
+        enable_compression=enable_compression,
+        max_workers=max_workers,
+        adaptive_concurrency=adaptive_concurrency,
+        early_stop=early_stop,
+        delta_window_ms=delta_window_ms,
+        delta_max_bytes=delta_max_bytes,
+        resume=resume,
+        use_cache=use_cache,
+        pack_size=pack_size,
+        hedge=hedge,
+        hedge_percentile=hedge_percentile,
+        hedge_model=hedge_model or None,
+        fanout_models=fanout,
+        output_layout=output_layout,
+        preprocess_backend=preprocess_backend,
+        verbose=False,
+        cancel=token,
+    )
+
+    def record(result: dict) -> None:
+        if fanout:
+            _record_fanout_tasks(result, len(image_paths))
+        else:
+            _record_task(provider, model, result, len(image_paths))
+
+    def encode(ev: dict) -> bytes:
+        return (json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def done_events(result: dict) -> list[dict]:
+        events = [{"event": "cancelled", "job_id": job_id, "reason": token.reason}] if token.cancelled else []
+        return events + [{"event": "done", "result": result}]
+
+    def release_job() -> None:
+        finished.set()
+        get_job_registry().remove(job_id)
+
+    def cancel_on_disconnect() -> None:
+        """响应生成器提前结束（客户端断开）时取消任务，在途请求随之关闭"""
+        if not finished.is_set():
+            token.cancel(REASON_CLIENT_DISCONNECTED)
+
+    headers = {"X-Job-Id": job_id}
+
+    if engine == "async":
+        async def run_job(emit: Callable[[dict], None]) -> None:
+            try:
+                emit(run_start_event())
+                result = await processor.process_async(**options, emit=emit)
+                await asyncio.to_thread(record, result)
+                for ev in done_events(result):
+                    emit(ev)
+            except Exception as e:
+                emit({"event": "fatal", "error": str(e)})
+            finally:
+                release_job()
+                await asyncio.to_thread(shutil.rmtree, tmp_dir, True)
+                emit(None)
+
+        async def iter_events_async():
+            aq: "asyncio.Queue[dict | None]" = asyncio.Queue()
+            job = asyncio.create_task(run_job(aq.put_nowait))
+            _BACKGROUND_JOBS.add(job)
+            job.add_done_callback(_BACKGROUND_JOBS.discard)
+            try:
+                while True:
+                    ev = await aq.get()
+                    if ev is None:
+                        break
+                    yield encode(ev)
+            finally:
+                cancel_on_disconnect()
+
+        return StreamingResponse(
+            iter_events_async(), media_type="application/x-ndjson; charset=utf-8", headers=headers,
+        )
 
-    def emit(ev: dict) -> None:
-        q.put(ev)
+    # thread 引擎：后台线程运行同步处理器，事件经 queue.Queue 转交给响应生成器
+    q: "queue.Queue[dict | None]" = queue.Queue()
 
     def worker() -> None:
-        from backend.core.config_loader import get_model, get_provider
+        from backend.core.local.checkpoint import new_run_id
         from backend.core.local.cloud_processor import process_images_with_cloud_api
-        from backend.core.local.result_handler import get_latest_output_file_path
 
-        processor = get_processor()
         session_dir: Optional[Path] = None
         try:
+            if fanout:
+                # 多模型对比：Processor 负责 session 目录、共享预处理与各模型并发
+                q.put(run_start_event())
+                result = processor.process(**options, emit=q.put)
+                record(result)
+                for ev in done_events(result):
+                    q.put(ev)
+                return
             session_dir = processor._prepare_session_dir(image_paths)
+            m = processor.resolve_model(provider, model)
+            run_id = new_run_id()
+            q.put(run_start_event())
 
-            provider_cfg = get_provider(provider)
-            model_cfg = get_model(provider, model)
-
-            model_name = model_cfg["name"]
-            model_info = model_cfg.get("info")
-            api_base_url = model_cfg.get("api_base_url")
-            provider_defaults = (
-                provider_cfg.get("info", {}).get("defaults", {})
-                if isinstance(provider_cfg.get("info"), dict)
-                else {}
-            )
-            env_key = model_cfg.get("env_key") or provider_defaults.get("env_key", "API_KEY")
-
-            emit(
-                {
-                    "event": "run_start",
-                    "provider": provider,
-                    "model": model,
-                    "model_name": model_name,
-                    "api_key_env": env_key,
-                    "api_base_url": api_base_url,
-                    "mode": "streaming",
-                }
-            )
-
-            success_count, fail_count, output_dir = process_images_with_cloud_api(
-                model_name=model_name,
-                model_info=model_info,
+            _, _, output_dir = process_images_with_cloud_api(
+                model_name=m["model_name"],
+                model_info=m["model_info"],
                 input_dir=str(session_dir),
                 prompt=resolved_prompt,
                 request_delay=request_delay,
                 max_retries=max_retries,
                 retry_delay=retry_delay,
-                api_base_url=api_base_url,
+                api_base_url=m["api_base_url"],
                 timeout=timeout,
                 enable_compression=enable_compression,
                 verbose=False,
                 max_workers=max_workers,
-                api_key_env=env_key,
+                adaptive_concurrency=adaptive_concurrency,
+                early_stop=early_stop,
+                delta_window_ms=delta_window_ms,
+                delta_max_bytes=delta_max_bytes,
+                rate_limits=m["rate_limit"],
+                failover=m["failover"],
+                resume=resume,
+                use_cache=use_cache,
+                pack_size=pack_size,
+                hedge=hedge,
+                hedge_percentile=hedge_percentile,
+                hedge_model=hedge_model or None,
+                api_key_env=m["env_key"],
                 use_streaming=True,
                 enable_streaming_print=False,
-                emit=emit,
+                emit=q.put,
+                cancel=token,
+                output_layout=output_layout,
+                preprocess_backend=preprocess_backend,
+                run_id=run_id,
             )
 
-            summary_data: dict = {}
-            per_image_payloads: list[dict] = []
-            summary_path = output_dir / "run_summary.json"
-            if summary_path.is_file():
-                summary_data = json.loads(summary_path.read_text(encoding="utf-8"))
-                summary_data.setdefault("output_dir", str(output_dir.resolve()))
-                for record in summary_data.get("images", []) or []:
-                    image_name = record.get("image_name") or ""
-                    image_stem = Path(image_name).stem if image_name else ""
-                    latest_output = (
-                        get_latest_output_file_path(output_dir, image_stem, extension=".json")
-                        if image_stem
-                        else None
-                    )
-                    if latest_output:
-                        record["output_file"] = str(latest_output)
-
-                    output_file = record.get("output_file")
-                    if output_file:
-                        payload_path = Path(output_file)
-                        if payload_path.is_file():
-                            try:
-                                payload = json.loads(payload_path.read_text(encoding="utf-8"))
-                                payload["_output_file"] = str(payload_path)
-                                per_image_payloads.append(payload)
-                            except json.JSONDecodeError:
-                                continue
-
-            result = {"summary": summary_data, "results": per_image_payloads}
-
-            try:
-                totals = summary_data.get("totals", {}) if isinstance(summary_data, dict) else {}
-                get_config_service().add_task_record(
-                    provider=provider,
-                    model=model,
-                    file_count=int(totals.get("all") or len(image_paths)),
-                    success_count=int(totals.get("success") or success_count),
-                    failed_count=int(totals.get("failed") or fail_count),
-                    output_dir=summary_data.get("output_dir"),
-                )
-            except Exception:
-                pass
-
-            emit({"event": "done", "result": result})
+            result = processor.collect_results(output_dir, run_id)
+            record(result)
+            for ev in done_events(result):
+                q.put(ev)
         except Exception as e:
-            emit({"event": "fatal", "error": str(e)})
+            q.put({"event": "fatal", "error": str(e)})
         finally:
+            release_job()
             try:
                 shutil.rmtree(tmp_dir, ignore_errors=True)
             except Exception:
@@ -245,11 +455,24 @@ async def process_images_stream(
 
     threading.Thread(target=worker, daemon=True).start()
 
-    def iter_events():
-        while True:
-            ev = q.get()
-            if ev is None:
-                break
-            yield (json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8")
+    async def iter_events():
+        # 在线程池中等待事件：客户端断开时生成器被关闭，finally 中取消任务
+        try:
+            while True:
+                ev = await run_in_threadpool(q.get)
+                if ev is None:
+                    break
+                yield encode(ev)
+        finally:
+            cancel_on_disconnect()
+
+    return StreamingResponse(iter_events(), media_type="application/x-ndjson; charset=utf-8", headers=headers)
+
 
-    return StreamingResponse(iter_events(), media_type="application/x-ndjson; charset=utf-8")
+@router.delete("/tasks/{job_id}")
+async def cancel_task(job_id: str) -> dict:
+    """取消进行中的任务：未开始的图片不再请求，在途的流立即关闭"""
+    token = get_job_registry().cancel(job_id)
+    if token is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已结束")
+    return {"job_id": job_id, "cancelled": True, "reason": token.reason}
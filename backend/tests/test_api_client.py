@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+请求调度组件回归测试
+
+验证：
+1. AIMD 自适应并发：慢启动每次成功 +1，过载时乘性减且冷却期内只减一次，之后按窗口加性增
+2. TTFT 超过同一 (端点, 模型) 基线的 ttft_inflation 倍时降并发，慢样本不抬高基线
+3. 令牌桶按速率补充且不超过容量；QuotaRateLimiter.settle 按实际用量多退少补并更新估算
+4. 熔断器 closed → open → half_open（只放行一个探测）→ closed，探测失败重新 open
+5. FailoverRouter 在主端点熔断时选择备用路由，全部熔断时抛出 CircuitOpenError
+
+运行方式：
+    python -m pytest -q tests/test_api_client.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.api_client import (  # noqa: E402
+    AdaptiveConcurrencyController, CircuitBreaker, CircuitOpenError, QuotaRateLimiter, RateLimits, TokenBucket,
+)
+from backend.core.local.failover import FailoverRouter, Route  # noqa: E402
+
+KEY = "http://x"
+
+
+def _round_trip(controller, outcome, ttft=None, model="m", ceiling=8):
+    """占用一个名额后立即按 outcome 释放，返回上限变化"""
+    controller.acquire(KEY, ceiling)
+    return controller.release(KEY, outcome, ttft, model=model)
+
+
+def test_aimd_increase_and_decrease():
+    """测试1：慢启动、乘性减、冷却与加性增"""
+    controller = AdaptiveConcurrencyController(cooldown_s=60.0)
+    for _ in range(3):
+        _round_trip(controller, "success")
+    assert controller.limit(KEY) == 4
+
+    change = _round_trip(controller, "overload")
+    assert change == {"limit": 2, "previous_limit": 4, "reason": "throttled"}
+    # 同一波拥塞只减一次
+    assert _round_trip(controller, "overload") is None and controller.limit(KEY) == 2
+
+    # 慢启动结束后每次成功 +1/limit，约一个窗口（limit 次成功）+1
+    _round_trip(controller, "success")
+    _round_trip(controller, "success")
+    assert controller.limit(KEY) == 2
+    assert _round_trip(controller, "success")["reason"] == "increase"
+    assert controller.limit(KEY) == 3
+    # 其它错误不调整
+    assert _round_trip(controller, "error") is None and controller.limit(KEY) == 3
+    snapshot = controller.snapshot(KEY, "m")
+    assert snapshot["decreases"] == 1 and snapshot["peak_limit"] == 4 and snapshot["in_flight"] == 0
+
+
+def test_aimd_ceiling():
+    """测试2：上限不超过 ceiling"""
+    controller = AdaptiveConcurrencyController()
+    for _ in range(10):
+        _round_trip(controller, "success", ceiling=3)
+    assert controller.limit(KEY) == 3
+
+
+def test_aimd_ttft_inflation():
+    """测试3：TTFT 膨胀时降并发，慢样本不计入基线；不同模型的基线互不影响"""
+    controller = AdaptiveConcurrencyController(cooldown_s=60.0, ttft_inflation=2.0)
+    for _ in range(3):
+        _round_trip(controller, "success", ttft=0.1)
+    assert controller.limit(KEY) == 4
+
+    change = _round_trip(controller, "success", ttft=0.5)
+    assert change == {"limit": 2, "previous_limit": 4, "reason": "ttft_inflation"}
+    assert controller.snapshot(KEY, "m")["ttft_baseline_seconds"] == 0.1
+
+    # 另一个模型首个样本只建立基线，不与 m 的基线比较（不降并发）
+    _round_trip(controller, "success", ttft=0.5, model="slow")
+    assert controller.limit(KEY) == 2 and controller.snapshot(KEY, "m")["decreases"] == 1
+    assert controller.snapshot(KEY, "slow")["ttft_baseline_seconds"] == 0.5
+
+
+def test_token_bucket_refill():
+    """测试4：令牌桶预约式扣减与按时间补充"""
+    bucket = TokenBucket(rate_per_s=10.0, capacity=20.0)
+    now = bucket._updated
+    assert bucket.reserve(15, now) == 0.0
+    # 余额 5，再扣 10 需等待 0.5s
+    assert abs(bucket.reserve(10, now) - 0.5) < 1e-9
+    bucket._refill(now + 1.0)
+    assert abs(bucket.level - 5.0) < 1e-9
+    # 补充不超过容量
+    bucket._refill(now + 100.0)
+    assert bucket.level == 20.0
+    # 超过容量的请求按容量扣减
+    assert bucket.reserve(50, now + 100.0) == 0.0 and bucket.level == 0.0
+
+
+def test_quota_settle():
+    """测试5：settle 按实际用量修正预扣并更新估算，未报告用量时保留预扣"""
+    quota = QuotaRateLimiter(usage_alpha=0.5)
+    limits = RateLimits(tpm=6000, estimated_tokens=1000)
+    key = "http://x|m"
+    _, reserved = quota.reserve(key, limits)
+    assert reserved == 1000
+    level = quota._states[key].tokens.level
+    assert 5000 - 1 <= level <= 5000 + 1
+
+    # 实际只用 400：退还 600，估算向实际用量靠拢
+    quota.settle(key, reserved, 400)
+    assert 5600 - 1 <= quota._states[key].tokens.level <= 5600 + 1
+    snapshot = quota.snapshot(key)
+    assert snapshot["usage_reports"] == 1 and snapshot["tokens_used"] == 400
+    assert snapshot["token_estimate"] == 700
+
+    # 下一次按新的估算预扣；超出估算时追加扣减
+    _, reserved = quota.reserve(key, limits)
+    assert reserved == 700
+    quota.settle(key, reserved, 1700)
+    assert 3900 - 1 <= quota._states[key].tokens.level <= 3900 + 1
+
+    # 接口未报告用量：不修正
+    _, reserved = quota.reserve(key, limits)
+    level = quota._states[key].tokens.level
+    quota.settle(key, reserved, None)
+    assert abs(quota._states[key].tokens.level - level) < 1.0
+    assert quota.snapshot(key)["usage_reports"] == 2
+
+
+def test_circuit_breaker_transitions():
+    """测试6：熔断器状态转换"""
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_s=0.1)
+    assert breaker.allow(KEY)
+    assert breaker.record(KEY, "failure") is None
+    # 与端点健康无关的结果不计数、不清零
+    assert breaker.record(KEY, "neutral") is None
+    change = breaker.record(KEY, "failure")
+    assert change == {"endpoint": KEY, "state": "open", "previous_state": "closed", "failures": 2}
+    assert not breaker.allow(KEY) and breaker.retry_in(KEY) > 0
+
+    time.sleep(0.12)
+    # half_open：只放行一个探测请求
+    assert breaker.allow(KEY) and breaker.state(KEY) == "half_open"
+    assert not breaker.allow(KEY)
+    # 探测失败重新 open
+    assert breaker.record(KEY, "failure")["state"] == "open"
+    assert not breaker.allow(KEY)
+
+    time.sleep(0.12)
+    assert breaker.allow(KEY)
+    assert breaker.record(KEY, "success")["state"] == "closed"
+    assert breaker.allow(KEY) and breaker.allow(KEY)
+    snapshot = breaker.snapshot(KEY)
+    assert snapshot["opened_count"] == 2 and snapshot["consecutive_failures"] == 0 and snapshot["rejected"] == 3
+
+
+def test_router_pick_while_open():
+    """测试7：主端点熔断时选择备用路由，全部熔断时抛出 CircuitOpenError"""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_s=60.0)
+    primary = Route(label="main", model_name="m", api_base_url="http://a", api_key="k", primary=True)
+    backup = Route(label="backup", model_name="b", api_base_url="http://b", api_key="k")
+    router = FailoverRouter(primary, [backup], breaker=breaker)
+    assert router.pick() is primary
+
+    breaker.record("http://a", "failure")
+    assert router.pick() is backup
+    assert router.failover_event(backup)["reason"] == "circuit_open"
+
+    breaker.record("http://b", "failure")
+    try:
+        router.pick()
+    except CircuitOpenError as exc:
+        assert exc.key == "http://a" and 0 < exc.retry_after <= 60.0
+    else:
+        raise AssertionError("全部熔断时应抛出 CircuitOpenError")
+    summary = router.summary()
+    assert summary["routed"] == {"backup": 1} and summary["breakers"]["http://a"]["state"] == "open"
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
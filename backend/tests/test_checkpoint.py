@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+断点续跑检查点回归测试
+
+验证：
+1. 不续跑时规划阶段不计算图片哈希，追加清单时才按需计算（每张最多一次）
+2. 批内去重只计算大小相同的图片的哈希
+3. resume 读取清单时压缩被覆盖的旧行，同一 (key, 图片名) 只保留最后一行，续跑结果不变
+
+运行方式：
+    python -m pytest -q tests/test_checkpoint.py
+"""
+
+import json
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local import checkpoint as checkpoint_module  # noqa: E402
+from backend.core.local.checkpoint import MANIFEST_FILENAME, plan_checkpoint  # noqa: E402
+from backend.core.local.cloud_processor import _split_duplicates  # noqa: E402
+
+
+def _images(root, contents):
+    paths = []
+    for name, data in contents.items():
+        path = root / name
+        path.write_bytes(data)
+        paths.append(path)
+    return paths
+
+
+@contextmanager
+def _count_hashes():
+    """记录 file_sha256 计算过哪些图片"""
+    calls = []
+    original = checkpoint_module.file_sha256
+
+    def counting(path):
+        calls.append(Path(path).name)
+        return original(path)
+
+    checkpoint_module.file_sha256 = counting
+    try:
+        yield calls
+    finally:
+        checkpoint_module.file_sha256 = original
+
+
+def test_lazy_hashing_without_resume():
+    """测试1：不续跑时规划不读图片，record 时只计算该图片的哈希"""
+    with _count_hashes() as calls, tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        images = _images(root, {"a.png": b"aaa", "b.png": b"bbbb"})
+        plan = plan_checkpoint(root / "out", images, prompt="p", model_name="m", resume=False)
+        assert calls == [] and len(plan.pending()) == 2
+        plan.record(1, {"image_name": "a.png", "status": "success", "output_file": "a.json"})
+        plan.record(1, {"image_name": "a.png", "status": "success", "output_file": "a.json"})
+        assert calls == ["a.png"]
+
+
+def test_dedup_hashes_same_size_only():
+    """测试2：只有大小相同的图片参与哈希比较"""
+    with _count_hashes() as calls, tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        images = _images(root, {"a.png": b"same", "b.png": b"same", "c.png": b"diff", "d.png": b"longer"})
+        plan = plan_checkpoint(root / "out", images, prompt="p", model_name="m", resume=False)
+        unique, duplicates = _split_duplicates(plan.pending(), plan)
+        assert [idx for idx, _ in unique] == [1, 3, 4]
+        assert [idx for idx, _ in duplicates[1]] == [2]
+        assert sorted(calls) == ["a.png", "b.png", "c.png"]
+
+
+def test_compact_on_load():
+    """测试3：多次运行覆盖的旧行在 resume 时被压缩，续跑仍跳过已成功的图片"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        out = root / "out"
+        out.mkdir()
+        images = _images(root, {"a.png": b"aaa", "b.png": b"aaa", "c.png": b"ccc"})
+        for status in ("failed", "failed", "success"):
+            plan = plan_checkpoint(out, images, prompt="p", model_name="m", resume=False)
+            for idx, img in plan.pending():
+                output_file = out / f"{img.stem}_结果.json"
+                output_file.write_text("{}", encoding="utf-8")
+                plan.record(idx, {"image_name": img.name, "status": status, "output_file": str(output_file)})
+        manifest_path = out / MANIFEST_FILENAME
+        assert len(manifest_path.read_text(encoding="utf-8").splitlines()) == 9
+
+        plan = plan_checkpoint(out, images, prompt="p", model_name="m", resume=True)
+        lines = [json.loads(line) for line in manifest_path.read_text(encoding="utf-8").splitlines()]
+        # a、b 内容相同（同一 key），按图片名各保留一行
+        assert sorted(e["image_name"] for e in lines) == ["a.png", "b.png", "c.png"]
+        assert all(e["status"] == "success" for e in lines)
+        assert sorted(plan.resumed) == [1, 2, 3]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+对冲竞速回归测试
+
+验证：
+1. 主请求先出首个 token 时不发对冲请求
+2. 主请求迟迟没有首个 token 时发出对冲请求，先出 token 的一路胜出，另一路被关闭
+3. 竞速等待期间任务取消：立即抛出 CancelledRunError，所有在途的一路都被关闭
+4. 对冲的 TPM 预扣：胜出一路留待按实际用量结算，落败一路退还，竞速结束后才拿到的预扣立即退还
+
+运行方式：
+    python -m pytest -q tests/test_hedging.py
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.api_client import QuotaRateLimiter, RateLimits  # noqa: E402
+from backend.core.local.cancellation import CancelToken, CancelledRunError  # noqa: E402
+from backend.core.local.cloud_processor import _settle_race_quota  # noqa: E402
+from backend.core.local.hedging import HedgeReservation, HedgeStats, race_first_token  # noqa: E402
+
+
+class _Stream:
+    """首个 chunk 前等待 delay 秒的假流；close() 打断等待"""
+
+    def __init__(self, text, delay):
+        self.text = text
+        self.delay = delay
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        if self.closed.wait(self.delay):
+            raise RuntimeError("stream closed")
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.text))])
+
+    def close(self):
+        self.closed.set()
+
+
+def _race(primary, hedge, cancel=None, hedge_after=0.1):
+    stats = HedgeStats(percentile=95, hedge_model=None)
+    race = race_first_token(
+        lambda: primary, lambda: hedge,
+        primary_model="m", hedge_model="m-backup", hedge_after=hedge_after, stats=stats, cancel=cancel,
+    )
+    return race, stats
+
+
+def test_primary_wins_without_hedge():
+    """测试1：主请求在阈值内出 token"""
+    primary, hedge = _Stream("a", 0.0), _Stream("b", 0.0)
+    race, stats = _race(primary, hedge, hedge_after=1.0)
+    assert race.name == "primary" and stats.hedged == 0 and stats.requests == 1
+
+
+def test_hedge_wins():
+    """测试2：主请求慢时对冲请求胜出，主请求被关闭"""
+    primary, hedge = _Stream("a", 5.0), _Stream("b", 0.0)
+    race, stats = _race(primary, hedge)
+    assert race.name == "hedge" and race.model == "m-backup"
+    assert stats.hedged == 1 and stats.hedge_wins == 1
+    assert primary.closed.wait(1.0)
+
+
+def test_cancel_during_race():
+    """测试3：两路都在等待首个 token 时取消任务"""
+    primary, hedge = _Stream("a", 30.0), _Stream("b", 30.0)
+    cancel = CancelToken()
+    threading.Timer(0.3, cancel.cancel).start()
+    t0 = time.monotonic()
+    try:
+        _race(primary, hedge, cancel=cancel)
+    except CancelledRunError:
+        pass
+    else:
+        raise AssertionError("取消后应抛出 CancelledRunError")
+    assert time.monotonic() - t0 < 2.0
+    assert primary.closed.is_set() and hedge.closed.is_set()
+
+
+def test_cancel_before_race():
+    """测试4：已取消的任务不再等待"""
+    cancel = CancelToken()
+    cancel.cancel()
+    try:
+        _race(_Stream("a", 30.0), _Stream("b", 30.0), cancel=cancel)
+    except CancelledRunError:
+        pass
+    else:
+        raise AssertionError("取消后应抛出 CancelledRunError")
+
+
+def _quota():
+    """TPM 600、每次预扣 100 的配额，返回 (limiter, key, limits)"""
+    limits = RateLimits(tpm=600, estimated_tokens=100)
+    return QuotaRateLimiter(), "http://x|m", limits
+
+
+def _level(quota, key):
+    return quota._states[key].tokens.level
+
+
+def test_hedge_wins_refunds_primary():
+    """测试5：对冲胜出时退还主请求的预扣，返回对冲的预扣供结算"""
+    quota, key, limits = _quota()
+    hedge_key = "http://x|m-backup"
+    _, primary_tokens = quota.reserve(key, limits)
+    reservation = HedgeReservation(quota)
+    _, hedge_tokens = quota.reserve(hedge_key, limits)
+    assert reservation.hold(hedge_key, hedge_tokens)
+    winner = _settle_race_quota(quota, SimpleNamespace(hedge=True), (key, primary_tokens), reservation.take())
+    assert winner == (hedge_key, 100)
+    assert _level(quota, key) >= 600 - 1
+    assert _level(quota, hedge_key) <= 500 + 1
+
+
+def test_primary_wins_refunds_hedge():
+    """测试6：主请求胜出时退还对冲的预扣"""
+    quota, key, limits = _quota()
+    hedge_key = "http://x|m-backup"
+    _, primary_tokens = quota.reserve(key, limits)
+    reservation = HedgeReservation(quota)
+    _, hedge_tokens = quota.reserve(hedge_key, limits)
+    reservation.hold(hedge_key, hedge_tokens)
+    winner = _settle_race_quota(quota, SimpleNamespace(hedge=False), (key, primary_tokens), reservation.take())
+    assert winner == (key, 100)
+    assert _level(quota, hedge_key) >= 600 - 1
+    # 退还不计入用量统计
+    assert quota.snapshot(hedge_key)["usage_reports"] == 0
+
+
+def test_late_hold_is_refunded():
+    """测试7：竞速结束后才拿到配额的对冲请求立即退还"""
+    quota, key, limits = _quota()
+    reservation = HedgeReservation(quota)
+    assert reservation.take() is None
+    _, tokens = quota.reserve(key, limits)
+    assert not reservation.hold(key, tokens)
+    assert _level(quota, key) >= 600 - 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
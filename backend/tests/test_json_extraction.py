@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+流式 JSON 提取回归测试
+
+验证：
+1. 说明文字中的 [1] 引用、{} 示例不会被当作答案提前采用
+2. ```json 围栏内、或开头只有空白的 JSON 在闭合时立即得到
+3. 未能提前采用时，整段文本回退解析优先取围栏内的 JSON
+4. 任意分块方式喂入，结果一致
+
+运行方式：
+    python -m pytest -q tests/test_json_extraction.py
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.result_handler import IncrementalJSONExtractor  # noqa: E402
+from backend.core.local.stream_session import _extract_json_from_text  # noqa: E402
+
+
+def _feed(text, chunk_size=None):
+    """按 chunk_size 分块喂入，返回提取器"""
+    extractor = IncrementalJSONExtractor()
+    step = chunk_size or len(text)
+    for start in range(0, len(text), step):
+        extractor.feed(text[start:start + step])
+    return extractor
+
+
+def _final_value(text, chunk_size=None):
+    """与 StreamSession.parse 一致：提前采用的值优先，否则整段回退解析"""
+    extractor = _feed(text, chunk_size)
+    if extractor.done:
+        return extractor.value
+    return _extract_json_from_text(text)
+
+
+def test_bracketed_citation_before_fence():
+    """测试1：说明文字中的 [1] 引用不是答案"""
+    text = '依据图例 [1] 的说明，结果如下：\n```json\n{"a": 1}\n```'
+    for chunk_size in (None, 1, 3, 7):
+        extractor = _feed(text, chunk_size)
+        assert extractor.done and extractor.value == {"a": 1}
+
+
+def test_example_object_before_fence():
+    """测试2：说明文字中的 {} 示例不是答案"""
+    text = '格式示例：{"name": "..."}，实际输出：\n```json\n{"name": "保修卡"}\n```'
+    for chunk_size in (None, 1, 5):
+        assert _final_value(text, chunk_size) == {"name": "保修卡"}
+
+
+def test_prose_without_fence_falls_back():
+    """测试3：没有围栏时不提前采用说明文字后的值，由整段回退解析"""
+    text = '参见 [1]。结果：{"a": 1}'
+    extractor = _feed(text)
+    assert not extractor.done
+    assert _final_value(text) == _extract_json_from_text(text)
+
+
+def test_leading_json():
+    """测试4：开头只有空白的 JSON 在闭合时立即得到，后续文本不再扫描"""
+    text = '\n  {"items": [1, {"b": "}"}]}\n以上为识别结果 [1]'
+    for chunk_size in (None, 1, 4):
+        extractor = _feed(text, chunk_size)
+        assert extractor.done and extractor.value == {"items": [1, {"b": "}"}]}
+
+
+def test_long_preamble_before_fence():
+    """测试5：长说明文字之后的围栏仍能识别"""
+    text = "说明" * 100 + '\n```json\n[{"a": 1}]\n```'
+    for chunk_size in (None, 1, 9):
+        extractor = _feed(text, chunk_size)
+        assert extractor.done and extractor.value == [{"a": 1}]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
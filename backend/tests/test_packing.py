@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+多图打包响应拆分测试
+
+验证：
+1. 按 image_index 对应（顺序任意），包装对象不会被当作结果
+2. 部分元素缺少或带有无效 image_index 时，只采用编号有效的元素，其余位置回退为单图请求
+3. 编号重复、越界、缺少 result 的位置回退
+4. 没有任何 image_index 时，长度恰好为 count 才按位置对应
+
+运行方式：
+    python -m pytest -q tests/test_packing.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.packing import split_packed_output  # noqa: E402
+
+
+def _split(items, count):
+    return split_packed_output("```json\n" + json.dumps(items, ensure_ascii=False) + "\n```", count)
+
+
+def test_keyed_out_of_order():
+    """测试1：按 image_index 对应，与元素顺序无关"""
+    items = [{"image_index": 2, "result": {"v": 2}}, {"image_index": 1, "result": {"v": 1}}]
+    assert _split(items, 2) == {1: {"v": 1}, 2: {"v": 2}}
+
+
+def test_partially_keyed():
+    """测试2：有一个元素缺少 image_index 时不退回按位置对应，也不保存包装对象"""
+    items = [
+        {"image_index": 2, "result": {"v": 2}},
+        {"image_index": 1, "result": {"v": 1}},
+        {"result": {"v": 3}},
+    ]
+    assert _split(items, 3) == {1: {"v": 1}, 2: {"v": 2}}
+
+
+def test_invalid_slots_fall_back():
+    """测试3：编号无效、越界、重复或缺少 result 的位置都不采用"""
+    items = [
+        {"image_index": "1", "result": {"v": 1}},
+        {"image_index": 2, "result": {"v": "a"}},
+        {"image_index": 2, "result": {"v": "b"}},
+        {"image_index": 3},
+        {"image_index": 9, "result": {"v": 9}},
+        {"image_index": True, "result": {"v": 4}},
+        {"image_index": "x", "result": {"v": 5}},
+    ]
+    assert _split(items, 5) == {1: {"v": 1}}
+
+
+def test_positional():
+    """测试4：不带 image_index 的结果数组按位置对应，长度不符时全部回退"""
+    assert _split([{"v": 1}, {"v": 2}], 2) == {1: {"v": 1}, 2: {"v": 2}}
+    assert _split([{"result": {"v": 1}}, {"result": {"v": 2}}], 2) == {1: {"v": 1}, 2: {"v": 2}}
+    assert _split([{"v": 1}], 2) == {}
+
+
+def test_wrapped_and_invalid_output():
+    """测试5：外层 {"results": [...]} 可以拆开，无法解析的输出返回空"""
+    wrapped = {"results": [{"image_index": 1, "result": {"v": 1}}, {"image_index": 2, "result": {"v": 2}}]}
+    assert split_packed_output(json.dumps(wrapped), 2) == {1: {"v": 1}, 2: {"v": 2}}
+    assert split_packed_output("nope", 2) == {}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+结果写盘失败回归测试
+
+验证：
+1. 写入失败的结果文件按路径记录，各次运行只取走自己输出文件的失败（写盘线程为进程级单例）
+2. 同一路径之后写入成功时，失败记录清除
+3. 运行汇总把写入失败的图片改记为失败并修正 totals，run_summary 中列出失败的文件
+
+运行方式：
+    python -m pytest -q tests/test_result_writer.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.result_writer import ResultWriter  # noqa: E402
+from backend.core.local.run_summary import RunSummaryWriter, read_run_summary  # noqa: E402
+
+
+def _blocked(path):
+    """在目标路径放一个非空目录，使 os.replace 失败"""
+    path.mkdir(parents=True)
+    (path / "keep").write_text("x")
+    return path
+
+
+def test_failures_scoped_by_path():
+    """测试1：A、B 两次运行各自只拿到自己的写入失败"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        writer = ResultWriter()
+        ok_a = root / "a" / "ok_结果.json"
+        bad_a = _blocked(root / "a" / "bad_结果.json")
+        bad_b = _blocked(root / "b" / "bad_结果.json")
+        for path in (ok_a, bad_a, bad_b):
+            writer.submit(path, {"result": path.name})
+        writer.flush()
+
+        failures_a = writer.take_failures([str(ok_a), str(bad_a)])
+        assert list(failures_a) == [str(bad_a)]
+        snapshot = writer.snapshot(failures_a)
+        assert snapshot["errors"] == 1 and snapshot["failed_files"] == [str(bad_a)]
+        # 已取走的不会重复出现；B 的失败仍在
+        assert writer.take_failures([bad_a]) == {}
+        assert list(writer.take_failures([bad_b])) == [str(bad_b)]
+
+
+def test_later_success_clears_failure():
+    """测试2：同一路径重写成功后不再计为失败"""
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = ResultWriter()
+        path = _blocked(Path(tmp) / "img_结果.json")
+        writer.submit(path, {"result": 1})
+        writer.flush()
+        (path / "keep").unlink()
+        path.rmdir()
+        writer.submit(path, {"result": 2})
+        writer.flush()
+        assert writer.take_failures([path]) == {}
+
+
+def test_summary_marks_write_failures():
+    """测试3：运行汇总中写入失败的图片改记为失败"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        summary = RunSummaryWriter(output_dir, {"run_id": "A"})
+        for i, name in enumerate(("ok", "bad"), 1):
+            summary.add({
+                "index": i, "image_name": f"{name}.png", "status": "success",
+                "output_file": str(output_dir / f"{name}_结果.json"),
+            })
+        failures = {str(output_dir / "bad_结果.json"): "disk full"}
+        changed = summary.mark_failed(failures)
+        assert [r["index"] for r in changed] == [2] and changed[0]["error_kind"] == "write_failed"
+        assert summary.totals() == {"success": 1, "failed": 1, "all": 2}
+        # 重写后仍可继续追加
+        summary.add({"index": 3, "image_name": "late.png", "status": "failed", "output_file": "late.json"})
+        summary.close({"totals": summary.totals()})
+
+        records = read_run_summary(output_dir, run_id="A")["images"]
+        assert [r["status"] for r in records] == ["success", "failed", "failed"]
+        assert "disk full" in records[1]["error"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
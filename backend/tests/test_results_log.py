@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+results.jsonl 索引重建回归测试
+
+验证：
+1. 没有 results.index.json 时逐行扫描重建索引
+2. 未写入的空洞（\\x00，无换行）之后的记录不丢失，按实际偏移读取
+3. 写了一半的行后接空洞时，其后的记录同样可读
+4. 运行结束（close）后注销正在写入的登记，只读打开的 results.jsonl 按最近使用最多保留 READ_CACHE_SIZE 个
+
+运行方式：
+    python -m pytest -q tests/test_results_log.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local import results_log  # noqa: E402
+from backend.core.local.results_log import (  # noqa: E402
+    READ_CACHE_SIZE, ResultsLog, active_results_log, get_results_log, open_results_log,
+)
+
+
+def _write_log(run_dir, skip=(), torn=()):
+    """按分配的偏移写入 a/b/c 三条结果；skip 中的不写入（留下空洞），torn 中的只写一半，不写索引文件"""
+    writer = ResultsLog(run_dir, writable=True)
+    for name in ("a", "b", "c"):
+        offset, data = writer.allocate(f"{name}_结果.json", {"status": "success", "result": {"name": name}})
+        if name in skip:
+            continue
+        if name in torn:
+            data = data[:len(data) // 2]
+        writer.write_at(offset, data)
+    writer.close()
+    # 模拟中途退出：没有 results.index.json
+    writer.index_path.unlink()
+    return ResultsLog(run_dir)
+
+
+def test_hole_before_valid_line():
+    """测试1：空洞与下一行连成一行时，下一行的记录仍可读取"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log = _write_log(Path(tmp), skip=("b",))
+        assert not log.has("b_结果.json")
+        assert log.read("a_结果.json")["result"] == {"name": "a"}
+        assert log.read("c_结果.json")["result"] == {"name": "c"}
+
+
+def test_torn_line_before_hole():
+    """测试2：写了一半的行跳过，其后空洞之后的记录仍可读取"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log = _write_log(Path(tmp), torn=("a",), skip=("b",))
+        assert not log.has("a_结果.json") and not log.has("b_结果.json")
+        assert log.read("c_结果.json")["result"] == {"name": "c"}
+
+
+def test_complete_log():
+    """测试3：没有损坏时全部记录可读"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log = _write_log(Path(tmp))
+        for name in ("a", "b", "c"):
+            assert log.read(f"{name}_结果.json")["result"] == {"name": name}
+
+
+def test_close_releases_active_log():
+    """测试4：close 后不再是正在写入的 log，按目录读取仍可用（转入只读缓存）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        run_dir = Path(tmp) / "run"
+        log = open_results_log(run_dir)
+        offset, data = log.allocate("a_结果.json", {"result": 1})
+        log.write_at(offset, data)
+        assert active_results_log(run_dir) is log
+        log.close()
+        assert active_results_log(run_dir) is None
+        assert run_dir.resolve() not in results_log._ACTIVE_LOGS
+        assert get_results_log(run_dir).read("a_结果.json")["result"] == 1
+
+
+def test_read_cache_bounded():
+    """测试5：只读打开的 results.jsonl 超出上限时淘汰最久未使用的"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dirs = []
+        for i in range(READ_CACHE_SIZE + 3):
+            run_dir = Path(tmp) / f"run{i}"
+            writer = ResultsLog(run_dir, writable=True)
+            offset, data = writer.allocate("a_结果.json", {"result": i})
+            writer.write_at(offset, data)
+            writer.close()
+            dirs.append(run_dir)
+        for i, run_dir in enumerate(dirs):
+            assert get_results_log(run_dir).read("a_结果.json")["result"] == i
+        assert len(results_log._READ_LOGS) <= READ_CACHE_SIZE
+        assert dirs[0].resolve() not in results_log._READ_LOGS
+        assert dirs[-1].resolve() in results_log._READ_LOGS
+        # 被淘汰的目录再次读取时重新打开
+        assert get_results_log(dirs[0]).read("a_结果.json")["result"] == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
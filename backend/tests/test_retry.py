@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+重试调度回归测试
+
+验证：
+1. classify_error 按状态码 / 异常类型分类，client_error 与 cancelled 不重试
+2. RetryPolicy.decide 的退避时间落在抖动范围内，Retry-After 至少等待且不超过上限
+3. DeferredRetryQueue 按就绪时间弹出，同时就绪时按加入顺序
+4. 串行（1 个工作线程）时失败的图片退避期间先处理下一张，不原地等待
+
+运行方式：
+    python -m pytest -q tests/test_retry.py
+"""
+
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.api_client import CircuitOpenError  # noqa: E402
+from backend.core.local.cancellation import CancelledRunError  # noqa: E402
+from backend.core.local.result_handler import ModelOutputError  # noqa: E402
+from backend.core.local.retry import (  # noqa: E402
+    MAX_RETRY_AFTER_SECONDS, DeferredRetryQueue, RetryDecision, RetryPolicy, classify_error,
+    run_with_deferred_retries,
+)
+
+
+class _StatusError(Exception):
+    """带 status_code 与响应头的假 API 异常"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+def test_classify_error():
+    """测试1：错误分类"""
+    assert classify_error(_StatusError(429)) == "rate_limited"
+    assert classify_error(_StatusError(408)) == "timeout"
+    assert classify_error(_StatusError(503)) == "server_error"
+    assert classify_error(_StatusError(401)) == "client_error"
+    assert classify_error(ReadTimeout()) == "timeout"
+    assert classify_error(ConnectionResetError()) == "connection"
+    assert classify_error(ModelOutputError("bad json")) == "invalid_output"
+    assert classify_error(CircuitOpenError("http://x", 3.0)) == "circuit_open"
+    assert classify_error(CancelledRunError("cancelled_by_user")) == "cancelled"
+    assert classify_error(RuntimeError("?")) == "unknown"
+
+
+def test_non_retryable():
+    """测试2：client_error / cancelled / 超过最大重试次数不重试"""
+    policy = RetryPolicy(max_retries=2, base_delay=1.0)
+    assert not policy.decide(_StatusError(400), 1).retry
+    assert not policy.decide(CancelledRunError("deadline_exceeded"), 1).retry
+    assert policy.decide(_StatusError(500), 2).retry
+    assert not policy.decide(_StatusError(500), 3).retry
+
+
+def test_backoff_jitter_bounds():
+    """测试3：第 n 次退避为 base * 2^(n-1)（不超过 max_delay），乘以 [1 - jitter, 1]"""
+    policy = RetryPolicy(max_retries=10, base_delay=1.0, max_delay=8.0, jitter=0.5)
+    for retry_count, ceiling in ((1, 1.0), (2, 2.0), (3, 4.0), (5, 8.0)):
+        for _ in range(200):
+            delay = policy.decide(_StatusError(503), retry_count).delay
+            assert ceiling * 0.5 <= delay <= ceiling
+    # invalid_output 不做指数退避
+    assert policy.decide(ModelOutputError("bad json"), 5).delay == 1.0
+
+
+def test_retry_after():
+    """测试4：Retry-After 至少等待该时间，异常大的值按上限截断"""
+    policy = RetryPolicy(max_retries=3, base_delay=1.0, jitter=0.0)
+    decision = policy.decide(_StatusError(429, {"retry-after": "7"}), 1)
+    assert decision.delay == 7.0 and decision.retry_after == 7.0
+    assert policy.decide(_StatusError(429, {"retry-after-ms": "2500"}), 1).delay == 2.5
+    assert policy.decide(_StatusError(429, {"retry-after": "86400"}), 1).delay == MAX_RETRY_AFTER_SECONDS
+    # 熔断器给出的探测时间同样生效
+    assert policy.decide(CircuitOpenError("http://x", 3.0), 1).delay == 3.0
+
+
+def test_deferred_queue_order():
+    """测试5：按就绪时间弹出，就绪时间相同时先进先出"""
+    queue = DeferredRetryQueue()
+    queue.push("late", 0.2)
+    queue.push("a", 0.0)
+    queue.push("b", 0.0)
+    assert queue.pop_ready() == "a"
+    assert queue.pop_ready() == "b"
+    assert queue.pop_ready() is None
+    assert 0.0 < queue.next_ready_in() <= 0.2
+    queue.release_all()
+    assert queue.pop_ready() == "late" and len(queue) == 0
+
+
+def test_serial_defers_retry():
+    """测试6：1 个工作线程时，第 1 张失败后先处理第 2、3 张，退避结束再重试第 1 张"""
+    order = []
+    failed = set()
+
+    def attempt(i):
+        def run():
+            order.append(i)
+            if i == 0 and i not in failed:
+                failed.add(i)
+                return RetryDecision(retry=True, kind="server_error", delay=0.2)
+            return {"index": i}
+        return run
+
+    t0 = time.monotonic()
+    results = run_with_deferred_retries([attempt(i) for i in range(3)], max_workers=1)
+    assert order == [0, 1, 2, 0]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert time.monotonic() - t0 >= 0.2
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+运行汇总并发回归测试
+
+验证：
+1. 同一输出目录下两次运行交错写入时，各自的逐图记录互不覆盖
+2. 按 run_id 读取得到本次运行的汇总与记录（运行中与结束后均可）
+3. run_summary.json 只在运行结束时替换，不按 run_id 读取时为最近一次完成的运行
+
+运行方式：
+    python -m pytest -q tests/test_run_summary.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent
+src_root = project_root / "src"
+sys.path.insert(0, str(src_root))
+sys.path.insert(0, str(project_root))
+
+from backend.core.local.run_summary import (  # noqa: E402
+    RunSummaryWriter, read_run_summary, write_summary_file,
+)
+
+
+def _record(index, name):
+    return {"index": index, "image_name": name, "status": "success", "output_file": f"{name}.json"}
+
+
+def _finish(output_dir, writer):
+    """与 cloud_processor._write_run_summary 一致：先写 footer，再替换 run_summary.json"""
+    totals = writer.totals()
+    writer.close({"totals": totals})
+    write_summary_file(output_dir, {
+        "run_id": writer.run_id, "totals": totals, "images_file": str(writer.path.resolve()),
+    })
+
+
+def test_interleaved_runs():
+    """测试1：A 写 3 条，B 开始，A 再写 1 条并结束，B 仍在运行"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        writer_a = RunSummaryWriter(output_dir, {"run_id": "A"})
+        for i in range(1, 4):
+            writer_a.add(_record(i, f"a{i}"))
+        writer_b = RunSummaryWriter(output_dir, {"run_id": "B"})
+        writer_b.add(_record(1, "b1"))
+        writer_a.add(_record(4, "a4"))
+        _finish(output_dir, writer_a)
+
+        summary_a = read_run_summary(output_dir, run_id="A")
+        assert summary_a["run_id"] == "A"
+        assert summary_a["totals"]["all"] == 4
+        assert [r["image_name"] for r in summary_a["images"]] == ["a1", "a2", "a3", "a4"]
+
+        summary_b = read_run_summary(output_dir, run_id="B")
+        assert summary_b["run_id"] == "B" and summary_b["complete"] is False
+        assert [r["image_name"] for r in summary_b["images"]] == ["b1"]
+
+        # 最近一次完成的运行
+        assert read_run_summary(output_dir)["run_id"] == "A"
+
+        _finish(output_dir, writer_b)
+        assert read_run_summary(output_dir)["run_id"] == "B"
+        assert read_run_summary(output_dir, run_id="A")["totals"]["all"] == 4
+        assert b"\x00" not in (output_dir / "run_summary.A.jsonl").read_bytes()
+
+
+def test_unknown_run():
+    """测试2：不存在的 run_id 返回空汇总"""
+    with tempfile.TemporaryDirectory() as tmp:
+        assert read_run_summary(Path(tmp), run_id="missing") == {}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")